@@ -0,0 +1,302 @@
+import sys
+import json
+import time
+import types
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+
+
+# ════════════════════════════════════════
+# S3
+# ════════════════════════════════════════
+
+class Body:
+    """Equivalente mínimo del StreamingBody de boto3."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeS3:
+    """S3 en memoria con la semántica que usa el bot.
+
+    Soporta get/put condicionales (IfNoneMatch / IfMatch), list_objects_v2
+    con StartAfter y paginación, y cuenta llamadas y bytes por operación.
+    latency_ms simula el round-trip de cada llamada.
+    """
+
+    PAGE_SIZE = 1000
+
+    class exceptions:
+        class NoSuchKey(ClientError):
+            def __init__(self):
+                super().__init__({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+    def __init__(self, latency_ms=0):
+        self.objects = {}    # (bucket, key) → (bytes, etag)
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lock = threading.Lock()
+
+    def _call(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _error(code, operation):
+        return ClientError({"Error": {"Code": code}}, operation)
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self._call("GetObject")
+        stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise self.exceptions.NoSuchKey()
+        data, etag = stored
+        if IfNoneMatch == etag:
+            raise self._error("304", "GetObject")
+        with self.lock:
+            self.bytes_in += len(data)
+        return {"Body": Body(data), "ETag": etag, "ContentLength": len(data)}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, IfNoneMatch=None, IfMatch=None, **kwargs):
+        self._call("PutObject")
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        with self.lock:
+            stored = self.objects.get((Bucket, Key))
+            if IfNoneMatch == "*" and stored is not None:
+                raise self._error("PreconditionFailed", "PutObject")
+            if IfMatch is not None and (stored is None or stored[1] != IfMatch):
+                raise self._error("PreconditionFailed", "PutObject")
+            etag = '"%s"' % hashlib.md5(data).hexdigest()
+            self.objects[(Bucket, Key)] = (data, etag)
+            self.bytes_out += len(data)
+        return {"ETag": etag}
+
+    def list_objects_v2(self, Bucket, Prefix="", StartAfter="", ContinuationToken=None, **kwargs):
+        self._call("ListObjectsV2")
+        after = ContinuationToken or StartAfter
+        keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix) and k > after)
+        page = keys[:self.PAGE_SIZE]
+        response = {"Contents": [{"Key": k, "Size": len(self.objects[(Bucket, k)][0])} for k in page]}
+        response["IsTruncated"] = len(keys) > len(page)
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call("DeleteObject")
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def put(self, bucket, key, data):
+        """Siembra un objeto sin contar la llamada."""
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        self.objects[(bucket, key)] = (data, '"%s"' % hashlib.md5(data).hexdigest())
+
+    def size(self, bucket, prefix=""):
+        return sum(len(data) for (b, k), (data, _) in self.objects.items() if b == bucket and k.startswith(prefix))
+
+
+# ════════════════════════════════════════
+# SSM / LAMBDA
+# ════════════════════════════════════════
+
+class FakeSSM:
+    """Parameter Store con valores fijos."""
+
+    def __init__(self, values):
+        self.values = values
+        self.calls = Counter()
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self.calls["GetParameters"] += 1
+        return {
+            "Parameters": [
+                {"Name": name, "Value": self.values[name], "Version": 1}
+                for name in Names if name in self.values
+            ],
+            "InvalidParameters": [name for name in Names if name not in self.values]
+        }
+
+
+class FakeLambda:
+    """Cliente Lambda que registra las invocaciones (no ejecuta nada)."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b""):
+        self.calls["Invoke"] += 1
+        self.invocations.append({"function": FunctionName, "type": InvocationType, "payload": json.loads(Payload or "{}")})
+        return {"StatusCode": 202 if InvocationType == "Event" else 200}
+
+
+class FakeAWS:
+    """Sustituye boto3.client: un cliente por servicio para todo el benchmark."""
+
+    def __init__(self, s3, ssm, lambda_client):
+        self.clients = {"s3": s3, "ssm": ssm, "lambda": lambda_client}
+
+    def client(self, service, *args, **kwargs):
+        return self.clients[service]
+
+    def calls(self):
+        total = Counter()
+        for client in self.clients.values():
+            total.update(client.calls)
+        return total
+
+    def reset_calls(self):
+        for client in self.clients.values():
+            client.calls.clear()
+
+
+# ════════════════════════════════════════
+# TELEGRAM
+# ════════════════════════════════════════
+
+class FakeResponse:
+    def __init__(self, request_body, result):
+        self.status_code = 200
+        self.content = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.text = self.content.decode("utf-8")
+        self.request = types.SimpleNamespace(body=request_body)
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeTelegramSession:
+    """Sustituye la requests.Session de telegram_client. Guarda los mensajes."""
+
+    def __init__(self):
+        self.hooks = {"response": []}
+        self.calls = Counter()
+        self.messages = []
+        self.next_id = 1
+
+    def post(self, url, json=None, timeout=None):
+        method = url.rsplit("/", 1)[-1]
+        self.calls[method] += 1
+        if method == "sendMessage":
+            self.messages.append(json["text"])
+            result = {"message_id": self.next_id}
+            self.next_id += 1
+        else:
+            result = True
+
+        response = FakeResponse(_dumps(json), result)
+        for hook in self.hooks["response"]:
+            hook(response)
+        return response
+
+
+def _dumps(payload):
+    return json.dumps(payload).encode("utf-8")
+
+
+# ════════════════════════════════════════
+# COTIZACIONES (yfinance)
+# ════════════════════════════════════════
+
+def ticker_seed(ticker):
+    return int(hashlib.md5(ticker.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def synthetic_bars(ticker, index):
+    """OHLCV determinista por ticker: paseo aleatorio con volumen > 1M."""
+    rng = np.random.default_rng(ticker_seed(ticker))
+    # El paseo arranca siempre en la misma fecha: descargas incrementales encajan
+    offset = max(0, (index[0] - pd.Timestamp("2020-01-01")).days) if len(index) else 0
+    steps = rng.normal(0.0005, 0.02, offset + len(index))
+    close = 50 * np.exp(np.cumsum(steps))[offset:]
+    spread = np.abs(rng.normal(0, 0.01, len(index))) * close
+    return pd.DataFrame({
+        "Open": close - spread / 2,
+        "High": close + spread,
+        "Low": close - spread,
+        "Close": close,
+        "Adj Close": close,
+        "Volume": rng.integers(1_000_000, 20_000_000, len(index)).astype(float)
+    }, index=index)
+
+
+class FakeQuotes:
+    """Módulo yfinance falso: download() y Ticker().info con datos sintéticos y contador."""
+
+    def __init__(self, history_days=400):
+        self.history_days = history_days
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def download(self, tickers, start=None, period=None, interval="1d", **kwargs):
+        with self.lock:
+            self.calls["download"] += 1
+        if isinstance(tickers, str):
+            tickers = tickers.split()
+
+        end = pd.Timestamp.today().normalize()
+        if start is not None:
+            first = pd.Timestamp(start)
+        elif period == "1d":
+            first = end
+        else:
+            first = end - pd.Timedelta(days=self.history_days)
+        index = pd.bdate_range(first, end)
+
+        frames = {ticker: synthetic_bars(ticker, index) for ticker in tickers}
+        return pd.concat(frames, axis=1)
+
+    def info(self, ticker):
+        """Metadatos deterministas para yf.Ticker(t).info (risk.fetch_info)."""
+        with self.lock:
+            self.calls["info"] += 1
+        sectors = ["Technology", "Healthcare", "Financial Services", "Energy", "Consumer Cyclical"]
+        return {"sector": sectors[sum(map(ord, ticker)) % len(sectors)]}
+
+    def module(self):
+        module = types.ModuleType("yfinance")
+        module.download = self.download
+        module.Ticker = lambda ticker: types.SimpleNamespace(info=self.info(ticker))
+        return module
+
+
+# ════════════════════════════════════════
+# ENTORNO
+# ════════════════════════════════════════
+
+@contextmanager
+def patched(aws, telegram_client, session, quotes):
+    """Conecta los fakes: boto3.client, sesión de Telegram y yfinance."""
+    import boto3
+
+    original_client = boto3.client
+    original_session = telegram_client._session
+    original_yfinance = sys.modules.get("yfinance")
+
+    boto3.client = aws.client
+    telegram_client._session = session
+    sys.modules["yfinance"] = quotes.module()
+    try:
+        yield
+    finally:
+        boto3.client = original_client
+        telegram_client._session = original_session
+        if original_yfinance is None:
+            sys.modules.pop("yfinance", None)
+        else:
+            sys.modules["yfinance"] = original_yfinance
@@ -0,0 +1,351 @@
+"""Benchmark offline de las dos Lambdas.
+
+Ejecuta daily_analysis.lambda_handler y cada rama de process_command del
+telegram_handler contra S3, SSM, Lambda, Telegram y yfinance falsos (en
+memoria) y el modo MOCK_CLAUDE, con historiales sintéticos de 10 a 100k
+trades. Mide latencia (p50/p95), pico de memoria asignada (tracemalloc) y
+llamadas a servicios externos por comando.
+
+Uso:
+    python3 benchmarks/run.py
+    python3 benchmarks/run.py --sizes 10,1000 --repeat 10 --save baseline.json
+    python3 benchmarks/run.py --compare baseline.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import types
+import logging
+import argparse
+import tracemalloc
+import importlib.util
+from contextlib import redirect_stdout
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DAILY_DIR = os.path.join(ROOT, "lambdas", "daily_analysis")
+TELEGRAM_DIR = os.path.join(ROOT, "lambdas", "telegram_handler")
+sys.path[:0] = [DAILY_DIR, TELEGRAM_DIR, os.path.join(ROOT, "lambdas", "shared")]
+
+# Rutas de AWS (no local) para ejercitar S3; antes de importar los handlers
+# para que el .env del desarrollador no cambie el entorno
+os.environ["ENVIRONMENT"] = "aws"
+os.environ["MOCK_CLAUDE"] = "true"
+# Cotizaciones sembradas válidas toda la ejecución: /portfolio y /balance no descargan
+os.environ["QUOTE_TTL_SECONDS"] = "86400"
+# /risk y la etapa var con menos escenarios: se mide el comando, no 1M de caminos
+os.environ.setdefault("MC_PATHS", "100000")
+
+import fakes
+import synthetic
+
+SSM_VALUES = {
+    "/trading-bot/claude-api-key": "sk-benchmark",
+    "/trading-bot/telegram-token": "benchmark-token",
+    "/trading-bot/telegram-chat-id": "1"
+}
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+# (nombre, mensaje, preparación, deshacer). Preparación y deshacer se
+# ejecutan fuera de la medida para que cada repetición parta del mismo estado
+COMMANDS = [
+    ("/help", "/help", None, None),
+    ("/portfolio", "/portfolio", None, None),
+    ("/balance", "/balance", None, None),
+    ("/stats", "/stats", None, None),
+    ("/compro", "/compro NVDA 1 100", None, None),
+    # Las posiciones sintéticas tienen 1000 acciones
+    ("/vendo", "/vendo AAPL 1 150", None, None),
+    ("/tax", "/tax", None, None),
+    ("/risk", "/risk", None, None),
+    ("/blacklist", "/blacklist ZZZZ", None, "/remove_blacklist ZZZZ"),
+    ("/blacklists", "/blacklists", None, None),
+    ("/remove_blacklist", "/remove_blacklist ZZZZ", "/blacklist ZZZZ", None),
+    ("/tip", "/tip ZZZZ Benchmark", None, "/remove_tip ZZZZ"),
+    ("/tips", "/tips", None, None),
+    ("/remove_tip", "/remove_tip ZZZZ", "/tip ZZZZ Benchmark", None),
+    ("/rebuild_stats", "/rebuild_stats", None, None),
+    ("/run", "/run", None, None),
+    ("/unknown", "/unknown", None, None)
+]
+# Escenarios cuya respuesta correcta es un mensaje de error
+EXPECTED_ERRORS = {"/unknown"}
+
+# Diferencias por debajo de esto son ruido del reloj
+NOISE_FLOOR_MS = 2.0
+
+
+def load_module(name, path):
+    """Importa un handler.py con nombre propio (las dos Lambdas usan handler)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values, pct):
+    # Misma definición que metrics.py (rango más cercano)
+    import metrics
+    return metrics.percentile(values, pct)
+
+
+# ════════════════════════════════════════
+# ENTORNO
+# ════════════════════════════════════════
+
+class Bench:
+    """Fakes conectados + handlers cargados."""
+
+    def __init__(self, s3_latency_ms=0, verbose=False):
+        self.s3 = fakes.FakeS3(latency_ms=s3_latency_ms)
+        self.aws = fakes.FakeAWS(self.s3, fakes.FakeSSM(SSM_VALUES), fakes.FakeLambda())
+        self.telegram = fakes.FakeTelegramSession()
+        self.quotes = fakes.FakeQuotes()
+        self.verbose = verbose
+
+        import telegram_client
+        self.patch = fakes.patched(self.aws, telegram_client, self.telegram, self.quotes)
+        self.patch.__enter__()
+
+        self.daily = load_module("daily_handler", os.path.join(DAILY_DIR, "handler.py"))
+        self.bot = load_module("telegram_handler", os.path.join(TELEGRAM_DIR, "handler.py"))
+
+        # Sin esperas del rate limiter de Yahoo: se cuentan las descargas
+        import market_data
+        market_data.rate_limiter = market_data.TokenBucket(1e9, 1e9)
+
+        # Los handlers ponen el root logger en INFO al importarse
+        logging.getLogger().setLevel(logging.INFO if verbose else logging.WARNING)
+
+    def close(self):
+        self.patch.__exit__(None, None, None)
+
+    def use_bucket(self, bucket):
+        """Cambia de usuario sintético: config y cachés del contenedor se reinician."""
+        os.environ["S3_BUCKET"] = bucket
+        self.bot.invalidate_config()
+        self.bot._clients.clear()
+        self.daily._clients.clear()
+
+    def reset_calls(self):
+        self.aws.reset_calls()
+        self.telegram.calls.clear()
+        self.quotes.calls.clear()
+
+    def calls(self):
+        calls = self.aws.calls()
+        calls.update({f"telegram.{k}": v for k, v in self.telegram.calls.items()})
+        calls.update({f"yfinance.{k}": v for k, v in self.quotes.calls.items()})
+        return dict(calls)
+
+    # ── Escenarios ──
+
+    def telegram_command(self, name, text):
+        """OK si el webhook responde 200 y la respuesta no es un error (salvo los esperados)."""
+        event = {"body": json.dumps({"message": {"text": text, "chat": {"id": 1}}})}
+        response = self.bot.lambda_handler(event, {})
+        reply = self.telegram.messages[-1] if self.telegram.messages else ""
+        return response["statusCode"] == 200 and (name in EXPECTED_ERRORS or not reply.startswith("❌"))
+
+    def webhook_ack(self, text):
+        """Webhook en AWS: OK si responde 200 delegando el comando (una invocación asíncrona)."""
+        event = {"body": json.dumps({"update_id": time.time_ns(), "message": {"text": text, "chat": {"id": 1}}})}
+        invocations = len(self.aws.clients["lambda"].invocations)
+        response = self.bot.lambda_handler(event, types.SimpleNamespace(function_name="telegram-handler"))
+        return response["statusCode"] == 200 and len(self.aws.clients["lambda"].invocations) == invocations + 1
+
+    def background(self, text):
+        """La invocación asíncrona que lanza webhook_ack (con la marca de update de los mutating)."""
+        self.bot.lambda_handler({"command": text, "update_id": time.time_ns()}, {})
+        reply = self.telegram.messages[-1] if self.telegram.messages else ""
+        return not reply.startswith("❌")
+
+    def save_trade(self, bucket):
+        trade = synthetic.make_trades(1, seed=int(time.time() * 1000))[0]
+        trade["date_close"] = time.strftime("%Y-%m-%d")
+        self.bot.save_trade_to_history(self.s3, bucket, trade)
+        return True
+
+    def daily_run(self, event):
+        try:
+            self.daily.lambda_handler(event, {})
+            return True
+        except Exception as e:
+            logging.getLogger().error(f"❌ daily_analysis: {e}")
+            return False
+
+    def command_step(self, text):
+        return (lambda: self.telegram_command(text, text)) if text else None
+
+    def scenarios(self, bucket):
+        """(nombre, medida, preparación, deshacer)."""
+        for name, text, setup, undo in COMMANDS:
+            yield (name, lambda name=name, text=text: self.telegram_command(name, text),
+                   self.command_step(setup), self.command_step(undo))
+        yield "webhook ack (/compro)", lambda: self.webhook_ack("/compro NVDA 1 100"), None, None
+        yield "background (/compro)", lambda: self.background("/compro NVDA 1 100"), None, None
+        yield "save_trade_to_history", lambda: self.save_trade(bucket), None, None
+        yield "daily", lambda: self.daily_run({}), None, None
+        yield "daily (manual)", lambda: self.daily_run({"trigger": "manual"}), None, None
+
+    # ── Medición ──
+
+    def invoke(self, fn, setup=None, undo=None, trace=False):
+        """Una invocación: (ok, ms, pico KiB o None, llamadas)."""
+        # metrics.py imprime su línea JSON en stdout
+        with redirect_stdout(sys.stdout if self.verbose else io.StringIO()):
+            if setup:
+                setup()
+            self.reset_calls()
+            if trace:
+                tracemalloc.start()
+            start = time.perf_counter()
+            ok = fn()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            peak_kib = None
+            if trace:
+                peak_kib = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+            calls = self.calls()
+            if undo:
+                undo()
+        return ok, elapsed_ms, peak_kib, calls
+
+    def measure(self, name, fn, setup, undo, repeat):
+        """Calentamiento + repeat medidas de tiempo + una con tracemalloc.
+
+        tracemalloc ralentiza mucho: la memoria se mide en una pasada aparte.
+        """
+        ok, _, _, _ = self.invoke(fn, setup, undo)
+        times = []
+        for _ in range(repeat):
+            run_ok, elapsed_ms, _, calls = self.invoke(fn, setup, undo)
+            ok = ok and run_ok
+            times.append(elapsed_ms)
+        run_ok, _, peak_kib, _ = self.invoke(fn, setup, undo, trace=True)
+
+        return {
+            "scenario": name,
+            "status": "ok" if ok and run_ok else "error",
+            "n": repeat,
+            "p50_ms": round(percentile(times, 50), 2),
+            "p95_ms": round(percentile(times, 95), 2),
+            "max_ms": round(max(times), 2),
+            "peak_kib": round(peak_kib, 1),
+            "calls": calls
+        }
+
+
+# ════════════════════════════════════════
+# INFORME
+# ════════════════════════════════════════
+
+def format_calls(calls):
+    short = {
+        "GetObject": "GET", "PutObject": "PUT", "ListObjectsV2": "LIST", "GetParameters": "SSM",
+        "Invoke": "λ", "telegram.sendMessage": "TG", "telegram.editMessageText": "TG-edit",
+        "yfinance.download": "YF"
+    }
+    return " ".join(f"{short.get(k, k)}:{v}" for k, v in sorted(calls.items()))
+
+
+def print_table(size, rows):
+    print(f"\n📊 {size} trades")
+    print(f"{'Escenario':<24}{'p50 ms':>10}{'p95 ms':>10}{'pico KiB':>11}  Llamadas")
+    for row in rows:
+        flag = "" if row["status"] == "ok" else "  ❌"
+        print(f"{row['scenario']:<24}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['peak_kib']:>11.1f}  "
+              f"{format_calls(row['calls'])}{flag}")
+
+
+def compare(results, baseline, tolerance):
+    """Regresiones respecto a una ejecución guardada con --save."""
+    previous = {(r["trades"], r["scenario"]): r for r in baseline["results"]}
+    regressions = []
+
+    for row in results:
+        before = previous.get((row["trades"], row["scenario"]))
+        if before is None:
+            continue
+        label = f"{row['scenario']} @ {row['trades']} trades"
+
+        if row["status"] != "ok" and before["status"] == "ok":
+            regressions.append(f"{label}: ahora falla")
+        if row["p50_ms"] > before["p50_ms"] * tolerance and row["p50_ms"] - before["p50_ms"] > NOISE_FLOOR_MS:
+            regressions.append(f"{label}: p50 {before['p50_ms']} → {row['p50_ms']} ms")
+        if row["peak_kib"] > before["peak_kib"] * tolerance and row["peak_kib"] - before["peak_kib"] > 64:
+            regressions.append(f"{label}: pico {before['peak_kib']} → {row['peak_kib']} KiB")
+        # Las llamadas son deterministas: cualquier aumento cuenta
+        for call, count in row["calls"].items():
+            if count > before["calls"].get(call, 0):
+                regressions.append(f"{label}: {call} {before['calls'].get(call, 0)} → {count}")
+
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark offline de daily_analysis y telegram_handler")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="tamaños de historial (trades), separados por comas")
+    parser.add_argument("--repeat", type=int, default=5, help="medidas por escenario (tras calentar)")
+    parser.add_argument("--only", default="", help="escenarios a ejecutar, separados por comas")
+    parser.add_argument("--s3-latency-ms", type=float, default=0, help="latencia simulada por llamada S3")
+    parser.add_argument("--save", help="guarda los resultados en JSON")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior: falla si hay regresiones")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="factor permitido en tiempo y memoria")
+    parser.add_argument("--verbose", action="store_true", help="muestra los logs de los handlers")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    only = {s for s in args.only.split(",") if s}
+    bench = Bench(args.s3_latency_ms, args.verbose)
+    results = []
+
+    try:
+        for size in sizes:
+            bucket = f"bench-{size}"
+            start = time.perf_counter()
+            synthetic.seed_bucket(bench.s3, bucket, size)
+            bench.use_bucket(bucket)
+            print(f"\n🌱 {size} trades sembrados en {time.perf_counter() - start:.1f}s "
+                  f"({bench.s3.size(bucket, 'history/') / 1024:.0f} KiB de historial)")
+
+            rows = []
+            for name, fn, setup, undo in bench.scenarios(bucket):
+                if only and name not in only:
+                    continue
+                row = bench.measure(name, fn, setup, undo, args.repeat)
+                row["trades"] = size
+                rows.append(row)
+            print_table(size, rows)
+            results += rows
+    finally:
+        bench.close()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+        print(f"\n✅ Resultados guardados en {args.save}")
+
+    failed = [r for r in results if r["status"] != "ok"]
+    for row in failed:
+        print(f"❌ {row['scenario']} @ {row['trades']} trades falló")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regresiones:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n✅ Sin regresiones")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
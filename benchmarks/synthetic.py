@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import random
+from datetime import date, timedelta
+
+import montecarlo
+import portfolio_store
+import quote_cache
+import risk
+import stats_aggregates
+import trade_history
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+TICKERS = [
+    "AAPL", "MSFT", "NVDA", "AMZN", "GOOGL", "META", "TSLA", "AMD", "ASML", "SAP",
+    "NFLX", "ADBE", "CRM", "ORCL", "INTC", "QCOM", "AVGO", "TXN", "IBM", "SHOP",
+    "V", "MA", "JPM", "BAC", "KO", "PEP", "MCD", "NKE", "DIS", "PFE",
+    "JNJ", "MRK", "XOM", "CVX", "SIE.DE", "ALV.DE", "BMW.DE", "SAN.MC", "ITX.MC", "IBE.MC"
+]
+
+
+# ════════════════════════════════════════
+# HISTORIAL
+# ════════════════════════════════════════
+
+def make_trades(count, seed=42, end=None):
+    """count trades cerrados repartidos en meses hasta el mes anterior a end.
+
+    Mismos campos y redondeos que cmd_vendo (2€ de costes, 19% sobre ganancias).
+    """
+    rng = random.Random(seed)
+    end = end or date.today().replace(day=1) - timedelta(days=1)
+    # ~50 trades/mes, como mucho 10 años
+    span_days = min(3650, max(30, count * 30 // 50))
+
+    trades = []
+    for _ in range(count):
+        date_close = end - timedelta(days=rng.randrange(span_days))
+        date_open = date_close - timedelta(days=rng.randrange(1, 90))
+        quantity = rng.randint(1, 20)
+        entry_price = round(rng.uniform(20, 500), 2)
+        exit_price = round(entry_price * (1 + rng.gauss(0.01, 0.08)), 2)
+
+        gross_pnl = (exit_price - entry_price) * quantity
+        net_before_tax = gross_pnl - 2
+        net_pnl = round(net_before_tax - max(0, net_before_tax * 0.19), 2)
+        trades.append({
+            "ticker": rng.choice(TICKERS),
+            "quantity": quantity,
+            "entry_price": entry_price,
+            "exit_price": exit_price,
+            "date_close": date_close.isoformat(),
+            "gross_pnl": round(gross_pnl, 2),
+            "net_pnl": net_pnl,
+            "pnl_pct": round((exit_price - entry_price) / entry_price * 100, 2),
+            "result": "win" if net_pnl > 0 else "loss",
+            "date_open": date_open.isoformat()
+        })
+
+    trades.sort(key=lambda t: t["date_close"])
+    return trades
+
+
+def seed_history(s3, bucket, trades):
+    """Particiones mensuales + manifest y agregados."""
+    months = {}
+    for trade in trades:
+        months.setdefault(trade["date_close"][:7], []).append(trade_history.trade_to_row(trade))
+
+    for month, rows in months.items():
+        s3.put(bucket, trade_history.partition_key(month), trade_history.HEADER + "".join(rows))
+    manifest = {"partitions": {m: trade_history.partition_key(m) for m in sorted(months)}}
+    s3.put(bucket, trade_history.MANIFEST_KEY, json.dumps(manifest, indent=2))
+
+    stats_aggregates.rebuild_aggregates(s3, bucket)
+
+
+# ════════════════════════════════════════
+# PORTFOLIO Y CONFIGURACIÓN
+# ════════════════════════════════════════
+
+def make_portfolio(positions, seed=42):
+    rng = random.Random(seed)
+    today = date.today()
+    return {
+        "positions": [
+            {
+                "ticker": ticker,
+                "quantity": 1000,
+                "entry_price": round(rng.uniform(20, 500), 2),
+                "date_open": (today - timedelta(days=rng.randrange(1, 120))).isoformat(),
+                "last_updated": today.isoformat()
+            }
+            for ticker in TICKERS[:positions]
+        ],
+        "cash_eur": 1_000_000,
+        "last_updated": today.isoformat(),
+        "seq": 0
+    }
+
+
+def seed_portfolio(s3, bucket, portfolio, pending_events=3):
+    """Snapshot + eventos sin compactar (lo normal entre análisis diarios)."""
+    s3.put(bucket, portfolio_store.SNAPSHOT_KEY, json.dumps(portfolio, indent=2))
+
+    ticker = portfolio["positions"][0]["ticker"] if portfolio["positions"] else TICKERS[0]
+    for seq in range(portfolio["seq"] + 1, portfolio["seq"] + 1 + pending_events):
+        event = dict(portfolio_store.make_event("buy", ticker, 1, 100.0), seq=seq)
+        s3.put(bucket, portfolio_store.event_key(seq), json.dumps(event))
+
+
+def seed_quotes(s3, bucket, portfolio, seed=42):
+    """Caché de cotizaciones como la deja el análisis diario."""
+    rng = random.Random(seed)
+    now = time.time()
+    quotes = {
+        p["ticker"]: {"price": round(p["entry_price"] * rng.uniform(0.8, 1.3), 2), "ts": now, "source": "daily"}
+        for p in portfolio["positions"]
+    }
+    s3.put(bucket, quote_cache.QUOTES_KEY, json.dumps({"quotes": quotes}))
+
+
+def seed_returns(s3, bucket, portfolio, days=montecarlo.HISTORY_DAYS, seed=42):
+    """Rentabilidades diarias de las posiciones como las guarda el análisis diario (/risk)."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    tickers = [p["ticker"] for p in portfolio["positions"]]
+    closes = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, size=(len(tickers), days + 1)), axis=1))
+    ts = np.arange(np.datetime64(date.today()) - days, np.datetime64(date.today()) + 1)
+    montecarlo.save_returns(risk.S3Store(s3, bucket, prefix=risk.S3_PREFIX), tickers, ts, closes)
+
+
+def seed_config(s3, bucket, tips=3, blacklist=5):
+    with open(os.path.join(ROOT, "config", "rules.json.example")) as f:
+        s3.put(bucket, "config/rules.json", f.read())
+    with open(os.path.join(ROOT, "config", "universe.txt.example")) as f:
+        s3.put(bucket, "config/universe.txt", f.read())
+
+    s3.put(bucket, "external/tickers_blacklist.txt", "\n".join(TICKERS[-blacklist:]))
+    s3.put(bucket, "external/user_tips.json", json.dumps([
+        {"ticker": ticker, "context": "Tip sintético", "date": date.today().isoformat(), "source": "user"}
+        for ticker in TICKERS[20:20 + tips]
+    ]))
+
+
+def seed_bucket(s3, bucket, trade_count, positions=10):
+    """Estado completo de un usuario con trade_count operaciones cerradas."""
+    seed_config(s3, bucket)
+    portfolio = make_portfolio(positions)
+    seed_portfolio(s3, bucket, portfolio)
+    seed_quotes(s3, bucket, portfolio)
+    seed_returns(s3, bucket, portfolio)
+    seed_history(s3, bucket, make_trades(trade_count))
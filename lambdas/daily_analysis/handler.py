@@ -1,21 +1,44 @@
 import os
+import sys
 import json
+import time
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-import time
 
-import anthropic
-import yfinance as yf
-import boto3
-import requests
-from dotenv import load_dotenv
+# lambdas/shared va junto al handler en el ZIP; en local se añade al path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+
+# Dependencias pesadas (anthropic, yfinance/pandas, numpy, boto3, requests)
+# se importan en la etapa que las usa: ver import_profile.STAGES
+from import_profile import lazy_import, log_import_report
+import metrics
 
 # Configurar logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Cargar .env si estamos en local
-load_dotenv()
+CLAUDE_MODEL = "claude-opus-4-6"
+# $ por millón de tokens (input, output)
+MODEL_PRICES = {
+    "claude-opus-4-6": (5, 25),
+    "claude-sonnet-4-5": (3, 15),
+    "claude-haiku-4-5": (1, 5)
+}
+# concurrent: lecturas S3 y datos de mercado en paralelo | sequential: una tras otra
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "concurrent")
+IO_WORKERS = 8
+# Segundos que se dejan tras pedir sector/país a Yahoo (Monte Carlo, Claude, Telegram)
+METADATA_RESERVE_SECONDS = 25
+
+# Clientes boto3 del contenedor
+_clients = {}
+
+# Cargar .env solo en local. En Lambda (ENVIRONMENT=aws) ni se importa dotenv;
+# fuera de Lambda ENVIRONMENT puede venir del propio .env
+if os.getenv("ENVIRONMENT") == "local" or not os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 
 def get_config():
@@ -34,6 +57,7 @@ def get_config():
         }
     else:
         logger.info("Entorno AWS - leyendo Parameter Store")
+        boto3 = lazy_import("boto3", "config")
         ssm = boto3.client("ssm", region_name="eu-west-1")
         
         params = ssm.get_parameters(
@@ -52,39 +76,86 @@ def get_config():
         
         config["s3_bucket"] = os.getenv("S3_BUCKET", "trading-system-data")
         config["aws_region"] = "eu-west-1"
+        config["mock_claude"] = os.getenv("MOCK_CLAUDE", "false")
         
         return config
 
     
-def load_portfolio(config):
-    """Carga portfolio actual y blacklist desde S3 o archivos locales."""
+def get_s3_client(config):
+    """Cliente S3 del contenedor.
+    
+    Se crea una vez desde el hilo principal: crear clientes boto3 a la vez
+    desde varios hilos con la sesión por defecto no es seguro.
+    """
+    if "s3" not in _clients:
+        boto3 = lazy_import("boto3", "portfolio")
+        _clients["s3"] = boto3.client("s3", region_name=config["aws_region"])
+    return _clients["s3"]
+
+
+def load_positions(config):
+    """Portfolio actual: compacta eventos del día anterior y lee el estado."""
     environment = os.getenv("ENVIRONMENT", "aws")
     
     if environment == "local":
         logger.info("Cargando portfolio desde archivos locales")
-        portfolio = {
+        return {
             "positions": [],
             "cash_eur": 2300,
             "last_updated": datetime.now().isoformat()
         }
-        blacklist = []
-        rules = load_rules_local()
-        
+    
+    portfolio_store = lazy_import("portfolio_store", "portfolio")
+    s3 = get_s3_client(config)
+    bucket = config["s3_bucket"]
+    
+    try:
+        portfolio_store.compact(s3, bucket)
+    except Exception as e:
+        logger.error(f"❌ Error compactando portfolio: {e}")
+    return portfolio_store.load_portfolio(s3, bucket)
+
+
+def load_blacklist(config):
+    """Tickers no disponibles en Trade Republic."""
+    if os.getenv("ENVIRONMENT", "aws") == "local":
+        return []
+    
+    blacklist_raw = load_s3_text(get_s3_client(config), config["s3_bucket"], "external/tickers_blacklist.txt")
+    return [t.strip() for t in blacklist_raw.split("\n") if t.strip()]
+
+
+def load_rules(config):
+    """Reglas de trading."""
+    if os.getenv("ENVIRONMENT", "aws") == "local":
+        return load_rules_local()
+    
+    return load_s3_json(get_s3_client(config), config["s3_bucket"], "config/rules.json")
+
+
+def load_tips(config):
+    """Carga tips externos (/tip) desde S3. En local no hay tips."""
+    environment = os.getenv("ENVIRONMENT", "aws")
+    
+    if environment == "local":
+        return []
+    
+    tips = load_s3_json(get_s3_client(config), config["s3_bucket"], "external/user_tips.json")
+    return tips if isinstance(tips, list) else []
+
+
+def load_universe(config):
+    """Carga universo de tickers a escanear (uno por línea)."""
+    environment = os.getenv("ENVIRONMENT", "aws")
+    
+    if environment == "local":
+        with open("config/universe.txt.example", "r") as f:
+            universe_raw = f.read()
     else:
-        s3 = boto3.client("s3", region_name=config["aws_region"])
-        bucket = config["s3_bucket"]
-        
-        # Portfolio actual
-        portfolio = load_s3_json(s3, bucket, "portfolio/current_positions.json")
-        
-        # Tickers blacklist
-        blacklist_raw = load_s3_text(s3, bucket, "external/tickers_blacklist.txt")
-        blacklist = [t.strip() for t in blacklist_raw.split("\n") if t.strip()]
-        
-        # Reglas trading
-        rules = load_s3_json(s3, bucket, "config/rules.json")
+        universe_raw = load_s3_text(get_s3_client(config), config["s3_bucket"], "config/universe.txt")
     
-    return portfolio, blacklist, rules
+    lines = [t.strip() for t in universe_raw.split("\n")]
+    return [t.upper() for t in lines if t and not t.startswith("#")]
 
 
 def load_rules_local():
@@ -113,52 +184,284 @@ def load_s3_text(s3_client, bucket, key):
         return ""
 
     
-def get_market_data(portfolio):
-    """Descarga solo precio actual para posiciones en portfolio."""
-    tickers = []
-    
-    if portfolio.get("positions"):
-        tickers = [p["ticker"] for p in portfolio["positions"]]
+def get_market_data(tickers, price_cache):
+    """Histórico OHLCV y precio actual de los tickers a partir de la caché.
     
+    Retorna (market_data, history, errors).
+    """
+    np = lazy_import("numpy", "market_data")
+    history, errors = price_cache.get_history(tickers)
     market_data = {}
     
-    for ticker in tickers:
+    for ticker, bars in history.items():
+        closes = bars["close"][~np.isnan(bars["close"])]
+        if len(closes) == 0:
+            errors[ticker] = "Sin precio de cierre"
+            continue
+        market_data[ticker] = {
+            "current_price": round(float(closes[-1]), 2)
+        }
+        logger.info(f"✅ {ticker}: {closes[-1]:.2f}€")
+    
+    for ticker, error in errors.items():
+        logger.error(f"❌ Error descargando {ticker}: {error}")
+    
+    return market_data, history, errors
+
+
+def save_quotes(config, market_data, price_cache):
+    """Publica los precios del día en la caché de cotizaciones que leen /portfolio y /balance.
+
+    Cada precio lleva la hora de su barra, no la de ahora: si la descarga falló
+    y salió de la caché OHLCV, no debe pisar una cotización más reciente.
+    """
+    prices = {t: d["current_price"] for t, d in market_data.items() if d.get("current_price") is not None}
+    as_of = {t: price_cache.as_of[t] for t in prices if t in price_cache.as_of}
+    try:
+        quote_cache = lazy_import("quote_cache", "market_data")
+        s3 = get_s3_client(config) if os.getenv("ENVIRONMENT", "aws") != "local" else None
+        quote_cache.build_quote_cache(config, s3).write(
+            prices, source="daily",
+            ts={t: price_ts for t, (price_ts, _) in as_of.items()},
+            fetched={t: fetched for t, (_, fetched) in as_of.items()}
+        )
+        logger.info(f"✅ Caché de cotizaciones: {len(prices)} tickers")
+    except Exception as e:
+        # Solo afecta a la frescura de /portfolio y /balance
+        logger.warning(f"⚠️ No se pudo actualizar la caché de cotizaciones: {e}")
+
+
+class InlineExecutor:
+    """Executor que ejecuta cada tarea al hacer submit (modo secuencial)."""
+    
+    def submit(self, fn, *args):
+        future = Future()
         try:
-            time.sleep(5)
-            stock = yf.Ticker(ticker)
-            hist = stock.history(period="1d")
-            
-            if not hist.empty:
-                current_price = hist["Close"].iloc[-1]
-                market_data[ticker] = {
-                    "current_price": round(float(current_price), 2)
-                }
-                logger.info(f"✅ {ticker}: {current_price:.2f}€")
-            
+            future.set_result(fn(*args))
         except Exception as e:
-            logger.error(f"❌ Error descargando {ticker}: {e}")
-            market_data[ticker] = {"error": str(e)}
+            future.set_exception(e)
+        return future
     
-    return market_data
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
 
 
-def build_prompt(portfolio, market_data, blacklist, rules):
-    """Construye prompt minimalista para Opus."""
-    today = datetime.now().strftime("%d/%m/%Y %H:%M CET")
+def load_inputs(config, price_cache, mode=PIPELINE_MODE):
+    """Etapa de I/O: portfolio, blacklist, reglas, tips, universo y datos de mercado.
     
-    # Solo incluir posiciones si existen
-    positions_text = ""
-    if portfolio.get("positions"):
-        positions_text = "\n\nPOSICIONES ABIERTAS:\n"
-        for pos in portfolio["positions"]:
-            ticker = pos["ticker"]
-            if ticker in market_data and "current_price" in market_data[ticker]:
-                current = market_data[ticker]["current_price"]
-                entry = pos["entry_price"]
-                pnl_pct = round(((current - entry) / entry) * 100, 2)
-                positions_text += f"{ticker}: {pos['quantity']} @ {entry}€ → {current}€ ({pnl_pct:+}%)\n"
+    En modo concurrent las lecturas S3 arrancan a la vez y la descarga de
+    precios de las posiciones empieza en cuanto se conoce el portfolio.
+    Los resultados se recogen en el mismo orden que la versión secuencial,
+    así que el primer error que se relanza es el mismo.
+    """
+    if os.getenv("ENVIRONMENT", "aws") != "local":
+        get_s3_client(config)
+    
+    durations = {}
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=IO_WORKERS) if mode == "concurrent" else InlineExecutor()
+    
+    with executor as pool:
+        def submit(name, fn, *args):
+            def run():
+                task_start = time.perf_counter()
+                try:
+                    return fn(*args)
+                finally:
+                    durations[name] = time.perf_counter() - task_start
+            return pool.submit(run)
+        
+        futures = {
+            name: submit(name, fn, config)
+            for name, fn in (
+                ("portfolio", load_positions),
+                ("blacklist", load_blacklist),
+                ("rules", load_rules),
+                ("tips", load_tips),
+                ("universe", load_universe)
+            )
+        }
+        
+        # yfinance (+ pandas) se importa aquí, antes de que las dos descargas
+        # de precios arranquen en hilos: sin depender del lock de lazy_import.
+        # El análisis diario casi siempre descarga, así que no es coste extra
+        if mode == "concurrent":
+            lazy_import("yfinance", "market_data")
+        
+        portfolio = futures["portfolio"].result()
+        position_tickers = [p["ticker"] for p in portfolio.get("positions", [])]
+        positions_market = submit("market_positions", get_market_data, position_tickers, price_cache)
+        
+        blacklist = futures["blacklist"].result()
+        rules = futures["rules"].result()
+        tips = futures["tips"].result()
+        tip_tickers = [
+            t["ticker"] for t in tips
+            if t.get("ticker") and t["ticker"] not in blacklist and t["ticker"] not in position_tickers
+        ]
+        tips_market = submit("market_tips", get_market_data, tip_tickers, price_cache)
+        
+        market_data, history, market_errors = positions_market.result()
+        for part, extra in zip((market_data, history, market_errors), tips_market.result()):
+            part.update(extra)
+        universe = futures["universe"].result()
+    
+    wall = time.perf_counter() - start
+    serial = sum(durations.values())
+    logger.info(f"⚡ I/O ({mode}): {wall:.2f}s, secuencial {serial:.2f}s, ahorro {max(serial - wall, 0):.2f}s")
+    
+    return {
+        "portfolio": portfolio,
+        "blacklist": blacklist,
+        "rules": rules,
+        "tips": tips,
+        "universe": universe,
+        "position_tickers": position_tickers,
+        "tip_tickers": tip_tickers,
+        "market_data": market_data,
+        "history": history,
+        "market_errors": market_errors
+    }
+
+
+def select_candidates(tickers, indicators, rules):
+    """Filtra candidatos de compra con los checks técnicos anti-FOMO en código."""
+    technical_checks = lazy_import("indicators", "indicators").technical_checks
+    checks = technical_checks(indicators, rules.get("analysis_config", {}))
+    candidates = []
+    
+    for ticker in tickers:
+        check = checks.get(ticker)
+        if check and check["passed"]:
+            candidates.append(ticker)
+        else:
+            failed = [k[:-3] for k, ok in (check or {}).items() if k != "passed" and not ok]
+            logger.info(f"⏭️ {ticker} descartado: {', '.join(failed) or 'sin datos'}")
+    
+    return candidates
+
+
+def risk_history(portfolio, history, candidates, price_cache):
+    """Histórico de posiciones y candidatos para assess_risk y simulate_var.
+
+    Los candidatos del screener no están en history, pero sí en la caché de
+    precios: se leen una vez aquí. Retorna un dict nuevo, history no cambia.
+    """
+    tickers = list(dict.fromkeys([p["ticker"] for p in portfolio.get("positions", [])] + candidates))
+    selected = {t: history[t] for t in tickers if t in history}
+    missing = [t for t in tickers if t not in history]
+    if missing:
+        selected.update(price_cache.get_history(missing)[0])
+    return selected
+
+
+def metadata_deadline(context):
+    """Hasta cuándo (time.monotonic()) se pueden pedir metadatos. None sin contexto de Lambda."""
+    remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining is None:
+        return None
+    return time.monotonic() + remaining() / 1000 - METADATA_RESERVE_SECONDS
+
+
+def assess_risk(config, portfolio, market_data, history, candidates, rules, deadline=None):
+    """Actualiza la ventana de correlaciones (posiciones + candidatos) y los
+    metadatos de sector/país. Retorna los avisos de risk_management para el prompt.
+
+    Los metadatos que falten se piden a Yahoo hasta deadline (time.monotonic()).
+    """
+    risk = lazy_import("risk", "risk")
+    indicators = lazy_import("indicators", "indicators")
+    positions = portfolio.get("positions", [])
+    held = [p["ticker"] for p in positions]
+    tickers = list(dict.fromkeys(held + candidates))
+    if not tickers:
+        return []
+
+    names, ts, matrices = indicators.align_history({t: history[t] for t in tickers if t in history})
+
+    s3 = get_s3_client(config) if os.getenv("ENVIRONMENT", "aws") != "local" else None
+    store = risk.build_store(config, s3)
+    state = risk.load_state(store)
+    if names:
+        state.update(names, ts, indicators.ffill(matrices["close"]))
+        store.write(risk.STATE_NAME, state.to_bytes())
+    metadata = risk.load_metadata(store)
+    limiter = lazy_import("market_data", "market_data").rate_limiter
+    if risk.refresh_metadata(metadata, tickers, deadline=deadline, limiter=limiter):
+        store.write(risk.METADATA_NAME, json.dumps(metadata, indent=2).encode("utf-8"))
+
+    risk_rules = rules.get("risk_management", {})
+    flags = []
+    threshold = risk_rules.get("max_correlation_alert")
+    if threshold is not None:
+        pairs = risk.correlated_pairs(state, threshold / 100, tickers)
+        if pairs:
+            flags.append(f"Correlación >{threshold}%: {risk.format_pairs(pairs)}")
+
+    values = {
+        p["ticker"]: p["quantity"] * market_data.get(p["ticker"], {}).get("current_price", p["entry_price"])
+        for p in positions
+    }
+    cash = portfolio.get("cash_eur", 0)
+    total = cash + sum(values.values())
+    for kind, name, pct, limit in risk.limit_breaches(values, metadata, total, risk_rules):
+        flags.append(f"Exposición {kind} {name}: {pct:.0f}% (límite {limit}%)")
+
+    # Tamaño de compra típico: el máximo por posición de trading_rules
+    size = total * rules.get("trading_rules", {}).get("max_position_size_percent", 100) / 100
+    for ticker in candidates:
+        for warning in risk.buy_breaches(metadata, values, cash, ticker, min(size, cash), risk_rules):
+            flags.append(f"Comprar {ticker}: {warning}")
+    return flags
+
+
+def simulate_var(config, portfolio, market_data, history, candidates, rules):
+    """Monte Carlo de las posiciones (VaR/CVaR a 1 y 10 días, probabilidad de stop).
+
+    Guarda antes el histórico de rentabilidades de posiciones y candidatos
+    (risk/returns.npz) que usa /risk. Retorna las líneas para el prompt.
+    """
+    risk = lazy_import("risk", "risk")
+    montecarlo = lazy_import("montecarlo", "risk")
+    indicators = lazy_import("indicators", "indicators")
+    positions = portfolio.get("positions", [])
+    tickers = list(dict.fromkeys([p["ticker"] for p in positions] + candidates))
+    names, ts, matrices = indicators.align_history({t: history[t] for t in tickers if t in history})
+    if not names:
+        return []
+
+    s3 = get_s3_client(config) if os.getenv("ENVIRONMENT", "aws") != "local" else None
+    store = risk.build_store(config, s3)
+    montecarlo.save_returns(store, names, ts, indicators.ffill(matrices["close"]))
+    if not positions:
+        return []
+
+    prices = {t: d["current_price"] for t, d in market_data.items() if "current_price" in d}
+    result, missing = montecarlo.portfolio_risk(
+        montecarlo.load_returns(store), positions, prices, portfolio.get("cash_eur", 0),
+        rules.get("trading_rules", {}).get("stop_loss_percent", -10)
+    )
+    if result is None:
+        return []
+    logger.info(f"⏱️ Monte Carlo: {result['paths']} escenarios en {result['seconds']:.1f}s ({result['workers']} procesos)")
+    flags = montecarlo.summary_flags(result)
+    if missing:
+        flags.append(f"Sin histórico para VaR: {', '.join(missing)}")
+    return flags
+
+
+def build_instructions(blacklist, rules):
+    """Bloque estático del prompt (rol, reglas, formato).
+
+    No lleva fecha ni datos de mercado: así es idéntico entre llamadas y
+    se puede marcar para prompt caching.
+    """
+    analysis_config = rules.get("analysis_config", {})
     
-    prompt = f"""Analista financiero experto. Fecha: {today}{positions_text}
+    return f"""Analista financiero experto.
 
 REGLAS: Stop-loss {rules['trading_rules']['stop_loss_percent']}%, Target {rules['trading_rules']['target_profit_percent']}%
 NO DISPONIBLE TR: {', '.join(blacklist) if blacklist else 'ninguno'}
@@ -174,16 +477,18 @@ Cada una: MANTENER/VENDER/AJUSTAR STOP
 Razón: 1 línea por posición
 
 🎯 OPORTUNIDADES (0-3 tickers máximo)
-Solo incluir si pasa 4/4 checks:
-✅ Técnico (soporte claro, RSI<70)
+Solo tickers de CANDIDATOS. Ya cumplen en código:
+✅ Técnico (precio cerca de soporte 20d, RSI<{analysis_config.get('max_rsi_buy', 70)})
+✅ Volumen medio 20d >{analysis_config.get('min_volume_daily', 1_000_000):,}
+Incluir solo si además pasa:
 ✅ Fundamental (P/E razonable, balance sano)  
 ✅ Sentimiento (catalizador confirmado múltiples fuentes)
-✅ Timing (volumen >1M, mercado abierto, sin eventos inminentes)
+✅ Timing (mercado abierto, sin eventos inminentes)
 
 Por cada oportunidad 4/4:
 - Ticker + razón compra en 1 línea
 
-Si ninguno pasa 4/4: omitir sección completa
+Si no hay CANDIDATOS o ninguno pasa: omitir sección completa
 
 ₿ CRYPTO
 BTC: ESPERAR/VIGILAR/ACTUAR (razón 3 palabras)
@@ -197,14 +502,59 @@ IMPORTANTE:
 - Sin tablas, sin markdown, sin asteriscos
 - Directo y accionable
 - Si no hay oportunidades claras → no fuerces recomendaciones
+- Si hay sección RIESGO: no recomiendes compras que la agraven y menciónalo en POSICIONES
 - Máximo 200 palabras TOTAL
 """
+
+
+def build_prompt(portfolio, market_data, indicators=None, candidates=None, tips=None, risk_flags=None):
+    """Construye la parte dinámica del prompt (fecha, posiciones, candidatos, riesgo)."""
+    format_indicators = lazy_import("indicators", "indicators").format_indicators
+    today = datetime.now().strftime("%d/%m/%Y %H:%M CET")
+    indicators = indicators or {}
+    candidates = candidates or []
+    tips_by_ticker = {t.get("ticker"): t.get("context", "") for t in (tips or [])}
     
-    return prompt
+    # Solo incluir posiciones si existen
+    positions_text = ""
+    if portfolio.get("positions"):
+        positions_text = "\n\nPOSICIONES ABIERTAS:\n"
+        for pos in portfolio["positions"]:
+            ticker = pos["ticker"]
+            if ticker in market_data and "current_price" in market_data[ticker]:
+                current = market_data[ticker]["current_price"]
+                entry = pos["entry_price"]
+                pnl_pct = round(((current - entry) / entry) * 100, 2)
+                positions_text += f"{ticker}: {pos['quantity']} @ {entry}€ → {current}€ ({pnl_pct:+}%)\n"
+                if ticker in indicators:
+                    positions_text += f"  {format_indicators(indicators[ticker])}\n"
+    
+    # Candidatos que ya pasan técnico + volumen en código
+    candidates_text = ""
+    if candidates:
+        candidates_text = "\n\nCANDIDATOS (técnico y volumen verificados):\n"
+        for ticker in candidates:
+            price = market_data.get(ticker, {}).get("current_price", "n/d")
+            candidates_text += f"{ticker}: {price}€ | {format_indicators(indicators[ticker])}\n"
+            if tips_by_ticker.get(ticker):
+                candidates_text += f"  Tip: {tips_by_ticker[ticker]}\n"
+    
+    # Pares correlacionados y límites de exposición (assess_risk)
+    risk_text = ""
+    if risk_flags:
+        risk_text = "\n\nRIESGO:\n" + "\n".join(f"- {flag}" for flag in risk_flags)
+    
+    return f"Fecha: {today}{positions_text}{candidates_text}{risk_text}"
 
 
-def analyze_with_claude(prompt, config):
-    """Llama a Claude Opus 4.6 con el prompt construido."""
+def analyze_with_claude(prompt, config, instructions="", model=CLAUDE_MODEL, on_text=None):
+    """Llama a Claude (Opus 4.6 por defecto) con el prompt construido.
+    
+    instructions va como system con cache_control: las llamadas siguientes
+    dentro de la ventana de caché del proveedor no lo vuelven a facturar entero.
+    Con on_text se consume la respuesta en streaming y se llama on_text(texto
+    acumulado) con cada fragmento.
+    """
     
     # MODO MOCK
     if config.get("mock_claude") == "true":
@@ -227,30 +577,99 @@ Mock.
 ⚠️ TEST - Eliminar MOCK para análisis real."""
 
     # Llamada real a Claude
+    anthropic = lazy_import("anthropic", "claude")
     client = anthropic.Anthropic(api_key=config["claude_api_key"])
-    logger.info("Llamando a Claude API...")
+    logger.info(f"Llamando a Claude API ({model})...")
     
-    message = client.messages.create(
-        model="claude-opus-4-6",
-        max_tokens=1000,
-        messages=[
+    request = {
+        "model": model,
+        "max_tokens": 1000,
+        "system": [
+            {
+                "type": "text",
+                "text": instructions,
+                "cache_control": {"type": "ephemeral"}
+            }
+        ],
+        "messages": [
             {
                 "role": "user",
                 "content": prompt
             }
         ]
+    }
+    
+    if on_text is None:
+        message = client.messages.create(**request)
+        analysis = message.content[0].text
+    else:
+        start = time.perf_counter()
+        analysis = ""
+        with client.messages.stream(**request) as stream:
+            for fragment in stream.text_stream:
+                if not analysis:
+                    logger.info(f"⚡ Primer token en {time.perf_counter() - start:.1f}s")
+                analysis += fragment
+                on_text(analysis)
+            message = stream.get_final_message()
+    
+    # Log tokens usados (cache write 1.25x, cache read 0.1x del precio de input)
+    usage = message.usage
+    cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    logger.info(f"Tokens input: {usage.input_tokens} (+{cache_write} escritos / {cache_read} leídos de caché)")
+    logger.info(f"Tokens output: {usage.output_tokens}")
+    price_in, price_out = MODEL_PRICES.get(model, MODEL_PRICES[CLAUDE_MODEL])
+    cost = (usage.input_tokens + cache_write * 1.25 + cache_read * 0.1) * price_in / 1_000_000 \
+        + usage.output_tokens * price_out / 1_000_000
+    logger.info(f"Coste estimado: ${cost:.4f}")
+    metrics.record(
+        calls=1,
+        tokens_in=usage.input_tokens + cache_write + cache_read,
+        tokens_out=usage.output_tokens,
+        cost_usd=cost
     )
     
-    analysis = message.content[0].text
+    return analysis
+
+
+def get_analysis(prompt, instructions, config, portfolio, market_data, tips, candidates,
+                 model=CLAUDE_MODEL, on_text=None, risk_flags=None):
+    """Análisis de Claude reutilizando la respuesta si las entradas no cambiaron."""
+    if config.get("mock_claude") == "true":
+        return analyze_with_claude(prompt, config, instructions, model)
     
-    # Log tokens usados
-    logger.info(f"Tokens input: {message.usage.input_tokens}")
-    logger.info(f"Tokens output: {message.usage.output_tokens}")
-    logger.info(f"Coste estimado: ${(message.usage.input_tokens * 5 + message.usage.output_tokens * 25) / 1_000_000:.4f}")
+    response_cache = lazy_import("response_cache", "claude")
+    cache = response_cache.build_response_cache(config)
+    key = response_cache.input_key(instructions, portfolio, market_data, tips, candidates, model, risk_flags)
     
+    analysis = cache.get(key)
+    if analysis is None:
+        analysis = analyze_with_claude(prompt, config, instructions, model, on_text)
+        cache.put(key, analysis)
     return analysis
 
 
+def plan_analysis(event, fingerprint, baseline, analysis_config):
+    """Decide el análisis de hoy: "full" (Opus), "digest" o "downgrade".
+    
+    Un /run manual siempre hace análisis completo.
+    """
+    input_fingerprint = lazy_import("input_fingerprint", "claude")
+    mode = analysis_config.get("quiet_day_mode", input_fingerprint.DEFAULT_MODE)
+    
+    if event.get("trigger") == "manual" or mode == "off":
+        return "full"
+    
+    reasons = input_fingerprint.material_changes(baseline, fingerprint, analysis_config)
+    if reasons:
+        logger.info(f"📈 Cambios materiales: {', '.join(reasons)}")
+        return "full"
+    
+    logger.info(f"😴 Sin cambios materiales desde {baseline['date']} → {mode}")
+    return mode
+
+
 def clean_for_telegram(text):
     """Limpia markdown residual que Telegram no entiende."""
     import re
@@ -263,36 +682,60 @@ def clean_for_telegram(text):
     return text
 
 
+def get_telegram_client():
+    """Módulo telegram_client con la sesión instrumentada para métricas."""
+    telegram_client = lazy_import("telegram_client", "telegram")
+    metrics.instrument_session(telegram_client.get_session())
+    return telegram_client
+
+
 def send_telegram(message_text, config):
-    """Envía mensaje via Telegram Bot API."""
-    token = config["telegram_token"]
-    chat_id = config["telegram_chat_id"]
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    """Envía mensaje via Telegram Bot API (troceado si supera 4096 caracteres)."""
+    telegram_client = get_telegram_client()
     
     try:
-        response = requests.post(url, json={
-            "chat_id": chat_id,
-            "text": message_text
-        })
-        
-        if response.status_code == 200:
-            logger.info("✅ Telegram mensaje enviado")
-        else:
-            logger.error(f"❌ Error Telegram: {response.text}")
-            
+        telegram_client.send_message(config["telegram_token"], config["telegram_chat_id"], message_text)
+        logger.info("✅ Telegram mensaje enviado")
+    except telegram_client.TelegramError as e:
+        logger.error(f"❌ Error Telegram: {e}")
     except Exception as e:
         logger.error(f"❌ Error enviando Telegram: {e}")
 
 
-def save_results(analysis, config, portfolio):
-    """Guarda log de ejecución en S3. Solo en entorno AWS."""
+def analysis_header():
+    return f"📊 ANÁLISIS - {datetime.now().strftime('%d/%m/%Y %H:%M')} CET\n\n"
+
+
+def start_live_message(config):
+    """Publica el mensaje que se editará durante el streaming. None si falla."""
+    telegram_client = get_telegram_client()
+    try:
+        return telegram_client.LiveMessage(
+            config["telegram_token"], config["telegram_chat_id"], "⏳ Análisis en marcha..."
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Sin mensaje en streaming, se enviará al final: {e}")
+        return None
+
+
+def finish_live_message(live, message_text, config):
+    """Deja el texto final en el mensaje en streaming (o lo envía aparte si falla)."""
+    try:
+        live.finish(message_text)
+    except Exception as e:
+        logger.error(f"❌ Error editando mensaje final: {e}")
+        send_telegram(message_text, config)
+
+
+def save_results(analysis, config, portfolio, run_metrics=None):
+    """Guarda log de ejecución (con métricas por etapa) en S3. Solo en entorno AWS."""
     environment = os.getenv("ENVIRONMENT", "aws")
     
     if environment == "local":
         logger.info("Local: no guardamos en S3")
         return
     
-    s3 = boto3.client("s3", region_name=config["aws_region"])
+    s3 = get_s3_client(config)
     bucket = config["s3_bucket"]
     
     today = datetime.now().strftime("%Y-%m-%d")
@@ -302,7 +745,8 @@ def save_results(analysis, config, portfolio):
         "timestamp": datetime.now().isoformat(),
         "portfolio_value": portfolio.get("total_value_eur", 0),
         "analysis_length": len(analysis),
-        "execution": "success"
+        "execution": "success",
+        "metrics": run_metrics
     }
     
     log_key = f"logs/daily_analysis_{today}.json"
@@ -322,41 +766,132 @@ def save_results(analysis, config, portfolio):
 def lambda_handler(event, context):
     """Entry point principal."""
     logger.info("🚀 Iniciando análisis diario trading bot")
+    live = None
+    mode = None
+    metrics.start_run()
     
     try:
         # 1. Configuración
-        config = get_config()
-        logger.info("✅ Config cargada")
+        with metrics.stage("config"):
+            if os.getenv("ENVIRONMENT", "aws") != "local":
+                metrics.instrument_boto3(lazy_import("boto3", "config"))
+            config = get_config()
+            logger.info("✅ Config cargada")
+            
+            # /run manual: mensaje que se irá editando con el análisis en streaming
+            if event.get("trigger") == "manual":
+                live = start_live_message(config)
         
-        # 2. Cargar portfolio y blacklist
-        portfolio, blacklist, rules = load_portfolio(config)
-        logger.info(f"✅ Portfolio cargado: {len(portfolio.get('positions', []))} posiciones")
+        # 2-3. Portfolio, blacklist, reglas, tips, universo y datos de mercado
+        with metrics.stage("inputs"):
+            price_cache = lazy_import("price_cache", "market_data").build_price_cache(config)
+            inputs = load_inputs(config, price_cache)
+            portfolio = inputs["portfolio"]
+            blacklist = inputs["blacklist"]
+            rules = inputs["rules"]
+            tips = inputs["tips"]
+            position_tickers = inputs["position_tickers"]
+            tip_tickers = inputs["tip_tickers"]
+            market_data = inputs["market_data"]
+            history = inputs["history"]
+            logger.info(f"✅ Portfolio cargado: {len(portfolio.get('positions', []))} posiciones")
+            logger.info(f"✅ Datos mercado: {len(market_data)} tickers ({len(inputs['market_errors'])} con error)")
         
-        # 3. Datos mercado
-        market_data = get_market_data(portfolio)
-        logger.info(f"✅ Datos mercado: {len(market_data)} tickers")
+        # 4. Indicadores técnicos y checks anti-FOMO deterministas
+        with metrics.stage("indicators"):
+            indicators = lazy_import("indicators", "indicators").compute_indicators(history)
+            candidates = select_candidates(tip_tickers, indicators, rules)
+            logger.info(f"✅ Indicadores: {len(indicators)} tickers, {len(candidates)}/{len(tip_tickers)} tips pasan")
         
-        # 4. Construir prompt
-        prompt = build_prompt(portfolio, market_data, blacklist, rules)
-        logger.info("✅ Prompt construido")
+        # 4b. Screener del universo → top-N candidatos
+        with metrics.stage("screener"):
+            universe = inputs["universe"]
+            screener = lazy_import("screener", "indicators")
+            shortlist, screened = screener.screen_universe(
+                universe, price_cache, rules.get("analysis_config", {}),
+                exclude=blacklist + position_tickers + tip_tickers,
+                time_budget=screener.time_budget(context)
+            )
+            for ticker in shortlist:
+                indicators[ticker] = screened[ticker]
+                market_data[ticker] = {"current_price": screened[ticker]["close"]}
+            candidates += shortlist
+            logger.info(f"✅ Screener: {len(shortlist)} candidatos de {len(universe)} tickers")
+            save_quotes(config, market_data, price_cache)
         
-        # 5. Análisis Claude
-        analysis = analyze_with_claude(prompt, config)
-        logger.info("✅ Análisis Claude completado")
+        # 4c. Correlaciones y exposición de risk_management
+        with metrics.stage("risk"):
+            # Sin los candidatos del screener si la caché falla: el VaR sigue con las posiciones
+            risk_histories = history
+            try:
+                risk_histories = risk_history(portfolio, history, candidates, price_cache)
+                risk_flags = assess_risk(config, portfolio, market_data, risk_histories, candidates, rules,
+                                         deadline=metadata_deadline(context))
+                logger.info(f"✅ Riesgo: {len(risk_flags)} avisos")
+            except Exception as e:
+                # El análisis sigue sin la sección de riesgo
+                logger.warning(f"⚠️ Error evaluando riesgo: {e}")
+                risk_flags = []
+        
+        # 4d. VaR / CVaR y probabilidad de stop (Monte Carlo)
+        with metrics.stage("var"):
+            try:
+                var_flags = simulate_var(config, portfolio, market_data, risk_histories, candidates, rules)
+                risk_flags += var_flags
+                logger.info(f"✅ VaR: {len(var_flags)} líneas")
+            except Exception as e:
+                logger.warning(f"⚠️ Error en la simulación de VaR: {e}")
+        
+        # 5. Construir prompt (bloque estático cacheable + datos del día)
+        with metrics.stage("prompt"):
+            instructions = build_instructions(blacklist, rules)
+            prompt = build_prompt(portfolio, market_data, indicators, candidates, tips, risk_flags)
+            logger.info("✅ Prompt construido")
+        
+        # 6. Análisis: Opus solo si algo material cambió desde el último completo
+        with metrics.stage("claude"):
+            analysis_config = rules.get("analysis_config", {})
+            input_fingerprint = lazy_import("input_fingerprint", "claude")
+            fingerprint = input_fingerprint.build_fingerprint(portfolio, market_data, tips, candidates)
+            state_store = input_fingerprint.build_store(config)
+            baseline = input_fingerprint.load_baseline(state_store)
+            mode = plan_analysis(event, fingerprint, baseline, analysis_config)
+            
+            if mode == "digest":
+                analysis = input_fingerprint.format_digest(baseline, fingerprint)
+            else:
+                model = CLAUDE_MODEL if mode == "full" else \
+                    analysis_config.get("quiet_day_model", input_fingerprint.DEFAULT_QUIET_MODEL)
+                on_text = (lambda text: live.update(analysis_header() + clean_for_telegram(text) + " ▌")) if live else None
+                analysis = get_analysis(prompt, instructions, config, portfolio, market_data, tips, candidates, model, on_text,
+                                        risk_flags)
+                if mode == "full":
+                    input_fingerprint.save_baseline(state_store, fingerprint, model)
+            logger.info(f"✅ Análisis completado ({mode})")
         
-        # 6. Enviar Telegram
-        header = f"📊 ANÁLISIS - {datetime.now().strftime('%d/%m/%Y %H:%M')} CET\n\n"
-        send_telegram(header + clean_for_telegram(analysis), config)
-        logger.info("✅ Telegram enviado")
+        # 7. Enviar Telegram (texto final siempre limpio)
+        with metrics.stage("telegram"):
+            message_text = analysis_header() + clean_for_telegram(analysis)
+            if live:
+                finish_live_message(live, message_text, config)
+            else:
+                send_telegram(message_text, config)
+            logger.info("✅ Telegram enviado")
         
-        # 7. Guardar resultados
-        save_results(analysis, config, portfolio)
+        # 8. Métricas (línea JSON) y log de ejecución
+        # Coste de imports por etapa (solo se informa en cold start)
+        imports = log_import_report()
+        run_metrics = metrics.finish_run(status="success", mode=mode, imports=imports or None)
+        save_results(analysis, config, portfolio, run_metrics)
         
         logger.info("✅ Ejecución completada con éxito")
         return {"statusCode": 200, "body": "Análisis completado"}
         
     except Exception as e:
         logger.error(f"❌ Error crítico: {e}")
+        if live:
+            finish_live_message(live, f"❌ Error en el análisis: {e}", config)
+        metrics.finish_run(status="error", mode=mode, error=str(e))
         raise e
 
 
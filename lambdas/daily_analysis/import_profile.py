@@ -0,0 +1,121 @@
+import sys
+import time
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# Dependencias pesadas por etapa del pipeline (orden de ejecución)
+STAGES = {
+    "config": ["boto3"],
+    "portfolio": ["portfolio_store"],
+    "market_data": ["numpy", "price_cache", "yfinance", "quote_cache"],
+    "indicators": ["indicators", "screener"],
+    "risk": ["risk", "montecarlo"],
+    "claude": ["anthropic"],
+    "telegram": ["telegram_client"]
+}
+
+# Imports del contenedor: etapa → {"seconds", "modules", "packages"}
+_stages = {}
+# Solo un hilo mide un primer import; el resto espera a que termine.
+# RLock: un módulo puede hacer lazy_import al importarse
+_lock = threading.RLock()
+
+
+# ════════════════════════════════════════
+# MEDICIÓN
+# ════════════════════════════════════════
+
+@contextmanager
+def stage_imports(stage):
+    """Mide el tiempo y los módulos nuevos importados dentro del bloque."""
+    before = set(sys.modules)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        new = set(sys.modules) - before
+        if new:
+            entry = _stages.setdefault(stage, {"seconds": 0.0, "modules": 0, "packages": set()})
+            entry["seconds"] += elapsed
+            entry["modules"] += len(new)
+            entry["packages"].update(name.split(".")[0] for name in new)
+
+
+def lazy_import(name, stage):
+    """Importa un módulo la primera vez que una etapa lo necesita.
+
+    Siempre pasa por importlib.import_module: un módulo que otro hilo aún
+    está importando ya está en sys.modules pero a medias, y import_module
+    espera a su lock. Con el módulo cargado es una consulta a sys.modules.
+    """
+    if name not in sys.modules:
+        with _lock:
+            if name not in sys.modules:
+                with stage_imports(stage):
+                    return importlib.import_module(name)
+    return importlib.import_module(name)
+
+
+# ════════════════════════════════════════
+# INFORME
+# ════════════════════════════════════════
+
+def import_report():
+    """Resumen por etapa, como -X importtime pero agregado. Retorna lista."""
+    return [
+        {
+            "stage": stage,
+            "ms": round(entry["seconds"] * 1000, 1),
+            "modules": entry["modules"],
+            # Paquetes de terceros/proyecto (los de stdlib no aportan al informe)
+            "packages": sorted(p for p in entry["packages"] if p not in sys.stdlib_module_names and not p.startswith("_"))
+        }
+        for stage, entry in _stages.items()
+    ]
+
+
+def log_import_report():
+    """Registra los imports pendientes de informar (solo hay en cold start)."""
+    report = import_report()
+    if not report:
+        return report
+
+    total_ms = sum(row["ms"] for row in report)
+    for row in report:
+        logger.info(f"⏱️ Imports {row['stage']}: {row['ms']} ms, {row['modules']} módulos ({', '.join(row['packages'])})")
+    logger.info(f"⏱️ Imports total: {round(total_ms, 1)} ms")
+
+    _stages.clear()
+    return report
+
+
+def main():
+    """Importa las etapas en orden en un proceso limpio e imprime el informe.
+
+    Uso (desde lambdas/daily_analysis): python3 import_profile.py
+    """
+    for stage, modules in STAGES.items():
+        for name in modules:
+            try:
+                lazy_import(name, stage)
+            except ImportError as e:
+                print(f"⚠️ {stage}: {name} no disponible ({e})")
+
+    report = import_report()
+    print(f"{'Etapa':<14}{'ms':>10}{'módulos':>10}  paquetes")
+    for row in report:
+        print(f"{row['stage']:<14}{row['ms']:>10}{row['modules']:>10}  {', '.join(row['packages'])}")
+    print(f"{'TOTAL':<14}{round(sum(row['ms'] for row in report), 1):>10}")
+
+
+if __name__ == "__main__":
+    import os
+    # Que market_data y compañía registren en este mismo informe
+    sys.modules.setdefault("import_profile", sys.modules[__name__])
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+    main()
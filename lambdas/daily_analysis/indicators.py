@@ -0,0 +1,277 @@
+import warnings
+
+import numpy as np
+
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+EMA_PERIOD = 20
+SMA_SHORT = 50
+SMA_LONG = 200
+VOLUME_PERIOD = 20
+LEVELS_PERIOD = 20
+# Distancia máxima al soporte (en ATRs) para considerarlo "soporte claro"
+SUPPORT_MAX_ATR = 2.0
+
+
+# ════════════════════════════════════════
+# ALINEADO
+# ════════════════════════════════════════
+
+def align_history(history):
+    """Convierte {ticker: bars} en matrices 2-D (tickers × días) sobre un eje común.
+
+    Los huecos (festivos distintos, tickers con menos histórico) quedan a NaN.
+    Retorna (tickers, ts, matrices) con matrices = {"close": 2-D, ...}.
+    """
+    tickers = [t for t, bars in history.items() if len(bars["ts"])]
+    if not tickers:
+        return [], np.array([], dtype="datetime64[s]"), {}
+
+    ts = np.unique(np.concatenate([history[t]["ts"] for t in tickers]))
+    fields = ["open", "high", "low", "close", "volume"]
+    matrices = {f: np.full((len(tickers), len(ts)), np.nan) for f in fields}
+
+    for row, ticker in enumerate(tickers):
+        bars = history[ticker]
+        cols = np.searchsorted(ts, bars["ts"])
+        for f in fields:
+            matrices[f][row, cols] = bars[f]
+
+    return tickers, ts, matrices
+
+
+def ffill(x):
+    """Forward-fill de NaN a lo largo del eje temporal (axis=1)."""
+    valid = ~np.isnan(x)
+    idx = np.where(valid, np.arange(x.shape[1]), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return x[np.arange(x.shape[0])[:, None], idx]
+
+
+# ════════════════════════════════════════
+# INDICADORES (todas las filas a la vez)
+# ════════════════════════════════════════
+
+def sma(x, period):
+    """Media móvil simple ignorando NaN. NaN hasta tener period valores."""
+    valid = ~np.isnan(x)
+    values = np.where(valid, x, 0.0)
+    zeros = np.zeros((x.shape[0], 1))
+    csum = np.concatenate([zeros, np.cumsum(values, axis=1)], axis=1)
+    ccount = np.concatenate([zeros, np.cumsum(valid, axis=1)], axis=1)
+
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] < period:
+        return out
+
+    window_sum = csum[:, period:] - csum[:, :-period]
+    window_count = ccount[:, period:] - ccount[:, :-period]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out[:, period - 1:] = np.where(window_count == period, window_sum / window_count, np.nan)
+    return out
+
+
+def wilder(x, period, alpha=None):
+    """Suavizado exponencial recursivo (Wilder por defecto) sobre axis=1.
+
+    Arranca en la media de los primeros period valores de cada fila; los NaN
+    intermedios mantienen el valor anterior.
+    """
+    alpha = alpha if alpha is not None else 1.0 / period
+    rows, cols = x.shape
+    out = np.full(x.shape, np.nan)
+
+    valid = ~np.isnan(x)
+    seed = sma(x, period)
+    # Primera columna en la que cada fila completa period valores consecutivos
+    has_seed = ~np.isnan(seed)
+    start = np.where(has_seed.any(axis=1), has_seed.argmax(axis=1), cols)
+
+    state = np.full(rows, np.nan)
+    for col in range(cols):
+        seeding = start == col
+        state[seeding] = seed[seeding, col]
+        update = (start < col) & valid[:, col]
+        state[update] = state[update] + alpha * (x[update, col] - state[update])
+        out[:, col] = state
+
+    return out
+
+
+def ema(x, period):
+    """Media móvil exponencial clásica (alpha = 2 / (period + 1))."""
+    return wilder(x, period, alpha=2.0 / (period + 1))
+
+
+def rsi(close, period=RSI_PERIOD):
+    """RSI de Wilder."""
+    close = ffill(close)
+    delta = np.diff(close, axis=1, prepend=np.nan)
+    gains = np.where(np.isnan(delta), np.nan, np.maximum(delta, 0.0))
+    losses = np.where(np.isnan(delta), np.nan, np.maximum(-delta, 0.0))
+
+    avg_gain = wilder(gains, period)
+    avg_loss = wilder(losses, period)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rs = avg_gain / avg_loss
+        out = 100.0 - 100.0 / (1.0 + rs)
+    # Sin pérdidas en la ventana → RSI 100
+    return np.where((avg_loss == 0) & ~np.isnan(avg_gain), 100.0, out)
+
+
+def atr(high, low, close, period=ATR_PERIOD):
+    """Average True Range de Wilder."""
+    prev_close = np.concatenate([np.full((close.shape[0], 1), np.nan), ffill(close)[:, :-1]], axis=1)
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    return wilder(true_range, period)
+
+
+def last_valid(x):
+    """Último valor no NaN de cada fila (NaN si la fila está vacía)."""
+    return ffill(x)[:, -1] if x.shape[1] else np.full(x.shape[0], np.nan)
+
+
+def rolling_levels(high, low, period=LEVELS_PERIOD):
+    """Soporte y resistencia: mínimo/máximo de las últimas period sesiones."""
+    with warnings.catch_warnings():
+        # Filas sin datos en la ventana → NaN (numpy avisa con RuntimeWarning)
+        warnings.simplefilter("ignore", RuntimeWarning)
+        support = np.nanmin(low[:, -period:], axis=1)
+        resistance = np.nanmax(high[:, -period:], axis=1)
+    return support, resistance
+
+
+# ════════════════════════════════════════
+# API
+# ════════════════════════════════════════
+
+INDICATOR_NAMES = ["close", "rsi", "ema20", "sma50", "sma200", "atr", "avg_volume", "support", "resistance"]
+
+
+def indicator_arrays(history):
+    """Último valor de cada indicador como arrays 1-D alineados con tickers.
+
+    history = {ticker: bars} (ver price_cache). Retorna (tickers, columns).
+    """
+    tickers, _, m = align_history(history)
+    if not tickers:
+        return [], {}
+
+    close = m["close"]
+    support, resistance = rolling_levels(m["high"], m["low"])
+
+    columns = {
+        "close": last_valid(close),
+        "rsi": last_valid(rsi(close)),
+        "ema20": last_valid(ema(close, EMA_PERIOD)),
+        "sma50": last_valid(sma(close, SMA_SHORT)),
+        "sma200": last_valid(sma(close, SMA_LONG)),
+        "atr": last_valid(atr(m["high"], m["low"], close)),
+        "avg_volume": last_valid(sma(m["volume"], VOLUME_PERIOD)),
+        "support": support,
+        "resistance": resistance
+    }
+    return tickers, columns
+
+
+def arrays_to_dict(tickers, columns):
+    """{ticker: {indicador: valor}} redondeado, None donde no hay dato."""
+    result = {}
+    for row, ticker in enumerate(tickers):
+        result[ticker] = {
+            name: (None if np.isnan(values[row]) else round(float(values[row]), 2))
+            for name, values in columns.items()
+        }
+    return result
+
+
+def dict_to_arrays(indicators):
+    """Inverso de arrays_to_dict. Retorna (tickers, columns)."""
+    tickers = list(indicators)
+    columns = {
+        name: np.array([np.nan if indicators[t][name] is None else indicators[t][name] for t in tickers], dtype=float)
+        for name in INDICATOR_NAMES
+    }
+    return tickers, columns
+
+
+def compute_indicators(history):
+    """Calcula el último valor de cada indicador para todos los tickers.
+
+    Retorna {ticker: {indicador: valor}}.
+    """
+    tickers, columns = indicator_arrays(history)
+    return arrays_to_dict(tickers, columns)
+
+
+def check_arrays(columns, analysis_config):
+    """Checks técnicos anti-FOMO vectorizados. Retorna dict de arrays booleanos.
+
+    - RSI < analysis_config.max_rsi_buy
+    - Volumen medio 20d > analysis_config.min_volume_daily
+    - Soporte claro: precio por encima del mínimo de 20 sesiones y a menos de
+      SUPPORT_MAX_ATR ATRs de él
+    """
+    max_rsi = analysis_config.get("max_rsi_buy", 70)
+    min_volume = analysis_config.get("min_volume_daily", 1_000_000)
+
+    # Las comparaciones con NaN dan False: sin dato → no pasa
+    with np.errstate(invalid="ignore"):
+        rsi_ok = columns["rsi"] < max_rsi
+        volume_ok = columns["avg_volume"] > min_volume
+        support_ok = (columns["support"] < columns["close"]) & (
+            columns["close"] <= columns["support"] + SUPPORT_MAX_ATR * columns["atr"]
+        )
+
+    return {
+        "rsi_ok": rsi_ok,
+        "volume_ok": volume_ok,
+        "support_ok": support_ok,
+        "passed": rsi_ok & volume_ok & support_ok
+    }
+
+
+def score_arrays(columns, analysis_config):
+    """Puntuación para ordenar candidatos (mayor = mejor).
+
+    Suma cercanía al soporte (en ATRs), margen de RSI hasta max_rsi_buy y
+    un bonus de 0.5 si el precio está sobre la SMA200 (tendencia alcista).
+    """
+    max_rsi = analysis_config.get("max_rsi_buy", 70)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        support_distance = (columns["close"] - columns["support"]) / (SUPPORT_MAX_ATR * columns["atr"])
+        score = (1 - support_distance) + (max_rsi - columns["rsi"]) / max_rsi
+        score = score + np.where(columns["close"] > columns["sma200"], 0.5, 0.0)
+
+    return np.where(np.isnan(score), -np.inf, score)
+
+
+def technical_checks(indicators, analysis_config):
+    """check_arrays sobre {ticker: indicadores}.
+
+    Retorna {ticker: {"rsi_ok", "volume_ok", "support_ok", "passed"}}.
+    """
+    tickers, columns = dict_to_arrays(indicators)
+    if not tickers:
+        return {}
+
+    checks = check_arrays(columns, analysis_config)
+    return {
+        ticker: {name: bool(values[row]) for name, values in checks.items()}
+        for row, ticker in enumerate(tickers)
+    }
+
+
+def format_indicators(ind):
+    """Resumen de una línea para el prompt."""
+    def fmt(value, digits=2):
+        return "n/d" if value is None else f"{value:.{digits}f}"
+
+    volume = "n/d" if ind["avg_volume"] is None else f"{ind['avg_volume'] / 1e6:.1f}M"
+    return (
+        f"RSI {fmt(ind['rsi'], 0)} | EMA20 {fmt(ind['ema20'])} | SMA50 {fmt(ind['sma50'])} "
+        f"| SMA200 {fmt(ind['sma200'])} | ATR {fmt(ind['atr'])} | Vol20 {volume} "
+        f"| S/R {fmt(ind['support'])}/{fmt(ind['resistance'])}"
+    )
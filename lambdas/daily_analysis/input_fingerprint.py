@@ -0,0 +1,135 @@
+import os
+import json
+import logging
+from datetime import datetime, date
+
+from import_profile import lazy_import
+from blob_store import LocalStore, S3Store
+
+logger = logging.getLogger()
+
+BASELINE_NAME = "last_full_analysis.json"
+
+# Valores por defecto de analysis_config
+DEFAULT_MODE = "downgrade"              # off | digest | downgrade
+DEFAULT_PRICE_CHANGE_PCT = 2.0
+DEFAULT_MAX_QUIET_DAYS = 3
+DEFAULT_QUIET_MODEL = "claude-haiku-4-5"
+
+
+# ════════════════════════════════════════
+# HUELLA
+# ════════════════════════════════════════
+
+def build_fingerprint(portfolio, market_data, tips, candidates):
+    """Resumen compacto de las entradas del análisis."""
+    return {
+        "date": date.today().isoformat(),
+        "positions": {p["ticker"]: p["quantity"] for p in portfolio.get("positions", [])},
+        "prices": {
+            ticker: data["current_price"]
+            for ticker, data in sorted(market_data.items())
+            if data.get("current_price")
+        },
+        "tips": sorted(t["ticker"] for t in tips if t.get("ticker")),
+        "candidates": sorted(candidates)
+    }
+
+
+def material_changes(baseline, current, analysis_config):
+    """Motivos por los que hoy merece un análisis completo. Lista vacía = día tranquilo.
+
+    Se compara con el último análisis completo, no con el de ayer, para que
+    varios días seguidos de movimientos pequeños acaben sumando.
+    """
+    if not baseline:
+        return ["sin análisis previo"]
+
+    threshold = analysis_config.get("quiet_price_change_pct", DEFAULT_PRICE_CHANGE_PCT)
+    max_days = analysis_config.get("quiet_max_days", DEFAULT_MAX_QUIET_DAYS)
+    reasons = []
+
+    age = (date.fromisoformat(current["date"]) - date.fromisoformat(baseline["date"])).days
+    if age >= max_days:
+        reasons.append(f"último análisis completo hace {age} días")
+
+    for ticker, quantity in current["positions"].items():
+        if ticker not in baseline["positions"]:
+            reasons.append(f"nueva posición {ticker}")
+        elif baseline["positions"][ticker] != quantity:
+            reasons.append(f"{ticker} cantidad {baseline['positions'][ticker]} → {quantity}")
+    for ticker in baseline["positions"]:
+        if ticker not in current["positions"]:
+            reasons.append(f"posición cerrada {ticker}")
+
+    for ticker in set(current["tips"]) - set(baseline["tips"]):
+        reasons.append(f"nuevo tip {ticker}")
+    for ticker in set(current["candidates"]) - set(baseline["candidates"]):
+        reasons.append(f"nuevo candidato {ticker}")
+
+    for ticker in list(current["positions"]) + current["candidates"]:
+        before = baseline["prices"].get(ticker)
+        now = current["prices"].get(ticker)
+        if before and now:
+            change = (now - before) / before * 100
+            if abs(change) >= threshold:
+                reasons.append(f"{ticker} {change:+.1f}%")
+
+    return reasons
+
+
+def format_digest(baseline, current):
+    """Resumen corto para un día sin cambios materiales (sin llamar a Claude)."""
+    lines = [f"😴 Sin cambios materiales desde el análisis del {baseline['date']}"]
+
+    if current["positions"]:
+        lines.append("")
+        lines.append("💼 POSICIONES")
+        for ticker in current["positions"]:
+            before = baseline["prices"].get(ticker)
+            now = current["prices"].get(ticker)
+            if before and now:
+                lines.append(f"{ticker}: {now}€ ({(now - before) / before * 100:+.1f}% desde entonces)")
+            else:
+                lines.append(f"{ticker}: sin precio")
+
+    if current["candidates"]:
+        lines.append("")
+        lines.append(f"🎯 Candidatos sin cambios: {', '.join(current['candidates'])}")
+
+    lines.append("")
+    lines.append("✅ Mantener el plan del último análisis")
+    return "\n".join(lines)
+
+
+# ════════════════════════════════════════
+# PERSISTENCIA
+# ════════════════════════════════════════
+
+def build_store(config):
+    """S3 (analysis/) en AWS, .cache/analysis en local."""
+    environment = os.getenv("ENVIRONMENT", "aws")
+
+    if environment == "local":
+        return LocalStore(os.getenv("ANALYSIS_STATE_DIR", ".cache/analysis"))
+
+    boto3 = lazy_import("boto3", "claude")
+    s3 = boto3.client("s3", region_name=config["aws_region"])
+    return S3Store(s3, config["s3_bucket"], prefix="analysis/")
+
+
+def load_baseline(store):
+    try:
+        data = store.read(BASELINE_NAME)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo leer la huella anterior: {e}")
+        return None
+    return json.loads(data.decode("utf-8")) if data else None
+
+
+def save_baseline(store, fingerprint, model):
+    entry = dict(fingerprint, model=model, saved=datetime.now().isoformat())
+    try:
+        store.write(BASELINE_NAME, json.dumps(entry, indent=2).encode("utf-8"))
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo guardar la huella: {e}")
@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from import_profile import lazy_import
+from yf_frames import split_frames
+
+logger = logging.getLogger()
+
+# Tickers por llamada a yf.download
+CHUNK_SIZE = 50
+# Chunks descargándose a la vez
+MAX_WORKERS = 4
+# Peticiones/segundo sostenidas hacia Yahoo y ráfaga máxima
+RATE_PER_SECOND = 1.0
+RATE_BURST = 2
+
+
+class TokenBucket:
+    """Rate limiter token-bucket compartido entre hilos."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Bloquea hasta que haya tokens disponibles. Retorna segundos esperados."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+
+                wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+# Un único bucket por contenedor: se mantiene entre invocaciones warm
+rate_limiter = TokenBucket(RATE_PER_SECOND, RATE_BURST)
+
+
+def chunked(items, size):
+    """Divide una lista en trozos de tamaño máximo size."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def download_chunk(tickers, limiter=None, **params):
+    """Descarga OHLCV de varios tickers en una sola petición.
+
+    params se pasan a yf.download (period, start, interval...).
+    Retorna dict {ticker: DataFrame} con las filas sin datos eliminadas.
+    """
+    # yfinance (y pandas) solo se cargan si hay que descargar algo
+    yf = lazy_import("yfinance", "market_data")
+    (limiter or rate_limiter).acquire()
+    metrics.record(calls=1)
+
+    df = yf.download(
+        tickers=tickers,
+        group_by="ticker",
+        auto_adjust=False,
+        threads=False,
+        progress=False,
+        **params
+    )
+    return split_frames(df, tickers)
+
+
+def download_history(tickers, chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS,
+                     limiter=None, **params):
+    """Descarga OHLCV de todos los tickers en chunks paralelos acotados.
+
+    Retorna (frames, errors): {ticker: DataFrame} y {ticker: mensaje}.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    frames = {}
+    errors = {}
+
+    if not tickers:
+        return frames, errors
+
+    chunks = chunked(tickers, chunk_size)
+
+    def run(chunk):
+        try:
+            return chunk, download_chunk(chunk, limiter, **params), None
+        except Exception as e:
+            return chunk, {}, e
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        for chunk, result, error in pool.map(run, chunks):
+            for ticker in chunk:
+                if error is not None:
+                    errors[ticker] = str(error)
+                elif ticker in result:
+                    frames[ticker] = result[ticker]
+                else:
+                    errors[ticker] = "Sin datos"
+
+    return frames, errors
+
+
+def fetch_quotes(tickers, **kwargs):
+    """Precio actual de cada ticker.
+
+    Retorna (market_data, errors) con market_data = {ticker: {"current_price": x}}.
+    """
+    frames, errors = download_history(tickers, period="1d", interval="1d", **kwargs)
+    market_data = {}
+
+    for ticker, frame in frames.items():
+        closes = frame["Close"].dropna()
+        if closes.empty:
+            errors[ticker] = "Sin precio de cierre"
+            continue
+        market_data[ticker] = {
+            "current_price": round(float(closes.iloc[-1]), 2)
+        }
+
+    return market_data, errors
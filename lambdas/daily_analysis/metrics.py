@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+COUNTERS = ("calls", "bytes_in", "bytes_out", "tokens_in", "tokens_out", "cost_usd")
+LOG_PREFIX = "logs/daily_analysis_"
+
+# Ejecución en curso (None fuera de lambda_handler: record() no hace nada)
+_run = None
+_lock = threading.Lock()
+
+
+# ════════════════════════════════════════
+# REGISTRO
+# ════════════════════════════════════════
+
+class RunMetrics:
+    """Métricas de una ejecución: etapa → tiempo y contadores."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.current = None
+
+    def stage_entry(self, name):
+        return self.stages.setdefault(name, dict({"ms": 0.0}, **{c: 0 for c in COUNTERS}))
+
+    def to_dict(self):
+        totals = {c: sum(s[c] for s in self.stages.values()) for c in COUNTERS}
+        totals["ms"] = round((time.time() - self.started) * 1000, 1)
+        totals["cost_usd"] = round(totals["cost_usd"], 6)
+        stages = {
+            name: dict(entry, ms=round(entry["ms"], 1), cost_usd=round(entry["cost_usd"], 6))
+            for name, entry in self.stages.items()
+        }
+        return {"stages": stages, "totals": totals}
+
+
+def start_run():
+    global _run
+    _run = RunMetrics()
+    return _run
+
+
+@contextmanager
+def stage(name):
+    """Mide una etapa del pipeline. Lo que se registre dentro se le atribuye.
+
+    Las etapas van en secuencia en el hilo principal; los hilos de trabajo
+    (I/O concurrente) registran en la etapa activa.
+    """
+    run = _run
+    if run is None:
+        yield
+        return
+
+    previous = run.current
+    run.current = name
+    run.stage_entry(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.stages[name]["ms"] += (time.perf_counter() - start) * 1000
+        run.current = previous
+
+
+def record(**counters):
+    """Suma contadores (calls, bytes_in, tokens_in, cost_usd...) a la etapa activa."""
+    run = _run
+    if run is None:
+        return
+    with _lock:
+        entry = run.stage_entry(run.current or "other")
+        for key, value in counters.items():
+            entry[key] += value or 0
+
+
+def finish_run(**extra):
+    """Emite la línea JSON de métricas y la retorna."""
+    global _run
+    if _run is None:
+        return None
+    data = dict(_run.to_dict(), **extra)
+    _run = None
+    # Línea JSON pura (sin prefijo del logger) para CloudWatch Logs Insights
+    print(json.dumps({"type": "metrics", **data}, ensure_ascii=False))
+    return data
+
+
+# ════════════════════════════════════════
+# INSTRUMENTACIÓN
+# ════════════════════════════════════════
+
+def _on_boto3_send(request, **kwargs):
+    body = request.body
+    record(bytes_out=len(body) if isinstance(body, (bytes, str)) else 0)
+
+
+def _on_boto3_response(http_response, **kwargs):
+    record(calls=1, bytes_in=int(http_response.headers.get("content-length") or 0))
+
+
+def instrument_boto3(boto3):
+    """Cuenta llamadas y bytes de todos los clientes boto3 creados después."""
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session()
+    events = boto3.DEFAULT_SESSION.events
+    events.register("before-send", _on_boto3_send, unique_id="metrics-send")
+    events.register("after-call", _on_boto3_response, unique_id="metrics-response")
+
+
+def instrument_session(session):
+    """Cuenta llamadas y bytes de una requests.Session (p.ej. la de Telegram)."""
+    if getattr(session, "_metrics_hooked", False):
+        return
+
+    def on_response(response, *args, **kwargs):
+        body = response.request.body
+        record(calls=1, bytes_in=len(response.content), bytes_out=len(body) if body else 0)
+
+    session.hooks["response"].append(on_response)
+    session._metrics_hooked = True
+
+
+# ════════════════════════════════════════
+# CONSULTA (p50 / p95 por etapa)
+# ════════════════════════════════════════
+
+def percentile(values, pct):
+    """Percentil por rango más cercano."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def summarize(entries):
+    """entries: logs diarios con "metrics". Retorna {etapa: {n, p50_ms, p95_ms, ...}}."""
+    by_stage = {}
+    for entry in entries:
+        metrics = entry.get("metrics")
+        if not metrics:
+            continue
+        for name, data in list(metrics["stages"].items()) + [("TOTAL", metrics["totals"])]:
+            by_stage.setdefault(name, []).append(data)
+
+    summary = {}
+    for name, rows in by_stage.items():
+        ms = [r["ms"] for r in rows]
+        cost = [r.get("cost_usd", 0) for r in rows]
+        summary[name] = {
+            "n": len(rows),
+            "p50_ms": percentile(ms, 50),
+            "p95_ms": percentile(ms, 95),
+            "p50_cost_usd": percentile(cost, 50),
+            "p95_cost_usd": percentile(cost, 95)
+        }
+    return summary
+
+
+def load_entries_s3(bucket, region="eu-west-1", days=30):
+    import boto3
+    s3 = boto3.client("s3", region_name=region)
+    keys = []
+    params = {"Bucket": bucket, "Prefix": LOG_PREFIX}
+    while True:
+        response = s3.list_objects_v2(**params)
+        keys += [obj["Key"] for obj in response.get("Contents", [])]
+        if not response.get("IsTruncated"):
+            break
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+    return [
+        json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8"))
+        for key in sorted(keys)[-days:]
+    ]
+
+
+def load_entries_dir(path):
+    entries = []
+    for name in sorted(os.listdir(path)):
+        if name.startswith("daily_analysis_") and name.endswith(".json"):
+            with open(os.path.join(path, name)) as f:
+                entries.append(json.load(f))
+    return entries
+
+
+def main(argv):
+    """Uso:
+    python3 metrics.py s3 <bucket> [días]
+    python3 metrics.py dir <carpeta con daily_analysis_*.json>
+    """
+    if len(argv) < 2 or argv[0] not in ("s3", "dir"):
+        print(main.__doc__)
+        return 1
+
+    if argv[0] == "s3":
+        entries = load_entries_s3(argv[1], days=int(argv[2]) if len(argv) > 2 else 30)
+    else:
+        entries = load_entries_dir(argv[1])
+
+    summary = summarize(entries)
+    print(f"{'Etapa':<14}{'n':>4}{'p50 ms':>10}{'p95 ms':>10}{'p50 $':>10}{'p95 $':>10}")
+    for name, row in sorted(summary.items(), key=lambda item: (item[0] == "TOTAL", -item[1]["p50_ms"])):
+        print(f"{name:<14}{row['n']:>4}{row['p50_ms']:>10.0f}{row['p95_ms']:>10.0f}"
+              f"{row['p50_cost_usd']:>10.4f}{row['p95_cost_usd']:>10.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+from handler import get_config, get_s3_client, load_rules_local, send_telegram
+from market_data import fetch_quotes
+import portfolio_store
+import quote_cache
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+STATE_KEY = "monitor/state.json"
+# Segundos que se reutiliza la configuración de Parameter Store en un contenedor warm
+CONFIG_TTL_SECONDS = int(os.getenv("CONFIG_TTL_SECONDS", "300"))
+
+# Estado del contenedor (se conserva entre invocaciones warm)
+_objects = {}        # key S3 → {"etag", "data"}
+_state = None        # {"prices": {ticker: precio}, "alerts": {id_posición: estado}}
+_config_cache = {}   # {"config", "loaded_at"}
+
+
+# ════════════════════════════════════════
+# CARGA INCREMENTAL
+# ════════════════════════════════════════
+
+def load_config():
+    """Configuración del contenedor: SSM (con descifrado) solo al arrancar o cada CONFIG_TTL_SECONDS."""
+    now = time.monotonic()
+    if not _config_cache or now - _config_cache["loaded_at"] >= CONFIG_TTL_SECONDS:
+        _config_cache.update({"config": get_config(), "loaded_at": now})
+    return _config_cache["config"]
+
+
+def load_json_if_changed(s3, bucket, key, default):
+    """Lee JSON de S3 solo si cambió desde la última lectura (If-None-Match)."""
+    cached = _objects.get(key)
+    params = {"Bucket": bucket, "Key": key}
+    if cached:
+        params["IfNoneMatch"] = cached["etag"]
+
+    try:
+        response = s3.get_object(**params)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if cached and code in ("304", "NotModified"):
+            return cached["data"]
+        if code in ("NoSuchKey", "404"):
+            return default
+        raise
+
+    data = json.loads(response["Body"].read().decode("utf-8"))
+    _objects[key] = {"etag": response["ETag"], "data": data}
+    return data
+
+
+def load_state(s3, bucket):
+    """Estado de la última evaluación: en memoria si el contenedor está warm."""
+    global _state
+    if _state is None:
+        _state = load_json_if_changed(s3, bucket, STATE_KEY, default={})
+        _state.setdefault("prices", {})
+        _state.setdefault("alerts", {})
+    return _state
+
+
+def save_state(s3, bucket, state):
+    s3.put_object(
+        Bucket=bucket,
+        Key=STATE_KEY,
+        Body=json.dumps(state, indent=2),
+        ContentType="application/json"
+    )
+
+
+# ════════════════════════════════════════
+# EVALUACIÓN
+# ════════════════════════════════════════
+
+def position_id(position):
+    """Identifica una posición concreta: una reentrada a otro precio es otra posición."""
+    return f"{position['ticker']}@{position['entry_price']}"
+
+
+def classify(pnl_pct, stop_loss, target):
+    if pnl_pct <= stop_loss:
+        return "stop"
+    if pnl_pct >= target:
+        return "target"
+    return "ok"
+
+
+def evaluate_positions(positions, quotes, rules, state):
+    """Evalúa solo las posiciones cuyo precio cambió desde la última vez.
+
+    Retorna lista de alertas nuevas (cruces de umbral). Actualiza state.
+    """
+    stop_loss = rules["trading_rules"]["stop_loss_percent"]
+    target = rules["trading_rules"]["target_profit_percent"]
+    alerts = []
+
+    for pos in positions:
+        ticker = pos["ticker"]
+        price = quotes.get(ticker, {}).get("current_price")
+        pid = position_id(pos)
+
+        if price is None:
+            continue
+        if state["prices"].get(ticker) == price and pid in state["alerts"]:
+            continue
+
+        state["prices"][ticker] = price
+        pnl_pct = round((price - pos["entry_price"]) / pos["entry_price"] * 100, 2)
+        status = classify(pnl_pct, stop_loss, target)
+        previous = state["alerts"].get(pid, "ok")
+        state["alerts"][pid] = status
+
+        if status != "ok" and status != previous:
+            alerts.append({
+                "ticker": ticker,
+                "status": status,
+                "price": price,
+                "entry_price": pos["entry_price"],
+                "pnl_pct": pnl_pct,
+                "threshold": stop_loss if status == "stop" else target
+            })
+
+    # Olvidar posiciones cerradas
+    open_ids = {position_id(p) for p in positions}
+    open_tickers = {p["ticker"] for p in positions}
+    state["alerts"] = {pid: s for pid, s in state["alerts"].items() if pid in open_ids}
+    state["prices"] = {t: p for t, p in state["prices"].items() if t in open_tickers}
+
+    return alerts
+
+
+def format_alert(alert):
+    if alert["status"] == "stop":
+        title = f"🛑 STOP-LOSS {alert['ticker']}"
+    else:
+        title = f"🎯 TARGET {alert['ticker']}"
+
+    return f"""{title}
+Precio: {alert['price']}€ ({alert['pnl_pct']:+}%)
+Entrada: {alert['entry_price']}€
+Umbral: {alert['threshold']:+}%"""
+
+
+# ════════════════════════════════════════
+# ENTRY POINT
+# ════════════════════════════════════════
+
+def lambda_handler(event, context):
+    """Monitor intradía de stop-loss / target. No llama a Claude."""
+    environment = os.getenv("ENVIRONMENT", "aws")
+    config = load_config()
+
+    if environment == "local":
+        s3 = None
+        portfolio = {"positions": []}
+        rules = load_rules_local()
+        state = _state if _state is not None else {"prices": {}, "alerts": {}}
+    else:
+        s3 = get_s3_client(config)
+        bucket = config["s3_bucket"]
+        portfolio = portfolio_store.load_portfolio(s3, bucket)
+        rules = load_json_if_changed(s3, bucket, "config/rules.json", default={})
+        state = load_state(s3, bucket)
+
+    positions = portfolio.get("positions", [])
+    if not positions:
+        logger.info("Sin posiciones que vigilar")
+        return {"statusCode": 200, "body": "Sin posiciones"}
+
+    # Sin rules.json no hay umbrales: mejor no alertar que inventarlos
+    if not {"stop_loss_percent", "target_profit_percent"} <= set(rules.get("trading_rules", {})):
+        logger.error("❌ config/rules.json sin trading_rules: monitor omitido")
+        return {"statusCode": 200, "body": "Sin reglas"}
+
+    quotes, errors = fetch_quotes([p["ticker"] for p in positions])
+    for ticker, error in errors.items():
+        logger.error(f"❌ Error descargando {ticker}: {error}")
+
+    try:
+        quote_cache.build_quote_cache(config, s3).write(
+            {t: q["current_price"] for t, q in quotes.items()}, source="monitor"
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo actualizar la caché de cotizaciones: {e}")
+
+    before = json.dumps(state, sort_keys=True)
+    alerts = evaluate_positions(positions, quotes, rules, state)
+
+    for alert in alerts:
+        send_telegram(format_alert(alert), config)
+        logger.info(f"🚨 Alerta {alert['status']} {alert['ticker']} ({alert['pnl_pct']:+}%)")
+
+    if s3 and json.dumps(state, sort_keys=True) != before:
+        state["updated"] = datetime.now().isoformat()
+        save_state(s3, bucket, state)
+
+    logger.info(f"✅ Monitor: {len(positions)} posiciones, {len(alerts)} alertas")
+    return {"statusCode": 200, "body": f"{len(alerts)} alertas"}
+
+
+# Para testing local
+if __name__ == "__main__":
+    lambda_handler({}, {})
@@ -0,0 +1,203 @@
+import io
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+from blob_store import LocalStore, S3Store
+from import_profile import lazy_import
+from market_data import download_history
+from yf_frames import price_time
+
+logger = logging.getLogger()
+
+COLUMNS = ["open", "high", "low", "close", "volume"]
+YF_COLUMNS = {"open": "Open", "high": "High", "low": "Low", "close": "Close", "volume": "Volume"}
+
+# Segundos que se considera válida la última barra (la de hoy puede estar incompleta)
+DEFAULT_TTL_SECONDS = int(os.getenv("PRICE_CACHE_TTL_SECONDS", "900"))
+# Días de histórico que se mantienen por ticker
+DEFAULT_HISTORY_DAYS = int(os.getenv("PRICE_HISTORY_DAYS", "365"))
+# Lecturas/escrituras de caché en paralelo (I/O a S3)
+IO_WORKERS = 16
+
+
+# ════════════════════════════════════════
+# SERIALIZACIÓN
+# ════════════════════════════════════════
+
+def encode_bars(bars, fetched_at, start):
+    """Serializa barras a .npz comprimido (una columna por array)."""
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        ts=bars["ts"],
+        fetched_at=np.float64(fetched_at),
+        start=np.datetime64(start, "D"),
+        **{col: bars[col] for col in COLUMNS}
+    )
+    return buffer.getvalue()
+
+
+def decode_bars(data):
+    """Inverso de encode_bars. Retorna (bars, fetched_at, start)."""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        bars = {"ts": npz["ts"]}
+        for col in COLUMNS:
+            bars[col] = npz[col]
+        return bars, float(npz["fetched_at"]), npz["start"].astype("datetime64[D]")
+
+
+def frame_to_bars(frame):
+    """Convierte DataFrame de yfinance a dict de arrays columnares."""
+    index = frame.index
+    if getattr(index, "tz", None) is not None:
+        index = index.tz_localize(None)
+
+    bars = {"ts": index.values.astype("datetime64[s]")}
+    for col in COLUMNS:
+        bars[col] = frame[YF_COLUMNS[col]].to_numpy(dtype=np.float64)
+    return bars
+
+
+def merge_bars(cached, fresh):
+    """Añade barras nuevas; las que solapan con la caché se sustituyen."""
+    keep = cached["ts"] < fresh["ts"][0]
+    return {key: np.concatenate([cached[key][keep], fresh[key]]) for key in cached}
+
+
+def slice_bars(bars, start):
+    """Barras desde start (inclusive)."""
+    mask = bars["ts"] >= np.datetime64(start, "s")
+    return {key: values[mask] for key, values in bars.items()}
+
+
+# ════════════════════════════════════════
+# CACHÉ
+# ════════════════════════════════════════
+
+class PriceCache:
+    """Caché incremental de OHLCV por ticker e intervalo.
+
+    Cada ticker se guarda en un .npz columnar. En cada lectura solo se
+    descargan las barras posteriores a la última cacheada; la última barra
+    se vuelve a pedir cuando supera el TTL porque puede estar incompleta.
+    as_of guarda, por ticker servido, (momento del último cierre, descarga).
+    """
+
+    def __init__(self, store, interval="1d", ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.store = store
+        self.interval = interval
+        self.ttl_seconds = ttl_seconds
+        self.as_of = {}
+
+    def name(self, ticker):
+        return f"{self.interval}/{ticker}.npz"
+
+    def load(self, ticker):
+        data = self.store.read(self.name(ticker))
+        if data is None:
+            return None
+        try:
+            return decode_bars(data)
+        except Exception as e:
+            logger.warning(f"⚠️ Caché corrupta para {ticker}, se descarta: {e}")
+            return None
+
+    def save(self, ticker, bars, fetched_at, start):
+        self.store.write(self.name(ticker), encode_bars(bars, fetched_at, start))
+
+    def stamp(self, ticker, bars, fetched_at):
+        """Registra en as_of de cuándo es el último precio servido de ticker."""
+        if len(bars["ts"]):
+            bar_ts = float(bars["ts"][-1].astype("datetime64[s]").astype(np.int64))
+            self.as_of[ticker] = (price_time(bar_ts, fetched_at, self.interval), fetched_at)
+
+    def get_history(self, tickers, days=DEFAULT_HISTORY_DAYS):
+        """OHLCV de los últimos days días para cada ticker.
+
+        Retorna (history, errors): {ticker: bars} y {ticker: mensaje}.
+        """
+        now = time.time()
+        start = date.today() - timedelta(days=days)
+        history = {}
+        errors = {}
+        cached = {}
+        # Agrupar por fecha de inicio para descargar en lote
+        pending = {}
+        to_save = []
+
+        tickers = list(dict.fromkeys(tickers))
+        with ThreadPoolExecutor(max_workers=IO_WORKERS) as pool:
+            entries = list(pool.map(self.load, tickers))
+
+        for ticker, entry in zip(tickers, entries):
+            if entry is None or entry[2] > np.datetime64(start, "D") or len(entry[0]["ts"]) == 0:
+                pending.setdefault(start.isoformat(), []).append(ticker)
+                continue
+
+            bars, fetched_at, _ = entry
+            cached[ticker] = entry
+
+            if now - fetched_at < self.ttl_seconds:
+                history[ticker] = slice_bars(bars, start)
+                self.stamp(ticker, bars, fetched_at)
+                continue
+
+            last_day = str(bars["ts"][-1].astype("datetime64[D]"))
+            pending.setdefault(last_day, []).append(ticker)
+
+        hits = len(history)
+        downloaded = 0
+
+        for fetch_start, group in pending.items():
+            frames, group_errors = download_history(group, start=fetch_start, interval=self.interval)
+
+            for ticker in group:
+                entry = cached.get(ticker)
+
+                if ticker in frames:
+                    fresh = frame_to_bars(frames[ticker])
+                    bars = merge_bars(entry[0], fresh) if entry else fresh
+                    bars = slice_bars(bars, start)
+                    downloaded += len(fresh["ts"])
+                    to_save.append((ticker, bars))
+                    history[ticker] = bars
+                    self.stamp(ticker, bars, now)
+                elif entry:
+                    # Sin red para este ticker: servir lo cacheado aunque esté caducado
+                    history[ticker] = slice_bars(entry[0], start)
+                    self.stamp(ticker, entry[0], entry[1])
+                else:
+                    errors[ticker] = group_errors.get(ticker, "Sin datos")
+
+        def save(item):
+            ticker, bars = item
+            try:
+                self.save(ticker, bars, now, start)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo guardar caché de {ticker}: {e}")
+
+        if to_save:
+            with ThreadPoolExecutor(max_workers=IO_WORKERS) as pool:
+                list(pool.map(save, to_save))
+
+        misses = sum(len(group) for group in pending.values())
+        logger.info(f"📦 Caché precios: {hits} hits, {misses} descargas incrementales, {downloaded} barras nuevas")
+        return history, errors
+
+
+def build_price_cache(config):
+    """Crea la caché según entorno: S3 en AWS, directorio local en local."""
+    environment = os.getenv("ENVIRONMENT", "aws")
+
+    if environment == "local":
+        root = os.getenv("PRICE_CACHE_DIR", ".cache/ohlcv")
+        return PriceCache(LocalStore(root))
+
+    boto3 = lazy_import("boto3", "market_data")
+    s3 = boto3.client("s3", region_name=config["aws_region"])
+    return PriceCache(S3Store(s3, config["s3_bucket"], prefix="cache/ohlcv/"))
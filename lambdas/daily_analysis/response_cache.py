@@ -0,0 +1,114 @@
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+
+from import_profile import lazy_import
+from blob_store import LocalStore, S3Store
+
+logger = logging.getLogger()
+
+# Segundos que una respuesta de Claude sirve para las mismas entradas
+DEFAULT_TTL_SECONDS = int(os.getenv("CLAUDE_CACHE_TTL_SECONDS", "7200"))
+# Variación de precio (%) que se considera "mismo precio" al calcular la clave
+PRICE_TOLERANCE_PCT = float(os.getenv("CLAUDE_CACHE_PRICE_TOLERANCE", "0.5"))
+
+# Respuestas del contenedor: clave → entrada (evita releer del store si está warm)
+_memory = {}
+
+
+# ════════════════════════════════════════
+# CLAVE
+# ════════════════════════════════════════
+
+def price_bucket(price, tolerance_pct=PRICE_TOLERANCE_PCT):
+    """Redondea un precio a escala logarítmica: pasos de tolerance_pct %."""
+    if not price or price <= 0:
+        return None
+    return round(math.log(price) / math.log1p(tolerance_pct / 100))
+
+
+def input_key(instructions, portfolio, market_data, tips, candidates, model,
+              risk_flags=None, tolerance_pct=PRICE_TOLERANCE_PCT):
+    """Hash de las entradas que cambian la respuesta.
+
+    instructions ya incluye reglas y blacklist; risk_flags son las líneas de
+    la sección RIESGO del prompt (exposición, VaR, probabilidad de stop).
+    La fecha/hora no cuenta.
+    """
+    payload = {
+        "model": model,
+        "instructions": hashlib.sha256(instructions.encode("utf-8")).hexdigest(),
+        "positions": sorted(
+            (p["ticker"], p["quantity"], p["entry_price"]) for p in portfolio.get("positions", [])
+        ),
+        "prices": {
+            ticker: price_bucket(data.get("current_price"), tolerance_pct)
+            for ticker, data in sorted(market_data.items())
+        },
+        "tips": sorted((t.get("ticker", ""), t.get("context", "")) for t in tips),
+        "candidates": sorted(candidates),
+        "risk": list(risk_flags or [])
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+# ════════════════════════════════════════
+# CACHÉ
+# ════════════════════════════════════════
+
+class ResponseCache:
+    """Respuestas de Claude por clave de entradas, con TTL."""
+
+    def __init__(self, store, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        """Análisis cacheado o None si no hay / caducó."""
+        entry = _memory.get(key)
+        if entry is None:
+            try:
+                data = self.store.read(f"{key}.json")
+            except Exception as e:
+                logger.warning(f"⚠️ Caché Claude no disponible: {e}")
+                data = None
+            entry = json.loads(data.decode("utf-8")) if data else None
+
+        if entry is None:
+            logger.info("🧠 Caché Claude MISS")
+            return None
+
+        age = time.time() - entry["created"]
+        if age > self.ttl_seconds:
+            logger.info(f"🧠 Caché Claude MISS (caducada hace {age - self.ttl_seconds:.0f}s)")
+            return None
+
+        _memory[key] = entry
+        logger.info(f"🧠 Caché Claude HIT (edad {age:.0f}s)")
+        return entry["analysis"]
+
+    def put(self, key, analysis):
+        entry = {"created": time.time(), "analysis": analysis}
+        _memory[key] = entry
+        try:
+            self.store.write(f"{key}.json", json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+        except Exception as e:
+            # Sin caché se sigue funcionando: solo se pierde el ahorro
+            logger.warning(f"⚠️ No se pudo guardar en caché Claude: {e}")
+
+
+def build_response_cache(config):
+    """Crea la caché según entorno: S3 en AWS, directorio local en local."""
+    environment = os.getenv("ENVIRONMENT", "aws")
+
+    if environment == "local":
+        root = os.getenv("CLAUDE_CACHE_DIR", ".cache/claude")
+        return ResponseCache(LocalStore(root))
+
+    boto3 = lazy_import("boto3", "claude")
+    s3 = boto3.client("s3", region_name=config["aws_region"])
+    return ResponseCache(S3Store(s3, config["s3_bucket"], prefix="cache/claude/"))
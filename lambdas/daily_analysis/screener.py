@@ -0,0 +1,86 @@
+import time
+import logging
+
+import numpy as np
+
+from indicators import indicator_arrays, check_arrays, score_arrays, arrays_to_dict
+from market_data import chunked
+
+logger = logging.getLogger()
+
+# Tickers por lote (descarga + cálculo). Acota memoria: ~100 × 365 × 5 float64 ≈ 1.5 MB
+BATCH_SIZE = 100
+# Segundos máximos de screening sin contexto de Lambda (local, benchmarks)
+TIME_BUDGET_SECONDS = 25
+# Tiempo que se deja a las etapas posteriores (riesgo, Claude, Telegram)
+RESERVE_SECONDS = 30
+DEFAULT_TOP_N = 10
+
+
+def time_budget(context, reserve=RESERVE_SECONDS):
+    """Segundos de screening: lo que le queda a la invocación menos la reserva.
+
+    Así el presupuesto descuenta lo que ya tardaron las etapas anteriores
+    (p.ej. un cold start o una descarga lenta) y sigue al timeout configurado.
+    """
+    remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining is None:
+        return TIME_BUDGET_SECONDS
+    return max(0.0, remaining() / 1000 - reserve)
+
+
+def screen_universe(universe, price_cache, analysis_config, exclude=(),
+                    batch_size=BATCH_SIZE, time_budget=TIME_BUDGET_SECONDS):
+    """Filtra el universo con los checks técnicos y retorna el top-N por puntuación.
+
+    Procesa el universo por lotes: cada lote se descarga (vía caché), se pasa
+    a arrays 2-D y se filtra de forma vectorizada. Solo se guardan las filas
+    que pasan, así la memoria no crece con el tamaño del universo.
+
+    Retorna (shortlist, indicators): lista de tickers ordenada y
+    {ticker: indicadores} de esos tickers.
+    """
+    top_n = analysis_config.get("screener_top_n", DEFAULT_TOP_N)
+    excluded = set(exclude)
+    tickers = [t for t in dict.fromkeys(universe) if t not in excluded]
+
+    started = time.monotonic()
+    passed_tickers = []
+    passed_columns = []
+    passed_scores = []
+    scanned = 0
+
+    for batch in chunked(tickers, batch_size):
+        if time.monotonic() - started > time_budget:
+            logger.warning(f"⏱️ Screener sin tiempo: {scanned}/{len(tickers)} tickers analizados")
+            break
+
+        history, _ = price_cache.get_history(batch)
+        names, columns = indicator_arrays(history)
+        scanned += len(batch)
+        if not names:
+            continue
+
+        passed = check_arrays(columns, analysis_config)["passed"]
+        rows = np.flatnonzero(passed)
+        if len(rows) == 0:
+            continue
+
+        passed_tickers.extend(names[i] for i in rows)
+        passed_columns.append({name: values[rows] for name, values in columns.items()})
+        passed_scores.append(score_arrays(columns, analysis_config)[rows])
+
+    if not passed_tickers:
+        logger.info(f"🔎 Screener: 0/{scanned} pasan checks")
+        return [], {}
+
+    columns = {name: np.concatenate([c[name] for c in passed_columns]) for name in passed_columns[0]}
+    scores = np.concatenate(passed_scores)
+    order = np.argsort(-scores, kind="stable")[:top_n]
+
+    shortlist = [passed_tickers[i] for i in order]
+    indicators = arrays_to_dict(shortlist, {name: values[order] for name, values in columns.items()})
+
+    elapsed = time.monotonic() - started
+    logger.info(f"🔎 Screener: {len(passed_tickers)}/{scanned} pasan checks, top {len(shortlist)} en {elapsed:.1f}s")
+    return shortlist, indicators
@@ -0,0 +1,313 @@
+import os
+import sys
+import copy
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import itertools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from backtest import (
+    Market, entry_signals, simulate, summarize,
+    load_history, load_universe, load_sectors, DEFAULT_CASH_EUR, WARMUP_DAYS
+)
+
+logger = logging.getLogger()
+
+# Valores a probar por defecto (ruta en rules.json → valores)
+DEFAULT_SPACE = {
+    "trading_rules.stop_loss_percent": [-5, -8, -10, -12, -15],
+    "trading_rules.target_profit_percent": [10, 15, 20, 25, 30],
+    "trading_rules.max_positions": [2, 3, 4, 5],
+    "trading_rules.min_cash_reserve_eur": [300, 500, 800],
+    "trading_rules.max_position_size_percent": [25, 33, 40, 50],
+    "risk_management.max_sector_exposure_percent": [40, 60, 100],
+    "risk_management.max_single_country_exposure": [50, 70, 100]
+}
+
+# Lo que usa backtest.simulate cuando rules.json no trae la clave. Los topes
+# de risk_management sin valor no limitan nada y se quedan fuera
+SIMULATOR_DEFAULTS = {
+    "trading_rules.min_cash_reserve_eur": 0,
+    "trading_rules.max_position_size_percent": 100
+}
+
+# Columnas de la tabla por parámetro
+SHORT_NAMES = {
+    "stop_loss_percent": "stop",
+    "target_profit_percent": "target",
+    "max_positions": "pos",
+    "min_cash_reserve_eur": "reserva",
+    "max_position_size_percent": "tamaño",
+    "max_sector_exposure_percent": "sector",
+    "max_single_country_exposure": "país"
+}
+
+# Mayor = mejor
+OBJECTIVES = {
+    "calmar": lambda s: s["cagr_pct"] / max(abs(s["max_drawdown_pct"]), 1.0),
+    "cagr": lambda s: s["cagr_pct"],
+    "return": lambda s: s["total_return_pct"],
+    "profit_factor": lambda s: s["profit_factor"] or 0.0
+}
+
+METRICS = ["cagr_pct", "max_drawdown_pct", "win_rate_pct", "trades", "profit_factor", "total_return_pct"]
+
+
+# ════════════════════════════════════════
+# ESPACIO DE PARÁMETROS
+# ════════════════════════════════════════
+
+def grid(space):
+    """Todas las combinaciones de space."""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_sample(space, samples, seed=42):
+    """samples combinaciones distintas al azar (todo el grid si es menor)."""
+    total = int(np.prod([len(v) for v in space.values()]))
+    if samples >= total:
+        return grid(space)
+
+    rng = random.Random(seed)
+    seen = set()
+    combos = []
+    while len(combos) < samples:
+        combo = {key: rng.choice(values) for key, values in space.items()}
+        key = tuple(combo.values())
+        if key not in seen:
+            seen.add(key)
+            combos.append(combo)
+    return combos
+
+
+def get_param(rules, path):
+    section, name = path.split(".", 1)
+    return rules.get(section, {}).get(name)
+
+
+def current_params(rules, keys):
+    """Valores actuales de keys; los que falten, con el default del simulador o fuera."""
+    current = {}
+    for key in keys:
+        value = get_param(rules, key)
+        if value is None:
+            value = SIMULATOR_DEFAULTS.get(key)
+        if value is not None:
+            current[key] = value
+    return current
+
+
+def apply_params(rules, params):
+    """Copia de rules con los valores de params (rutas "sección.clave")."""
+    rules = copy.deepcopy(rules)
+    for path, value in params.items():
+        section, name = path.split(".", 1)
+        rules.setdefault(section, {})[name] = value
+    return rules
+
+
+# ════════════════════════════════════════
+# WORKERS
+# ════════════════════════════════════════
+
+# Estado de cada proceso del pool (se carga una vez en init_worker)
+_worker = {}
+
+
+def init_worker(directory, rules, initial_cash, start, split):
+    """Abre los arrays compartidos con mmap: el SO comparte las páginas entre procesos."""
+    _worker.update({
+        "market": Market.load(directory),
+        "passed": np.load(os.path.join(directory, "passed.npy"), mmap_mode="r"),
+        "score": np.load(os.path.join(directory, "score.npy"), mmap_mode="r"),
+        "rules": rules,
+        "cash": initial_cash,
+        "start": start,
+        "split": split
+    })
+
+
+def run_params(params):
+    """Backtest de una combinación: periodo de ajuste y, si hay, de validación."""
+    w = _worker
+    rules = apply_params(w["rules"], params)
+    row = dict(params)
+
+    train = summarize(simulate(w["market"], w["passed"], w["score"], rules, w["cash"], w["start"], w["split"]))
+    row.update({name: train[name] for name in METRICS})
+
+    if w["split"] < len(w["market"].ts) - 1:
+        test = summarize(simulate(w["market"], w["passed"], w["score"], rules, w["cash"], w["split"]))
+        row.update({f"oos_{name}": test[name] for name in METRICS})
+    return row
+
+
+def run_sweep(market, passed, score, rules, combos, initial_cash, start, split, workers):
+    """Reparte combos entre procesos. Los precios y señales van por mmap, no por pickle.
+
+    Los .npy se escriben en /dev/shm si existe (memoria compartida) o en el
+    directorio temporal (SWEEP_DIR para cambiarlo).
+    """
+    base = os.getenv("SWEEP_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+    directory = tempfile.mkdtemp(prefix="sweep-", dir=base)
+    try:
+        market.save(directory)
+        np.save(os.path.join(directory, "passed.npy"), passed, allow_pickle=False)
+        np.save(os.path.join(directory, "score.npy"), score, allow_pickle=False)
+
+        chunksize = max(1, len(combos) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(directory, rules, initial_cash, start, split)) as pool:
+            return list(pool.map(run_params, combos, chunksize=chunksize))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# ════════════════════════════════════════
+# RESULTADOS
+# ════════════════════════════════════════
+
+def validated(row):
+    """Sin periodo de validación todo vale; con él, el objetivo ahí debe ser positivo."""
+    return "oos_objective" not in row or (row["oos_objective"] or 0) > 0
+
+
+def rank(rows, objective, min_trades):
+    """Ordena por objetivo en el ajuste. Las que no validan o tienen menos de
+    min_trades operaciones van al final: ajustar bien y perder en la
+    validación es sobreajuste.
+    """
+    score = OBJECTIVES[objective]
+    for row in rows:
+        row["objective"] = round(score(row), 4) if row["trades"] >= min_trades else None
+        if "oos_cagr_pct" in row:
+            row["oos_objective"] = round(score({m: row[f"oos_{m}"] for m in METRICS}), 4)
+
+    def key(row):
+        if row["objective"] is None:
+            return (False, -np.inf)
+        return (validated(row), row["objective"])
+
+    return sorted(rows, key=key, reverse=True)
+
+
+def write_csv(path, rows, keys):
+    columns = keys + ["objective"] + METRICS
+    if "oos_objective" in rows[0]:
+        columns += ["oos_objective"] + [f"oos_{m}" for m in METRICS]
+    with open(path, "w") as f:
+        f.write(",".join(columns) + "\n")
+        for row in rows:
+            f.write(",".join("" if row.get(c) is None else str(row.get(c)) for c in columns) + "\n")
+
+
+def print_table(rows, keys, current, top):
+    names = [SHORT_NAMES.get(k.split(".", 1)[1], k) for k in keys]
+    oos = "oos_cagr_pct" in rows[0]
+    header = "".join(f"{n:>8}" for n in names) + f"{'obj':>8}{'CAGR%':>8}{'DD%':>8}{'win%':>7}{'ops':>6}"
+    if oos:
+        header += f"{'obj val':>9}{'CAGR% val':>11}{'DD% val':>9}"
+    print(f"{'#':>4}{header}")
+
+    for position, row in enumerate(rows[:top], 1):
+        line = "".join(f"{row.get(k, '-'):>8}" for k in keys)
+        objective = "n/d" if row["objective"] is None else f"{row['objective']:.2f}"
+        line += f"{objective:>8}{row['cagr_pct']:>8}{row['max_drawdown_pct']:>8}{row['win_rate_pct']:>7}{row['trades']:>6}"
+        if oos:
+            line += f"{row['oos_objective']:>9.2f}{row['oos_cagr_pct']:>11}{row['oos_max_drawdown_pct']:>9}"
+        if all(row.get(k) == current.get(k) for k in keys):
+            line += "  ← actual"
+        elif not validated(row):
+            line += "  ⚠️ no valida"
+        print(f"{position:>4}{line}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Barrido de parámetros de rules.json con backtest en paralelo")
+    parser.add_argument("--rules", default="config/rules.json.example")
+    parser.add_argument("--universe", default="config/universe.txt.example")
+    parser.add_argument("--years", type=float, default=10)
+    parser.add_argument("--cash", type=float, default=DEFAULT_CASH_EUR)
+    parser.add_argument("--bucket", help="caché de precios en S3 en vez de local")
+    parser.add_argument("--sectors", help="CSV ticker,sector para max_sector_exposure_percent")
+    parser.add_argument("--space", help="JSON {\"sección.clave\": [valores]} (por defecto DEFAULT_SPACE)")
+    parser.add_argument("--grid", action="store_true", help="todas las combinaciones en vez de muestreo")
+    parser.add_argument("--samples", type=int, default=200, help="combinaciones al azar (sin --grid)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--holdout", type=float, default=0.3,
+                        help="fracción final del periodo reservada para validar (0 = ninguna)")
+    parser.add_argument("--objective", choices=sorted(OBJECTIVES), default="calmar")
+    parser.add_argument("--min-trades", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--out", default="sweep_results.csv")
+    parser.add_argument("--recommend", default="rules.recommended.json")
+    args = parser.parse_args(argv)
+
+    with open(args.rules) as f:
+        rules = json.load(f)
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    if not args.sectors:
+        # Sin mapa de sectores el tope sectorial no cambia nada: no se barre
+        space = {k: v for k, v in space.items() if k != "risk_management.max_sector_exposure_percent"}
+    keys = list(space)
+
+    combos = grid(space) if args.grid else random_sample(space, args.samples, args.seed)
+    # La configuración actual siempre entra como referencia
+    current = current_params(rules, keys)
+    if current not in combos:
+        combos.append(current)
+
+    started = time.perf_counter()
+    history = load_history(load_universe(args.universe), int(args.years * 365) + WARMUP_DAYS, args.bucket)
+    market = Market.from_history(history, load_sectors(args.sectors) if args.sectors else None)
+    passed, score = entry_signals(market, rules.get("analysis_config", {}))
+
+    start_date = np.datetime64("today", "D") - np.timedelta64(int(args.years * 365), "D")
+    start = int(np.searchsorted(market.ts, start_date.astype("datetime64[s]")))
+    split = start + int((len(market.ts) - start) * (1 - args.holdout))
+    prepared = time.perf_counter()
+
+    print(f"🧪 {len(combos)} combinaciones × {len(market.tickers)} tickers en {args.workers} procesos")
+    rows = run_sweep(market, passed, score, rules, combos, args.cash, start, split, args.workers)
+    elapsed = time.perf_counter() - prepared
+    rows = rank(rows, args.objective, args.min_trades)
+
+    print(f"Ajuste: {market.ts[start].astype('datetime64[D]')} → {market.ts[split - 1].astype('datetime64[D]')}"
+          + (f" | validación: {market.ts[split].astype('datetime64[D]')} → {market.ts[-1].astype('datetime64[D]')}"
+             if split < len(market.ts) - 1 else ""))
+    print_table(rows, keys, current, args.top)
+
+    write_csv(args.out, rows, keys)
+    best = rows[0]
+    if best["objective"] is None:
+        print(f"❌ Ninguna combinación llega a {args.min_trades} operaciones: sin recomendación")
+        return 1
+    if not validated(best):
+        print("❌ Ninguna combinación mantiene un objetivo positivo en la validación: sin recomendación")
+        return 1
+
+    recommended = apply_params(rules, {key: best[key] for key in keys if key in best})
+    with open(args.recommend, "w") as f:
+        json.dump(recommended, f, indent=4, ensure_ascii=False)
+        f.write("\n")
+
+    print(f"✅ Tabla: {args.out} | rules.json recomendado: {args.recommend}")
+    print(f"⏱️ Datos {prepared - started:.1f}s, barrido {elapsed:.1f}s ({len(combos) / elapsed:.1f} backtests/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,51 @@
+import os
+
+
+# ════════════════════════════════════════
+# BACKENDS
+# ════════════════════════════════════════
+
+class LocalStore:
+    """Guarda ficheros en un directorio local (/tmp en Lambda)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def read(self, name):
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+class S3Store:
+    """Guarda ficheros en S3 bajo un prefijo."""
+
+    def __init__(self, s3_client, bucket, prefix):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def read(self, name):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + name)
+            return response["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def write(self, name, data):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self.prefix + name,
+            Body=data,
+            ContentType="application/octet-stream"
+        )
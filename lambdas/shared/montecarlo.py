@@ -0,0 +1,280 @@
+import io
+import os
+import math
+import time
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# Escenarios por simulación y horizonte (sesiones) del VaR largo y del stop
+PATHS = int(os.getenv("MC_PATHS", "1000000"))
+HORIZON_DAYS = int(os.getenv("MC_HORIZON_DAYS", "10"))
+SEED = int(os.getenv("MC_SEED", "42"))
+METHOD = os.getenv("MC_METHOD", "bootstrap")
+METHODS = ("bootstrap", "cov")
+# 0 = un proceso por CPU
+WORKERS = int(os.getenv("MC_WORKERS", "0"))
+# Sesiones de rentabilidades que guarda el análisis diario
+HISTORY_DAYS = int(os.getenv("MC_HISTORY_DAYS", "250"))
+# Escenarios por bloque: ~20 MB por array con 10 posiciones y 10 días
+CHUNK_PATHS = 25_000
+# Por debajo de esto no hay cola que estimar
+MIN_HISTORY_DAYS = 20
+CONFIDENCES = (95, 99)
+RETURNS_NAME = "returns.npz"
+
+
+# ════════════════════════════════════════
+# HISTÓRICO DE RENTABILIDADES
+# ════════════════════════════════════════
+
+def log_returns(closes):
+    """Rentabilidades logarítmicas diarias (tickers × días-1). NaN donde falte precio."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.log(closes[:, 1:] / closes[:, :-1])
+
+
+def save_returns(store, tickers, ts, closes, days=HISTORY_DAYS):
+    """Guarda las últimas days rentabilidades (closes = tickers × días, con ffill)."""
+    returns = log_returns(closes)[:, -days:]
+    buffer = io.BytesIO()
+    np.savez(
+        buffer, tickers=np.array(tickers, dtype="U16"),
+        dates=np.asarray(ts).astype("datetime64[D]")[1:][-days:], returns=returns.T
+    )
+    store.write(RETURNS_NAME, buffer.getvalue())
+
+
+def load_returns(store):
+    """(tickers, dates, returns días × tickers) o None si el análisis diario aún no lo guardó."""
+    data = store.read(RETURNS_NAME)
+    if not data:
+        return None
+    arrays = np.load(io.BytesIO(data), allow_pickle=False)
+    return [str(t) for t in arrays["tickers"]], arrays["dates"], arrays["returns"]
+
+
+# ════════════════════════════════════════
+# SIMULACIÓN
+# ════════════════════════════════════════
+
+def simulate_chunk(task):
+    """Un bloque de escenarios. Todo vectorizado: (días × escenarios × posiciones).
+
+    El día va en el primer eje para que la suma acumulada y el mínimo
+    recorran memoria contigua. Retorna (P&L 1 día, P&L horizonte, drawdown
+    máximo, escenarios que tocan el stop por posición); los arrays por
+    escenario van en float32 para reducir lo que cruza el pipe.
+    """
+    rng = np.random.default_rng(task["seed"])
+    paths, horizon = task["paths"], task["horizon"]
+    returns = task["returns"]
+    n = returns.shape[1]
+
+    if task["method"] == "bootstrap":
+        # Días completos del histórico: conserva la correlación y las colas reales
+        steps = returns[rng.integers(0, len(returns), size=(horizon, paths))]
+    else:
+        normal = rng.standard_normal((horizon * paths, n))
+        steps = (normal @ task["chol"].T).reshape(horizon, paths, n)
+        steps += task["mean"]
+
+    # Precio relativo al de hoy en cada día del horizonte
+    np.cumsum(steps, axis=0, out=steps)
+    np.exp(steps, out=steps)
+
+    values = steps @ task["values"]
+    invested = task["values"].sum()
+    equity = values + task["cash"]
+    peak = np.maximum.accumulate(np.maximum(equity, invested + task["cash"]), axis=0)
+    drawdown = (1 - equity / peak).max(axis=0)
+    hits = (steps.min(axis=0) <= task["stops"]).sum(axis=0)
+
+    return (
+        (values[0] - invested).astype(np.float32),
+        (values[-1] - invested).astype(np.float32),
+        drawdown.astype(np.float32),
+        hits
+    )
+
+
+def _worker(conn, tasks):
+    try:
+        for index, task in tasks:
+            conn.send((index, simulate_chunk(task)))
+    except Exception as e:
+        conn.send((None, repr(e)))
+    finally:
+        conn.close()
+
+
+def run_chunks(tasks, workers):
+    """Reparte los bloques entre workers procesos y los devuelve en orden.
+
+    Process + Pipe en vez de ProcessPoolExecutor: Lambda no tiene /dev/shm y
+    los semáforos de multiprocessing.Queue fallan allí. Con fork los
+    procesos heredan las arrays sin serializarlas.
+    """
+    if workers <= 1 or len(tasks) == 1:
+        return [simulate_chunk(task) for task in tasks]
+
+    context = multiprocessing.get_context("fork")
+    indexed = list(enumerate(tasks))
+    connections, processes = [], []
+    for w in range(min(workers, len(tasks))):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_worker, args=(sender, indexed[w::workers]), daemon=True)
+        process.start()
+        sender.close()
+        connections.append(receiver)
+        processes.append(process)
+
+    results = [None] * len(tasks)
+    error = None
+    pending = list(connections)
+    while pending:
+        for conn in wait(pending):
+            try:
+                index, result = conn.recv()
+            except EOFError:
+                pending.remove(conn)
+                continue
+            if index is None:
+                error = result
+            else:
+                results[index] = result
+
+    for process in processes:
+        process.join()
+    if error or any(r is None for r in results):
+        raise RuntimeError(f"Simulación incompleta: {error or 'un proceso terminó sin resultados'}")
+    return results
+
+
+def tail(losses, confidence):
+    """(VaR, CVaR) de pérdidas positivas al nivel confidence (%)."""
+    var = float(np.percentile(losses, confidence))
+    return var, float(losses[losses >= var].mean())
+
+
+def simulate(returns, values, stops, cash, method=METHOD, paths=PATHS, horizon=HORIZON_DAYS,
+             seed=SEED, workers=WORKERS):
+    """Monte Carlo de la cartera sobre returns (días × posiciones, log).
+
+    values = € a mercado de cada posición; stops = precio del stop / precio
+    actual. Las semillas salen de seed por bloque, así que el resultado es
+    el mismo con cualquier número de procesos.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Método desconocido: {method}")
+    start = time.perf_counter()
+    values = np.asarray(values, dtype=float)
+    stops = np.asarray(stops, dtype=float)
+    workers = workers or os.cpu_count() or 1
+
+    shared = {"method": method, "horizon": horizon, "returns": returns,
+              "values": values, "stops": stops, "cash": cash}
+    if method == "cov":
+        shared["mean"] = returns.mean(axis=0)
+        cov = np.atleast_2d(np.cov(returns, rowvar=False))
+        # Pequeño ajuste en la diagonal por si la matriz no es definida positiva
+        shared["chol"] = np.linalg.cholesky(cov + np.eye(len(cov)) * 1e-12)
+
+    chunks = math.ceil(paths / CHUNK_PATHS)
+    seeds = np.random.SeedSequence(seed).spawn(chunks)
+    tasks = [dict(shared, seed=seeds[i], paths=min(CHUNK_PATHS, paths - i * CHUNK_PATHS))
+             for i in range(chunks)]
+    results = run_chunks(tasks, workers)
+
+    total = cash + values.sum()
+    pnl_1d = np.concatenate([r[0] for r in results])
+    pnl_h = np.concatenate([r[1] for r in results])
+    drawdown = np.concatenate([r[2] for r in results])
+    hits = np.sum([r[3] for r in results], axis=0)
+
+    var = {}
+    for label, pnl in (("1d", pnl_1d), (f"{horizon}d", pnl_h)):
+        var[label] = {}
+        for confidence in CONFIDENCES:
+            v, cv = tail(-pnl, confidence)
+            var[label][confidence] = {"var": v, "cvar": cv, "var_pct": v / total * 100, "cvar_pct": cv / total * 100}
+
+    return {
+        "method": method,
+        "paths": paths,
+        "horizon": horizon,
+        "days": len(returns),
+        "total": total,
+        "invested": float(values.sum()),
+        "var": var,
+        "drawdown": {"p50": float(np.percentile(drawdown, 50)) * 100,
+                     "p95": float(np.percentile(drawdown, 95)) * 100},
+        # Ya por debajo del stop: probabilidad 1
+        "stop_probability": np.where(stops >= 1, 1.0, hits / paths),
+        "workers": min(workers, chunks),
+        "seconds": time.perf_counter() - start
+    }
+
+
+# ════════════════════════════════════════
+# CARTERA
+# ════════════════════════════════════════
+
+def portfolio_risk(history, positions, prices, cash, stop_loss_percent, **options):
+    """Simula las posiciones de la cartera con el histórico guardado.
+
+    history = load_returns(); prices = {ticker: precio actual}. Las
+    posiciones sin histórico quedan fuera (en "missing") y su valor se
+    suma al efectivo, sin riesgo. Retorna None si no hay nada que simular.
+    """
+    tickers, _, returns = history if history else ([], None, np.zeros((0, 0)))
+    column = {t: i for i, t in enumerate(tickers)}
+
+    held = {}
+    for p in positions:
+        price = prices.get(p["ticker"], p["entry_price"])
+        entry = held.setdefault(p["ticker"], {"quantity": 0.0, "cost": 0.0, "price": price})
+        entry["quantity"] += p["quantity"]
+        entry["cost"] += p["quantity"] * p["entry_price"]
+
+    names = [t for t in held if t in column]
+    missing = [t for t in held if t not in column]
+    cash = cash + sum(held[t]["quantity"] * held[t]["price"] for t in missing)
+    if not names:
+        return None, missing
+
+    sample = returns[:, [column[t] for t in names]]
+    sample = sample[~np.isnan(sample).any(axis=1)]
+    if len(sample) < MIN_HISTORY_DAYS:
+        return None, missing
+
+    values = [held[t]["quantity"] * held[t]["price"] for t in names]
+    # Stop sobre el precio medio de entrada, igual que el monitor
+    stops = [(held[t]["cost"] / held[t]["quantity"]) * (1 + stop_loss_percent / 100) / held[t]["price"]
+             for t in names]
+    result = simulate(sample, values, stops, cash, **options)
+    result["tickers"] = names
+    result["stops"] = stops
+    return result, missing
+
+
+def summary_flags(result):
+    """Líneas para la sección RIESGO del prompt."""
+    horizon = f"{result['horizon']}d"
+    v1 = result["var"]["1d"][95]
+    vh = result["var"][horizon][95]
+    flags = [
+        f"VaR 95% 1d: {v1['var']:.0f}€ ({v1['var_pct']:.1f}%), {horizon}: {vh['var']:.0f}€ "
+        f"({vh['var_pct']:.1f}%); CVaR 95% {horizon}: {vh['cvar']:.0f}€ ({vh['cvar_pct']:.1f}%)"
+    ]
+    likely = sorted(
+        ((t, p) for t, p in zip(result["tickers"], result["stop_probability"]) if p >= 0.05),
+        key=lambda item: -item[1]
+    )
+    if likely:
+        flags.append(f"Prob. de tocar stop en {horizon}: " + ", ".join(f"{t} {p * 100:.0f}%" for t, p in likely))
+    return flags
@@ -0,0 +1,248 @@
+import copy
+import json
+import math
+import logging
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+import tax_ledger
+
+logger = logging.getLogger()
+
+SNAPSHOT_KEY = "portfolio/current_positions.json"
+EVENTS_PREFIX = "portfolio/events/"
+DEFAULT_PORTFOLIO = {"positions": [], "cash_eur": 2300}
+COMMISSION_EUR = 1
+# Eventos pendientes a partir de los cuales el webhook compacta por su cuenta
+COMPACT_THRESHOLD = 20
+MAX_RETRIES = 5
+
+# Snapshot cacheado por contenedor: {"etag", "data"}
+_snapshot_cache = {}
+
+
+class PortfolioError(ValueError):
+    """Evento inválido para el estado actual (p.ej. vender más de lo que hay)."""
+
+
+# ════════════════════════════════════════
+# EVENTOS
+# ════════════════════════════════════════
+
+def event_key(seq):
+    return f"{EVENTS_PREFIX}{seq:012d}.json"
+
+
+def make_event(event_type, ticker, quantity, price, commission=COMMISSION_EUR):
+    return {
+        "type": event_type,
+        "ticker": ticker,
+        "quantity": quantity,
+        "price": price,
+        "commission": commission,
+        "ts": datetime.now().isoformat()
+    }
+
+
+def apply_event(portfolio, event):
+    """Aplica un evento buy/sell sobre el portfolio (in place). Lanza PortfolioError.
+
+    Además de la posición agregada (precio medio) mantiene los lotes FIFO
+    y el acumulado fiscal del año en tax_ledger.
+    """
+    ticker = event["ticker"]
+    quantity = event["quantity"]
+    price = event["price"]
+    ts = event["ts"]
+    # NaN o inf dejarían el efectivo inservible para siempre en el log
+    for name, value in (("Cantidad", quantity), ("Precio", price)):
+        if not (math.isfinite(value) and value > 0):
+            raise PortfolioError(f"{name} debe ser un número mayor que 0 ({value})")
+    positions = portfolio.setdefault("positions", [])
+    position = next((p for p in positions if p["ticker"] == ticker), None)
+
+    if event["type"] == "buy":
+        tax_ledger.add_lot(portfolio, event)
+        if position:
+            # Precio medio ponderado
+            total_qty = position["quantity"] + quantity
+            avg_price = ((position["quantity"] * position["entry_price"]) + (quantity * price)) / total_qty
+            position["quantity"] = total_qty
+            position["entry_price"] = round(avg_price, 2)
+            position["last_updated"] = ts
+        else:
+            positions.append({
+                "ticker": ticker,
+                "quantity": quantity,
+                "entry_price": price,
+                "date_open": ts[:10],
+                "last_updated": ts
+            })
+        cost = quantity * price + event["commission"]
+        portfolio["cash_eur"] = round(portfolio.get("cash_eur", 0) - cost, 2)
+
+    elif event["type"] == "sell":
+        if not position:
+            raise PortfolioError(f"No tienes {ticker} en portfolio")
+        if quantity > position["quantity"]:
+            raise PortfolioError(f"Solo tienes {position['quantity']} acciones de {ticker}")
+
+        tax_ledger.record_sale(portfolio, event)
+
+        if quantity == position["quantity"]:
+            positions.remove(position)
+        else:
+            position["quantity"] = round(position["quantity"] - quantity, 4)
+            position["last_updated"] = ts
+        proceeds = quantity * price - event["commission"]
+        portfolio["cash_eur"] = round(portfolio.get("cash_eur", 0) + proceeds, 2)
+
+    else:
+        raise PortfolioError(f"Tipo de evento desconocido: {event['type']}")
+
+    portfolio["last_updated"] = ts
+    portfolio["seq"] = event["seq"]
+    return portfolio
+
+
+# ════════════════════════════════════════
+# LECTURA
+# ════════════════════════════════════════
+
+def load_snapshot(s3, bucket):
+    """Snapshot + ETag. Usa If-None-Match para no re-descargarlo si no cambió."""
+    params = {"Bucket": bucket, "Key": SNAPSHOT_KEY}
+    cached = _snapshot_cache.get(bucket)
+    if cached:
+        params["IfNoneMatch"] = cached["etag"]
+
+    try:
+        response = s3.get_object(**params)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if cached and code in ("304", "NotModified"):
+            return copy.deepcopy(cached["data"]), cached["etag"]
+        if code in ("NoSuchKey", "404"):
+            return copy.deepcopy(DEFAULT_PORTFOLIO), None
+        raise
+
+    data = json.loads(response["Body"].read().decode("utf-8"))
+    data.setdefault("seq", 0)
+    _snapshot_cache[bucket] = {"etag": response["ETag"], "data": data}
+    return copy.deepcopy(data), response["ETag"]
+
+
+def list_events(s3, bucket, after_seq):
+    """Eventos con seq > after_seq, en orden."""
+    keys = []
+    params = {"Bucket": bucket, "Prefix": EVENTS_PREFIX, "StartAfter": event_key(after_seq)}
+    while True:
+        response = s3.list_objects_v2(**params)
+        keys += [obj["Key"] for obj in response.get("Contents", [])]
+        if not response.get("IsTruncated"):
+            break
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+    events = []
+    for key in keys:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        events.append(json.loads(body.decode("utf-8")))
+    return events
+
+
+def load_state(s3, bucket):
+    """Reconstruye el estado: último snapshot + cola de eventos.
+
+    Retorna (portfolio, snapshot_etag, pending_events).
+    """
+    portfolio, etag = load_snapshot(s3, bucket)
+    events = list_events(s3, bucket, portfolio.get("seq", 0))
+
+    for event in events:
+        try:
+            apply_event(portfolio, event)
+        except PortfolioError as e:
+            # Un evento inválido ya escrito no debe bloquear la lectura
+            logger.error(f"❌ Evento {event.get('seq')} ignorado: {e}")
+            portfolio["seq"] = event["seq"]
+
+    return portfolio, etag, len(events)
+
+
+def load_portfolio(s3, bucket):
+    """Estado actual del portfolio."""
+    return load_state(s3, bucket)[0]
+
+
+# ════════════════════════════════════════
+# ESCRITURA
+# ════════════════════════════════════════
+
+def is_conflict(error):
+    code = error.response.get("Error", {}).get("Code")
+    return code in ("PreconditionFailed", "412", "ConditionalRequestConflict", "409")
+
+
+def append_event(s3, bucket, event):
+    """Añade un evento al log con escritura condicional (If-None-Match: *).
+
+    Si otra invocación escribió el mismo seq, se recarga el estado, se
+    revalida el evento y se reintenta con el siguiente seq.
+    Retorna (before, after, pending_events). Lanza PortfolioError si no es válido.
+    """
+    for attempt in range(MAX_RETRIES):
+        before, _, pending = load_state(s3, bucket)
+        seq = before.get("seq", 0) + 1
+        event = dict(event, seq=seq)
+        after = apply_event(copy.deepcopy(before), event)
+
+        try:
+            s3.put_object(
+                Bucket=bucket,
+                Key=event_key(seq),
+                Body=json.dumps(event, ensure_ascii=False),
+                ContentType="application/json",
+                IfNoneMatch="*"
+            )
+        except ClientError as e:
+            if is_conflict(e):
+                logger.warning(f"⚠️ Conflicto en evento {seq}, reintentando ({attempt + 1})")
+                continue
+            raise
+
+        logger.info(f"✅ Evento {seq} ({event['type']} {event['ticker']}) guardado")
+        return before, after, pending + 1
+
+    raise RuntimeError("No se pudo guardar el evento tras varios reintentos")
+
+
+def compact(s3, bucket):
+    """Pliega la cola de eventos en un nuevo snapshot.
+
+    El snapshot se escribe con If-Match sobre el ETag leído, así dos
+    compactaciones simultáneas no pueden hacer retroceder el estado.
+    Los eventos no se borran (log inmutable); StartAfter hace que leer la
+    cola no dependa de cuántos eventos antiguos haya.
+    """
+    portfolio, etag, pending = load_state(s3, bucket)
+    if pending == 0:
+        return False
+
+    params = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=SNAPSHOT_KEY,
+            Body=json.dumps(portfolio, indent=2, ensure_ascii=False),
+            ContentType="application/json",
+            **params
+        )
+    except ClientError as e:
+        if is_conflict(e):
+            logger.info("Compactación concurrente detectada, se omite")
+            return False
+        raise
+
+    logger.info(f"✅ Snapshot compactado hasta evento {portfolio['seq']} ({pending} eventos)")
+    return True
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+from portfolio_store import is_conflict
+from yf_frames import split_frames, price_time
+
+logger = logging.getLogger()
+
+QUOTES_KEY = "cache/quotes.json"
+# Segundos que una cotización se da por buena; pasado eso se vuelve a pedir
+DEFAULT_TTL_SECONDS = int(os.getenv("QUOTE_TTL_SECONDS", "900"))
+MAX_RETRIES = 3
+
+# Último objeto leído por contenedor: (bucket, key) → {"etag", "data"}
+_objects = {}
+
+
+# ════════════════════════════════════════
+# BACKENDS
+# ════════════════════════════════════════
+
+class S3QuoteStore:
+    """Un único JSON pequeño en S3 compartido por ambas Lambdas."""
+
+    def __init__(self, s3, bucket, key=QUOTES_KEY):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+
+    def load(self):
+        """(data, etag). Con el contenedor warm usa If-None-Match: un 304 no trae cuerpo."""
+        cached = _objects.get((self.bucket, self.key))
+        params = {"Bucket": self.bucket, "Key": self.key}
+        if cached:
+            params["IfNoneMatch"] = cached["etag"]
+
+        try:
+            response = self.s3.get_object(**params)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if cached and code in ("304", "NotModified"):
+                return cached["data"], cached["etag"]
+            if code in ("NoSuchKey", "404"):
+                return {"quotes": {}}, None
+            raise
+
+        data = json.loads(response["Body"].read().decode("utf-8"))
+        _objects[(self.bucket, self.key)] = {"etag": response["ETag"], "data": data}
+        return data, response["ETag"]
+
+    def save(self, data, etag):
+        """Escritura condicional sobre el ETag leído. Lanza ClientError si hubo conflicto."""
+        params = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        response = self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=json.dumps(data, indent=2),
+            ContentType="application/json",
+            **params
+        )
+        if response.get("ETag"):
+            _objects[(self.bucket, self.key)] = {"etag": response["ETag"], "data": data}
+
+
+class LocalQuoteStore:
+    """Fichero local (.cache/quotes.json) para ejecutar sin S3."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {"quotes": {}}, None
+        with open(self.path) as f:
+            return json.load(f), None
+
+    def save(self, data, etag):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+# ════════════════════════════════════════
+# CACHÉ
+# ════════════════════════════════════════
+
+class QuoteCache:
+    """Última cotización conocida por ticker, con su propia marca de tiempo.
+
+    Escriben el análisis diario y el monitor (que ya descargan precios);
+    /portfolio y /balance leen y solo descargan lo que falta o caducó.
+    Cada entrada lleva ts (momento del precio, de la barra) y fetched
+    (cuándo se obtuvo): gana el ts más reciente y el TTL cuenta desde fetched.
+    """
+
+    def __init__(self, store, ttl=DEFAULT_TTL_SECONDS):
+        self.store = store
+        self.ttl = ttl
+
+    def read(self, tickers, now=None):
+        """{ticker: {"price", "ts", "source", "age", "stale"}} de los tickers que estén."""
+        now = now or time.time()
+        data, _ = self.store.load()
+        quotes = {}
+        for ticker in tickers:
+            entry = data.get("quotes", {}).get(ticker)
+            if entry:
+                age = max(0.0, now - entry["ts"])
+                stale = now - entry.get("fetched", entry["ts"]) > self.ttl
+                quotes[ticker] = dict(entry, age=age, stale=stale)
+        return quotes
+
+    def write(self, prices, source, ts=None, fetched=None):
+        """Mezcla {ticker: precio} en el objeto compartido (gana el ts más reciente).
+
+        ts y fetched: epoch común o {ticker: epoch}; por defecto, ahora.
+        """
+        if not prices:
+            return
+        now = time.time()
+        for attempt in range(MAX_RETRIES):
+            data, etag = self.store.load()
+            quotes = dict(data.get("quotes", {}))
+            for ticker, price in prices.items():
+                price_ts = stamp(ts, ticker, now)
+                current = quotes.get(ticker)
+                if current is None or current["ts"] <= price_ts:
+                    quotes[ticker] = {"price": round(float(price), 4), "ts": price_ts,
+                                      "fetched": stamp(fetched, ticker, now), "source": source}
+            try:
+                self.store.save({"quotes": quotes, "updated": datetime.now().isoformat()}, etag)
+                return
+            except ClientError as e:
+                if not is_conflict(e):
+                    raise
+                logger.warning(f"⚠️ Conflicto guardando cotizaciones, reintentando ({attempt + 1})")
+        logger.warning("⚠️ Cotizaciones no guardadas tras varios conflictos")
+
+    def get(self, tickers, fetch=None, source="telegram"):
+        """Cotizaciones de tickers. Las que faltan o caducaron se piden en un solo lote.
+
+        Si la descarga falla se devuelven las caducadas (stale=True) y las
+        que no hay simplemente no aparecen.
+        """
+        quotes = self.read(tickers)
+        missing = [t for t in dict.fromkeys(tickers) if t not in quotes or quotes[t]["stale"]]
+        if not missing:
+            return quotes
+
+        try:
+            fresh = (fetch or fetch_prices)(missing)
+        except Exception as e:
+            logger.error(f"❌ Error descargando cotizaciones: {e}")
+            return quotes
+
+        now = time.time()
+        prices = {ticker: price for ticker, (price, _) in fresh.items()}
+        stamps = {ticker: ts for ticker, (_, ts) in fresh.items()}
+        for ticker, price in prices.items():
+            quotes[ticker] = {"price": round(float(price), 4), "ts": stamps[ticker], "fetched": now,
+                              "source": source, "age": max(0.0, now - stamps[ticker]), "stale": False}
+        try:
+            self.write(prices, source, stamps, now)
+        except Exception as e:
+            # La respuesta ya tiene los precios: la caché es una optimización
+            logger.error(f"❌ Error guardando cotizaciones: {e}")
+        logger.info(f"📦 Cotizaciones: {len(tickers) - len(missing)} en caché, {len(fresh)}/{len(missing)} descargadas")
+        return quotes
+
+
+def stamp(value, ticker, default):
+    """Marca de tiempo de ticker: value puede ser común o {ticker: epoch}."""
+    if isinstance(value, dict):
+        return value.get(ticker, default)
+    return default if value is None else value
+
+
+def fetch_prices(tickers):
+    """Último cierre de cada ticker con una sola llamada a yf.download.
+
+    Retorna {ticker: (precio, ts)} con ts el momento de la barra (price_time).
+    """
+    # yfinance (y pandas) solo se cargan si hay que descargar algo
+    import yfinance as yf
+
+    df = yf.download(
+        tickers=list(tickers),
+        period="5d",
+        interval="1d",
+        group_by="ticker",
+        auto_adjust=False,
+        threads=False,
+        progress=False
+    )
+    now = time.time()
+    prices = {}
+    for ticker, frame in split_frames(df, list(tickers)).items():
+        closes = frame["Close"].dropna()
+        if not closes.empty:
+            bar = closes.index[-1]
+            bar = bar.tz_localize(None) if bar.tzinfo else bar
+            prices[ticker] = (round(float(closes.iloc[-1]), 2), price_time(bar.timestamp(), now))
+    return prices
+
+
+def build_quote_cache(config, s3=None):
+    """S3 (cache/quotes.json) si hay cliente o estamos en AWS; fichero en local."""
+    if s3 is None and os.getenv("ENVIRONMENT", "aws") == "local":
+        return QuoteCache(LocalQuoteStore(os.getenv("QUOTE_CACHE_PATH", ".cache/quotes.json")))
+
+    if s3 is None:
+        import boto3
+        s3 = boto3.client("s3", region_name=config["aws_region"])
+    return QuoteCache(S3QuoteStore(s3, config["s3_bucket"]))
+
+
+def format_age(seconds):
+    """Antigüedad legible: "hace 5 min", "hace 3 h", "hace 2 d"."""
+    if seconds < 60:
+        return "ahora"
+    if seconds < 3600:
+        return f"hace {int(seconds // 60)} min"
+    if seconds < 86400:
+        return f"hace {int(seconds // 3600)} h"
+    return f"hace {int(seconds // 86400)} d"
@@ -0,0 +1,380 @@
+import io
+import os
+import json
+import time
+import logging
+
+import numpy as np
+
+from blob_store import LocalStore, S3Store
+
+logger = logging.getLogger()
+
+# Sesiones de la ventana de rentabilidades diarias
+WINDOW_DAYS = int(os.getenv("RISK_WINDOW_DAYS", "60"))
+STATE_NAME = "state.npz"
+METADATA_NAME = "metadata.json"
+S3_PREFIX = "risk/"
+# Sector/país casi nunca cambian: se vuelven a pedir al mes
+METADATA_TTL_SECONDS = 30 * 86400
+# Tickers sin metadatos que se consultan como mucho por ejecución (yfinance .info es lento)
+METADATA_FETCH_LIMIT = 20
+
+# País por sufijo Yahoo. Sin sufijo = EE.UU.
+COUNTRY_SUFFIXES = {
+    ".DE": "DE", ".F": "DE", ".MC": "ES", ".PA": "FR", ".AS": "NL", ".MI": "IT", ".BR": "BE",
+    ".LS": "PT", ".VI": "AT", ".HE": "FI", ".IR": "IE", ".SW": "CH", ".L": "GB", "-EUR": "CRYPTO"
+}
+# Nombres de país de yfinance (.info["country"]) → mismo código que el sufijo
+COUNTRY_CODES = {
+    "United States": "US", "Germany": "DE", "Spain": "ES", "France": "FR", "Netherlands": "NL",
+    "Italy": "IT", "Belgium": "BE", "Portugal": "PT", "Austria": "AT", "Finland": "FI",
+    "Ireland": "IE", "Switzerland": "CH", "United Kingdom": "GB"
+}
+
+
+def ticker_country(ticker):
+    ticker = ticker.upper()
+    for suffix, country in COUNTRY_SUFFIXES.items():
+        if ticker.endswith(suffix):
+            return country
+    return "US"
+
+
+# ════════════════════════════════════════
+# CORRELACIÓN INCREMENTAL
+# ════════════════════════════════════════
+
+class RollingCorrelation:
+    """Últimas window rentabilidades diarias por ticker y sus sumas.
+
+    returns es un buffer circular (window × n): cada día nuevo sustituye a
+    la fila más antigua y sums / cross (Σr y Σr·rᵀ) se actualizan restando
+    la fila que sale y sumando la que entra, O(n²) por día en vez de
+    O(window·n²). La correlación sale de las sumas sin recorrer la ventana.
+    """
+
+    def __init__(self, window=WINDOW_DAYS):
+        self.window = window
+        self.tickers = []
+        self.dates = np.full(window, np.datetime64("NaT"), dtype="datetime64[D]")
+        self.returns = np.zeros((window, 0))
+        self.sums = np.zeros(0)
+        self.cross = np.zeros((0, 0))
+        self.head = 0        # fila más antigua (la siguiente en salir)
+        self.count = 0       # filas ocupadas
+        self.pushes = 0      # días sumados desde el último recálculo exacto
+
+    @property
+    def last_date(self):
+        return self.dates[(self.head - 1) % self.window] if self.count else None
+
+    def ordered_dates(self):
+        """Fechas de la ventana de la más antigua a la más reciente."""
+        return np.roll(self.dates, -self.head)[self.window - self.count:]
+
+    def recompute(self):
+        """Sumas exactas desde la ventana (corrige el error de redondeo acumulado)."""
+        self.sums = self.returns.sum(axis=0)
+        self.cross = self.returns.T @ self.returns
+        self.pushes = 0
+
+    def push(self, date, row):
+        """Añade las rentabilidades de un día (alineadas con self.tickers)."""
+        row = np.nan_to_num(np.asarray(row, dtype=float))
+        old = self.returns[self.head]
+        self.sums += row - old
+        self.cross += np.outer(row, row) - np.outer(old, old)
+        self.returns[self.head] = row
+        self.dates[self.head] = date
+        self.head = (self.head + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        self.pushes += 1
+        if self.pushes >= self.window:
+            self.recompute()
+
+    def add_ticker(self, ticker, column):
+        """Nueva columna con sus rentabilidades en el orden del buffer. O(window·n)."""
+        column = np.nan_to_num(np.asarray(column, dtype=float))
+        cross_column = self.returns.T @ column
+        n = len(self.tickers)
+
+        cross = np.empty((n + 1, n + 1))
+        cross[:n, :n] = self.cross
+        cross[:n, n] = cross[n, :n] = cross_column
+        cross[n, n] = column @ column
+
+        self.cross = cross
+        self.returns = np.column_stack([self.returns, column])
+        self.sums = np.append(self.sums, column.sum())
+        self.tickers.append(ticker)
+
+    def keep(self, tickers):
+        """Descarta los tickers que no estén en tickers."""
+        wanted = set(tickers)
+        idx = [i for i, t in enumerate(self.tickers) if t in wanted]
+        if len(idx) == len(self.tickers):
+            return
+        self.tickers = [self.tickers[i] for i in idx]
+        self.returns = self.returns[:, idx]
+        self.sums = self.sums[idx]
+        self.cross = self.cross[np.ix_(idx, idx)]
+
+    def correlation(self):
+        """Matriz de correlación (n × n). NaN si algún ticker no varía."""
+        if self.count < 2:
+            return np.full((len(self.tickers),) * 2, np.nan)
+        mean = self.sums / self.count
+        cov = self.cross / self.count - np.outer(mean, mean)
+        std = np.sqrt(np.clip(np.diag(cov), 0, None))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = cov / np.outer(std, std)
+        corr[np.outer(std, std) == 0] = np.nan
+        return np.clip(corr, -1, 1)
+
+    def update(self, tickers, ts, closes):
+        """Lleva la ventana hasta el último día de closes (tickers × días, sin huecos).
+
+        Los días nuevos se añaden de uno en uno; los tickers nuevos se
+        incorporan con su histórico de la ventana actual. Si el estado está
+        vacío o hay un hueco con el último día guardado, se reconstruye.
+        """
+        ts = np.asarray(ts).astype("datetime64[D]")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            daily = closes[:, 1:] / closes[:, :-1] - 1
+        days = ts[1:]
+        if len(days) == 0:
+            return
+
+        last = self.last_date
+        if last is None or last not in days:
+            self.rebuild(tickers, days, daily)
+            return
+
+        self.keep(tickers)
+        window_dates = self.ordered_dates()
+        positions = np.searchsorted(days, window_dates)
+        found = (positions < len(days)) & (days[np.minimum(positions, len(days) - 1)] == window_dates)
+        row_of = {t: i for i, t in enumerate(tickers)}
+
+        for ticker in tickers:
+            if ticker in self.tickers:
+                continue
+            values = np.where(found, daily[row_of[ticker], np.minimum(positions, len(days) - 1)], 0.0)
+            # Mismo orden físico que el buffer circular
+            ordered = np.zeros(self.window)
+            ordered[self.window - self.count:] = values
+            self.add_ticker(ticker, np.roll(ordered, self.head))
+
+        order = [row_of[t] for t in self.tickers]
+        for i in np.nonzero(days > last)[0]:
+            self.push(days[i], daily[order, i])
+
+    def rebuild(self, tickers, days, daily):
+        """Ventana desde cero con los últimos window días."""
+        days = days[-self.window:]
+        daily = daily[:, -self.window:]
+        self.tickers = list(tickers)
+        self.dates = np.full(self.window, np.datetime64("NaT"), dtype="datetime64[D]")
+        self.returns = np.zeros((self.window, len(tickers)))
+        self.count = len(days)
+        self.head = self.count % self.window
+        self.dates[:self.count] = days
+        self.returns[:self.count] = np.nan_to_num(daily.T)
+        self.recompute()
+
+    # ── Serialización ──
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez(
+            buffer, tickers=np.array(self.tickers, dtype="U16"), dates=self.dates,
+            returns=self.returns, sums=self.sums, cross=self.cross,
+            meta=np.array([self.window, self.head, self.count, self.pushes])
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        arrays = np.load(io.BytesIO(data), allow_pickle=False)
+        window, head, count, pushes = (int(v) for v in arrays["meta"])
+        state = cls(window)
+        state.tickers = [str(t) for t in arrays["tickers"]]
+        state.dates = arrays["dates"]
+        state.returns = arrays["returns"]
+        state.sums = arrays["sums"]
+        state.cross = arrays["cross"]
+        state.head, state.count, state.pushes = head, count, pushes
+        return state
+
+
+# ════════════════════════════════════════
+# ALMACENAMIENTO
+# ════════════════════════════════════════
+
+def build_store(config, s3=None):
+    """S3 (risk/) si hay cliente o estamos en AWS; .cache/risk en local."""
+    if s3 is None and os.getenv("ENVIRONMENT", "aws") == "local":
+        return LocalStore(os.getenv("RISK_STATE_DIR", ".cache/risk"))
+    if s3 is None:
+        import boto3
+        s3 = boto3.client("s3", region_name=config["aws_region"])
+    return S3Store(s3, config["s3_bucket"], prefix=S3_PREFIX)
+
+
+def load_state(store):
+    data = store.read(STATE_NAME)
+    return RollingCorrelation.from_bytes(data) if data else RollingCorrelation()
+
+
+def load_metadata(store):
+    data = store.read(METADATA_NAME)
+    return json.loads(data.decode("utf-8")) if data else {}
+
+
+# ════════════════════════════════════════
+# METADATOS (sector / país)
+# ════════════════════════════════════════
+
+def fetch_info(ticker):
+    """Sector y país de yfinance (una petición por ticker)."""
+    import yfinance as yf
+    info = yf.Ticker(ticker).info or {}
+    country = info.get("country")
+    return {
+        "sector": info.get("sector"),
+        "country": COUNTRY_CODES.get(country, country) if country else ticker_country(ticker)
+    }
+
+
+def refresh_metadata(metadata, tickers, fetch=fetch_info, limit=METADATA_FETCH_LIMIT,
+                     deadline=None, limiter=None):
+    """Completa metadata con los tickers que faltan o caducaron. Retorna True si cambió.
+
+    deadline (time.monotonic()) corta las peticiones para no comerse el
+    tiempo de las etapas siguientes; limiter es el rate limiter de Yahoo
+    (market_data.rate_limiter). Lo que quede se pide en la siguiente ejecución.
+    """
+    now = time.time()
+    pending = [t for t in tickers if now - metadata.get(t, {}).get("ts", 0) > METADATA_TTL_SECONDS]
+    fetched = 0
+    for ticker in pending[:limit]:
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.warning(f"⏱️ Metadatos sin tiempo: {fetched}/{len(pending)} tickers consultados")
+            break
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            metadata[ticker] = dict(fetch(ticker), ts=now)
+        except Exception as e:
+            # Sin ts: se reintenta en la siguiente ejecución
+            logger.warning(f"⚠️ Sin metadatos de {ticker}: {e}")
+            metadata[ticker] = {"sector": None, "country": ticker_country(ticker)}
+        fetched += 1
+    return fetched > 0
+
+
+def sector_of(metadata, ticker):
+    return metadata.get(ticker, {}).get("sector")
+
+
+def country_of(metadata, ticker):
+    return metadata.get(ticker, {}).get("country") or ticker_country(ticker)
+
+
+# ════════════════════════════════════════
+# LÍMITES
+# ════════════════════════════════════════
+
+def exposures(values, metadata, total):
+    """% del capital total por sector y por país. values = {ticker: € a mercado}."""
+    by_sector = {}
+    by_country = {}
+    for ticker, value in values.items():
+        sector = sector_of(metadata, ticker)
+        if sector:
+            by_sector[sector] = by_sector.get(sector, 0.0) + value
+        country = country_of(metadata, ticker)
+        by_country[country] = by_country.get(country, 0.0) + value
+    scale = 100 / total if total > 0 else 0
+    return ({k: v * scale for k, v in by_sector.items()},
+            {k: v * scale for k, v in by_country.items()})
+
+
+def correlated_pairs(state, threshold, tickers=None, against=None):
+    """[(a, b, corr)] con corr >= threshold, de mayor a menor.
+
+    tickers limita los pares a esos tickers; against, a pares que incluyan
+    alguno de against (p.ej. candidato frente a posiciones).
+    """
+    corr = state.correlation()
+    index = {t: i for i, t in enumerate(state.tickers)}
+    names = [t for t in (tickers or state.tickers) if t in index]
+    if len(names) < 2:
+        return []
+
+    idx = np.array([index[t] for t in names])
+    sub = corr[np.ix_(idx, idx)]
+    with np.errstate(invalid="ignore"):
+        rows, cols = np.nonzero(np.triu(sub >= threshold, k=1))
+    pairs = [(names[r], names[c], float(sub[r, c])) for r, c in zip(rows, cols)]
+    if against:
+        pairs = [p for p in pairs if p[0] in against or p[1] in against]
+    return sorted(pairs, key=lambda p: -p[2])
+
+
+def limit_breaches(values, metadata, total, risk_rules):
+    """Sectores y países por encima de su límite: [(tipo, nombre, %, límite)]."""
+    sectors, countries = exposures(values, metadata, total)
+    breaches = []
+    max_sector = risk_rules.get("max_sector_exposure_percent")
+    max_country = risk_rules.get("max_single_country_exposure")
+    if max_sector is not None:
+        breaches += [("sector", k, v, max_sector) for k, v in sectors.items() if v > max_sector]
+    if max_country is not None:
+        breaches += [("país", k, v, max_country) for k, v in countries.items() if v > max_country]
+    return breaches
+
+
+def buy_breaches(metadata, values, cash, ticker, amount, risk_rules):
+    """Límites de sector/país que comprar amount € de ticker supera (o agrava).
+
+    values = posiciones a mercado antes de la compra. El capital total no
+    cambia (el efectivo pasa a la posición), así que se compara contra
+    cash + Σ values.
+    """
+    total = cash + sum(values.values())
+    after = dict(values)
+    after[ticker] = after.get(ticker, 0.0) + amount
+    previous = {(kind, name) for kind, name, _, _ in limit_breaches(values, metadata, total, risk_rules)}
+    groups = {("sector", sector_of(metadata, ticker)), ("país", country_of(metadata, ticker))}
+
+    warnings = []
+    for kind, name, pct, limit in limit_breaches(after, metadata, total, risk_rules):
+        if (kind, name) not in groups:
+            continue
+        verb = "sigue por encima del" if (kind, name) in previous else "supera el"
+        warnings.append(f"Exposición {kind} {name}: {pct:.0f}% ({verb} límite {limit}%)")
+    return warnings
+
+
+def check_buy(state, metadata, values, cash, ticker, amount, risk_rules):
+    """Avisos de risk_management para una compra: exposición y correlación con lo que ya hay."""
+    warnings = buy_breaches(metadata, values, cash, ticker, amount, risk_rules)
+
+    threshold = risk_rules.get("max_correlation_alert")
+    held = [t for t in values if t != ticker]
+    if threshold is None or not held:
+        return warnings
+    if ticker not in state.tickers:
+        warnings.append(f"Sin datos de correlación de {ticker} (se calculan en el análisis diario)")
+        return warnings
+
+    for a, b, corr in correlated_pairs(state, threshold / 100, held + [ticker], against={ticker}):
+        other = b if a == ticker else a
+        warnings.append(f"Correlación {ticker}-{other}: {corr * 100:.0f}% (límite {threshold}%)")
+    return warnings
+
+
+def format_pairs(pairs):
+    return ", ".join(f"{a}-{b} {corr * 100:.0f}%" for a, b, corr in pairs)
@@ -0,0 +1,194 @@
+import json
+import logging
+from bisect import bisect_right
+
+logger = logging.getLogger()
+
+RULES_KEY = "config/rules.json"
+
+# Tramos del ahorro por defecto (igual que tax_rates_spain en rules.json.example)
+DEFAULT_TAX_RATES = {
+    "tier_1": {"limit_eur": 6000, "rate_percent": 19},
+    "tier_2": {"limit_eur": 50000, "rate_percent": 21},
+    "tier_3": {"limit_eur": 200000, "rate_percent": 26},
+    "tier_4": {"rate_percent": 28}
+}
+
+
+# ════════════════════════════════════════
+# LOTES FIFO
+# ════════════════════════════════════════
+
+def get_lots(portfolio, ticker):
+    """Cola FIFO de lotes de ticker (índice portfolio["lots"][ticker]).
+
+    Las posiciones anteriores al ledger no tienen lotes: se crea uno con
+    el precio medio y la fecha de apertura de la posición.
+    """
+    lots = portfolio.setdefault("lots", {})
+    if ticker not in lots:
+        position = next((p for p in portfolio.get("positions", []) if p["ticker"] == ticker), None)
+        lots[ticker] = [{
+            "quantity": position["quantity"],
+            "price": position["entry_price"],
+            "commission": 0,
+            "date": position.get("date_open", "")
+        }] if position else []
+    return lots[ticker]
+
+
+def add_lot(portfolio, event):
+    """Cada compra es un lote nuevo al final de la cola."""
+    get_lots(portfolio, event["ticker"]).append({
+        "quantity": event["quantity"],
+        "price": event["price"],
+        "commission": event["commission"],
+        "date": event["ts"][:10]
+    })
+
+
+def consume_lots(portfolio, ticker, quantity):
+    """Saca quantity acciones de los lotes más antiguos.
+
+    Retorna (coste de adquisición, comisiones de compra prorrateadas
+    incluidas en ese coste). El llamador ya validó que hay acciones suficientes.
+    """
+    lots = get_lots(portfolio, ticker)
+    remaining = quantity
+    cost = 0.0
+    commissions = 0.0
+    used = 0
+
+    for lot in lots:
+        if lot["quantity"] <= 0:
+            # Compra de 0 acciones registrada antes de validar: se descarta
+            used += 1
+            continue
+        take = min(remaining, lot["quantity"])
+        share = take / lot["quantity"]
+        commissions += lot["commission"] * share
+        cost += take * lot["price"] + lot["commission"] * share
+        remaining = round(remaining - take, 4)
+
+        if take == lot["quantity"]:
+            used += 1
+        else:
+            lot["commission"] = round(lot["commission"] * (1 - share), 4)
+            lot["quantity"] = round(lot["quantity"] - take, 4)
+        if remaining <= 0:
+            break
+
+    # Lotes agotados: un solo slice por venta
+    del lots[:used]
+    if not lots:
+        del portfolio["lots"][ticker]
+    return cost, commissions
+
+
+# ════════════════════════════════════════
+# ACUMULADOS POR AÑO
+# ════════════════════════════════════════
+
+def empty_year():
+    return {"sales": 0, "proceeds": 0.0, "cost_basis": 0.0, "commissions": 0.0,
+            "gains": 0.0, "losses": 0.0, "net": 0.0}
+
+
+def record_sale(portfolio, event):
+    """Venta FIFO: actualiza lotes y el acumulado del año en O(lotes consumidos).
+
+    proceeds y cost_basis ya llevan las comisiones de venta y compra
+    (commissions suma ambas), así gains/losses son la ganancia patrimonial.
+    """
+    cost, buy_commissions = consume_lots(portfolio, event["ticker"], event["quantity"])
+    proceeds = event["quantity"] * event["price"] - event["commission"]
+    gain = proceeds - cost
+
+    year = portfolio.setdefault("realized", {}).setdefault(event["ts"][:4], empty_year())
+    year["sales"] += 1
+    year["proceeds"] = round(year["proceeds"] + proceeds, 2)
+    year["cost_basis"] = round(year["cost_basis"] + cost, 2)
+    year["commissions"] = round(year["commissions"] + buy_commissions + event["commission"], 2)
+    if gain >= 0:
+        year["gains"] = round(year["gains"] + gain, 2)
+    else:
+        year["losses"] = round(year["losses"] + gain, 2)
+    year["net"] = round(year["gains"] + year["losses"], 2)
+    return year
+
+
+def get_year(portfolio, year):
+    return portfolio.get("realized", {}).get(str(year), empty_year())
+
+
+# ════════════════════════════════════════
+# TRAMOS
+# ════════════════════════════════════════
+
+class TaxTiers:
+    """Tramos progresivos de tax_rates_spain con la cuota acumulada en cada límite.
+
+    tax(base) es una búsqueda en una lista de 4 elementos: no depende de
+    cuántas ventas haya en el año.
+    """
+
+    def __init__(self, tax_rates=None):
+        tiers = sorted((tax_rates or DEFAULT_TAX_RATES).values(),
+                       key=lambda t: t.get("limit_eur", float("inf")))
+        self.limits = []
+        self.rates = []
+        self.base_tax = []
+        lower, accumulated = 0.0, 0.0
+        for tier in tiers:
+            rate = tier["rate_percent"] / 100
+            self.limits.append(lower)
+            self.rates.append(rate)
+            self.base_tax.append(accumulated)
+            upper = tier.get("limit_eur", float("inf"))
+            accumulated += (upper - lower) * rate
+            lower = upper
+
+    def index(self, base):
+        return max(0, bisect_right(self.limits, base) - 1)
+
+    def tax(self, base):
+        """Cuota sobre la base del ahorro (0 si es negativa)."""
+        if base <= 0:
+            return 0.0
+        i = self.index(base)
+        return self.base_tax[i] + (base - self.limits[i]) * self.rates[i]
+
+    def marginal(self, net_before, gain):
+        """Impuesto atribuible a una venta: cuota del año después menos antes.
+
+        Negativo si una pérdida compensa ganancias ya realizadas en el año.
+        """
+        return self.tax(net_before + gain) - self.tax(net_before)
+
+    def breakdown(self, base):
+        """[(desde, hasta, tipo %, cuota)] de los tramos que toca base."""
+        rows = []
+        for i, lower in enumerate(self.limits):
+            if base <= lower:
+                break
+            upper = self.limits[i + 1] if i + 1 < len(self.limits) else None
+            top = base if upper is None else min(base, upper)
+            rows.append((lower, upper, round(self.rates[i] * 100, 2), (top - lower) * self.rates[i]))
+        return rows
+
+    def current(self, base):
+        """(tipo marginal %, euros que quedan hasta el siguiente tramo o None)."""
+        i = self.index(max(base, 0))
+        room = self.limits[i + 1] - max(base, 0) if i + 1 < len(self.limits) else None
+        return round(self.rates[i] * 100, 2), room
+
+
+def load_tiers(s3, bucket):
+    """Tramos de config/rules.json (o los de por defecto si no está)."""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=RULES_KEY)
+        rules = json.loads(response["Body"].read().decode("utf-8"))
+    except Exception as e:
+        logger.warning(f"⚠️ rules.json no disponible, tramos por defecto: {e}")
+        rules = {}
+    return TaxTiers(rules.get("tax_rates_spain"))
@@ -0,0 +1,188 @@
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger()
+
+API_URL = "https://api.telegram.org/bot{token}/{method}"
+# Límite de sendMessage (Telegram cuenta unidades UTF-16)
+MAX_MESSAGE_LENGTH = 4096
+# (conexión, lectura) en segundos
+TIMEOUT = (3.05, 10)
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1
+# Mínimo entre ediciones de un mensaje en streaming (Telegram limita ~1/s por chat)
+EDIT_INTERVAL_SECONDS = 1.5
+
+# Sesión del contenedor: reutiliza la conexión TLS entre mensajes e invocaciones
+_session = None
+
+
+class TelegramError(Exception):
+    """Respuesta de error de la Bot API (o reintentos agotados)."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return _session
+
+
+# ════════════════════════════════════════
+# TROCEADO
+# ════════════════════════════════════════
+
+def message_length(text):
+    """Longitud tal y como la cuenta Telegram (emojis fuera del BMP cuentan 2)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def fit_prefix(line, limit):
+    """Número de caracteres de line que caben en limit unidades."""
+    units = 0
+    for i, ch in enumerate(line):
+        units += 2 if ord(ch) > 0xFFFF else 1
+        if units > limit:
+            return i
+    return len(line)
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """Divide text en trozos <= limit cortando por saltos de línea.
+
+    Solo se corta dentro de una línea si esa línea por sí sola no cabe.
+    """
+    if message_length(text) <= limit:
+        return [text]
+
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while message_length(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            cut = fit_prefix(line, limit)
+            chunks.append(line[:cut])
+            line = line[cut:]
+
+        candidate = f"{current}\n{line}" if current else line
+        if message_length(candidate) <= limit:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = line
+
+    if current:
+        chunks.append(current)
+    # Telegram rechaza mensajes vacíos
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+# ════════════════════════════════════════
+# API
+# ════════════════════════════════════════
+
+def call(token, method, payload, max_retries=MAX_RETRIES):
+    """Llama a un método de la Bot API. Retorna el campo result.
+
+    Reintenta con backoff exponencial errores de conexión y 5xx, y en 429
+    espera lo que indica retry_after. No reintenta timeouts de lectura: el
+    mensaje puede haberse entregado y se duplicaría.
+    """
+    url = API_URL.format(token=token, method=method)
+
+    for attempt in range(max_retries + 1):
+        delay = BACKOFF_SECONDS * 2 ** attempt
+        try:
+            response = get_session().post(url, json=payload, timeout=TIMEOUT)
+        except requests.ConnectionError as e:
+            if attempt == max_retries:
+                raise TelegramError(f"Sin conexión con Telegram: {e}")
+            logger.warning(f"⚠️ Telegram {method}: error de conexión, reintento en {delay}s")
+            time.sleep(delay)
+            continue
+
+        if response.status_code == 200:
+            return response.json().get("result")
+
+        if response.status_code == 429:
+            try:
+                delay = response.json().get("parameters", {}).get("retry_after", delay)
+            except ValueError:
+                pass
+        elif response.status_code < 500:
+            raise TelegramError(response.text, response.status_code)
+
+        if attempt == max_retries:
+            raise TelegramError(response.text, response.status_code)
+        logger.warning(f"⚠️ Telegram {method}: HTTP {response.status_code}, reintento en {delay}s")
+        time.sleep(delay)
+
+
+def send_message(token, chat_id, text):
+    """Envía text troceado en mensajes <= 4096. Retorna los mensajes enviados."""
+    chunks = split_message(text)
+    sent = [call(token, "sendMessage", {"chat_id": chat_id, "text": chunk}) for chunk in chunks]
+    if len(chunks) > 1:
+        logger.info(f"✂️ Mensaje dividido en {len(chunks)} partes")
+    return sent
+
+
+class LiveMessage:
+    """Mensaje que se edita a medida que llega texto (p.ej. streaming de Claude).
+
+    update() es best-effort y limitado a una edición cada EDIT_INTERVAL_SECONDS;
+    finish() deja el texto definitivo, troceado si hace falta.
+    """
+
+    def __init__(self, token, chat_id, placeholder, min_interval=EDIT_INTERVAL_SECONDS):
+        self.token = token
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.message_id = call(token, "sendMessage", {"chat_id": chat_id, "text": placeholder})["message_id"]
+        self.text = placeholder
+        self.last_edit = time.monotonic()
+
+    def edit(self, text, max_retries=MAX_RETRIES):
+        # Telegram responde 400 si el texto no cambia
+        if text == self.text:
+            return
+        call(self.token, "editMessageText",
+             {"chat_id": self.chat_id, "message_id": self.message_id, "text": text},
+             max_retries=max_retries)
+        self.text = text
+        self.last_edit = time.monotonic()
+
+    def update(self, text):
+        """Edición intermedia: se omite si es pronto o si Telegram falla."""
+        if time.monotonic() - self.last_edit < self.min_interval:
+            return
+        if message_length(text) > MAX_MESSAGE_LENGTH:
+            text = text[:fit_prefix(text, MAX_MESSAGE_LENGTH - 1)] + "…"
+        try:
+            self.edit(text, max_retries=0)
+        except (TelegramError, requests.RequestException) as e:
+            # call() solo envuelve errores de conexión: un ReadTimeout llega tal
+            # cual y no debe cortar el streaming. Se espera otro intervalo
+            self.last_edit = time.monotonic()
+            logger.warning(f"⚠️ Edición intermedia omitida: {e}")
+
+    def finish(self, text):
+        """Texto final: el primer trozo sustituye al mensaje, el resto va aparte."""
+        # Telegram rechaza mensajes vacíos (p.ej. una respuesta en blanco)
+        chunks = [chunk for chunk in split_message(text) if chunk.strip()]
+        if not chunks:
+            logger.warning("⚠️ Texto final vacío: se deja el último mensaje")
+            return
+        self.edit(chunks[0])
+        for chunk in chunks[1:]:
+            call(self.token, "sendMessage", {"chat_id": self.chat_id, "text": chunk})
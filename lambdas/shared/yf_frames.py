@@ -0,0 +1,38 @@
+# Duración de una barra por intervalo de yfinance
+BAR_SECONDS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600, "1d": 86400, "1wk": 7 * 86400}
+
+
+def split_frames(df, tickers):
+    """{ticker: DataFrame} de un yf.download(group_by="ticker"), sin filas vacías.
+
+    Con un solo ticker yfinance devuelve columnas simples en vez de
+    MultiIndex; los tickers sin datos no aparecen.
+    """
+    frames = {}
+    if df is None or df.empty:
+        return frames
+
+    multi = getattr(df.columns, "nlevels", 1) > 1
+    available = set(df.columns.get_level_values(0)) if multi else set()
+
+    for ticker in tickers:
+        if multi:
+            if ticker not in available:
+                continue
+            frame = df[ticker]
+        else:
+            frame = df
+        frame = frame.dropna(how="all")
+        if not frame.empty:
+            frames[ticker] = frame
+
+    return frames
+
+
+def price_time(bar_ts, fetched_at, interval="1d"):
+    """Momento (epoch) al que corresponde el cierre de una barra.
+
+    Una barra cerrada vale hasta su final; si seguía abierta al descargarla,
+    hasta la descarga. Así un precio de una caché antigua no pasa por nuevo.
+    """
+    return min(fetched_at, bar_ts + BAR_SECONDS.get(interval, 86400))
@@ -1,12 +1,25 @@
 import os
+import sys
 import json
+import math
+import time
 import logging
 from datetime import datetime
 
 import boto3
-import requests
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
+# lambdas/shared va junto al handler en el ZIP; en local se añade al path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+
+import portfolio_store
+import quote_cache
+import stats_aggregates
+import tax_ledger
+import telegram_client
+import trade_history
+
 # Configurar logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -19,8 +32,63 @@ load_dotenv()
 # CONFIGURACIÓN
 # ════════════════════════════════════════
 
+SSM_PARAMETERS = [
+    "/trading-bot/telegram-token",
+    "/trading-bot/telegram-chat-id"
+]
+# Segundos que un contenedor warm reutiliza los parámetros sin volver a SSM
+CONFIG_TTL_SECONDS = int(os.getenv("CONFIG_TTL_SECONDS", "300"))
+# Un objeto vacío por update de Telegram con comando mutating ya ejecutado
+UPDATES_PREFIX = "telegram/updates/"
+# /risk en 256 MB (~1/7 de vCPU) y 30 s: 200k escenarios en un proceso son
+# ~2.5 s de CPU; el millón del análisis diario pasaría de 10 s
+RISK_PATHS = int(os.getenv("MC_PATHS", "200000"))
+RISK_WORKERS = int(os.getenv("MC_WORKERS", "1"))
+
+# Estado del contenedor (se conserva entre invocaciones warm)
+_config_cache = {}   # {"config", "versions", "loaded_at"}
+_clients = {}        # (servicio, región) → cliente boto3
+_cold_start = True
+
+
+def get_client(service, region="eu-west-1"):
+    """Cliente boto3 reutilizado entre invocaciones (conexiones HTTP en pool)."""
+    key = (service, region)
+    if key not in _clients:
+        _clients[key] = boto3.client(service, region_name=region)
+    return _clients[key]
+
+
+def fetch_ssm_config():
+    """Lee y descifra los parámetros de SSM. Retorna (config, versiones)."""
+    params = get_client("ssm").get_parameters(
+        Names=SSM_PARAMETERS,
+        WithDecryption=True
+    )
+    config = {}
+    versions = {}
+    for param in params["Parameters"]:
+        name = param["Name"].split("/")[-1]
+        config[name.replace("-", "_")] = param["Value"]
+        versions[param["Name"]] = param.get("Version")
+
+    config["s3_bucket"] = os.getenv("S3_BUCKET", "trading-system-data")
+    config["aws_region"] = "eu-west-1"
+    return config, versions
+
+
+def invalidate_config():
+    """Fuerza a releer SSM en la siguiente llamada (p.ej. token rotado)."""
+    _config_cache.clear()
+
+
 def get_config():
-    """Lee configuración según entorno."""
+    """Lee configuración según entorno.
+
+    En AWS los parámetros se cachean en el contenedor durante
+    CONFIG_TTL_SECONDS. Al caducar se releen y, si cambió la versión de
+    algún parámetro, se registra el cambio.
+    """
     environment = os.getenv("ENVIRONMENT", "aws")
 
     if environment == "local":
@@ -30,23 +98,19 @@ def get_config():
             "s3_bucket": os.getenv("S3_BUCKET"),
             "aws_region": os.getenv("AWS_REGION", "eu-west-1")
         }
-    else:
-        ssm = boto3.client("ssm", region_name="eu-west-1")
-        params = ssm.get_parameters(
-            Names=[
-                "/trading-bot/telegram-token",
-                "/trading-bot/telegram-chat-id"
-            ],
-            WithDecryption=True
-        )
-        config = {}
-        for param in params["Parameters"]:
-            name = param["Name"].split("/")[-1]
-            config[name.replace("-", "_")] = param["Value"]
 
-        config["s3_bucket"] = os.getenv("S3_BUCKET", "trading-system-data")
-        config["aws_region"] = "eu-west-1"
-        return config
+    now = time.monotonic()
+    if _config_cache and now - _config_cache["loaded_at"] < CONFIG_TTL_SECONDS:
+        return _config_cache["config"]
+
+    config, versions = fetch_ssm_config()
+    previous = _config_cache.get("versions", {})
+    for name, version in versions.items():
+        if name in previous and previous[name] != version:
+            logger.info(f"🔄 Parámetro {name} actualizado: v{previous[name]} → v{version}")
+
+    _config_cache.update({"config": config, "versions": versions, "loaded_at": now})
+    return config
 
 
 # ════════════════════════════════════════
@@ -107,20 +171,17 @@ def save_s3_text(s3_client, bucket, key, text):
 # ════════════════════════════════════════
 
 def send_telegram(message_text, config):
-    """Envía mensaje via Telegram."""
-    token = config["telegram_token"]
-    chat_id = config["telegram_chat_id"]
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-
+    """Envía mensaje via Telegram (troceado si supera 4096 caracteres)."""
     try:
-        response = requests.post(url, json={
-            "chat_id": chat_id,
-            "text": message_text
-        })
-        if response.status_code == 200:
-            logger.info("✅ Telegram mensaje enviado")
+        telegram_client.send_message(config["telegram_token"], config["telegram_chat_id"], message_text)
+        logger.info("✅ Telegram mensaje enviado")
+    except telegram_client.TelegramError as e:
+        if e.status_code == 401:
+            # Token revocado o rotado: no esperar al TTL para releer SSM
+            invalidate_config()
+            logger.error(f"❌ Error Telegram (token inválido): {e}")
         else:
-            logger.error(f"❌ Error Telegram: {response.text}")
+            logger.error(f"❌ Error Telegram: {e}")
     except Exception as e:
         logger.error(f"❌ Error enviando Telegram: {e}")
 
@@ -129,163 +190,121 @@ def send_telegram(message_text, config):
 # ════════════════════════════════════════
 
 def cmd_help():
-    """Retorna mensaje de ayuda con todos los comandos."""
-    return """
-🤖 TRADING ASSISTANT - COMANDOS DISPONIBLES
-
-💰 OPERACIONES
-
-/compro TICKER CANTIDAD PRECIO(€)
-  Registra una compra
-  Ej: /compro AAPL 2 180.50
-
-/vendo TICKER CANTIDAD PRECIO(€)
-  Registra una venta
-  Ej: /vendo AAPL 2 195.00
-
-📊 CONSULTAS
-
-/portfolio
-  Muestra posiciones actuales y P&L
-
-/balance
-  Resumen financiero total
-
-/stats
-  Estadísticas: win rate, mejor/peor trade
-
-🔧 CONFIGURACIÓN
-
-/blacklist TICKER
-  Marca ticker como no disponible en TR
-  Ej: /blacklist PLTR
-
-/remove_blacklist TICKER
-  Elimina ticker de la blacklist
-  Ej: /remove_blacklist PLTR
-
-/blacklists
-  Muestra tickers bloqueados en TR
-
-/tip TICKER RAZÓN
-  Añade recomendación externa para análisis
-  Ej: /tip NVDA Amigo dice que presentan GPU
-
-/remove_tip TICKER
-  Elimina tip externo
-  Ej: /remove_tip NVDA
-
-/tips
-  Muestra tips externos activos
-
-⚡ ACCIONES
-
-/run
-  Lanza análisis manual ahora mismo
-
-/help
-  Muestra este mensaje
-"""
+    """Ayuda generada desde COMMANDS, agrupada por sección."""
+    msg = "\n🤖 TRADING ASSISTANT - COMANDOS DISPONIBLES\n"
+    for section in SECTIONS:
+        msg += f"\n{section}\n"
+        for name, spec in COMMANDS.items():
+            if spec["section"] != section:
+                continue
+            msg += f"\n{usage(name, spec)}\n  {spec['help']}\n"
+            if spec.get("example"):
+                msg += f"  Ej: {spec['example']}\n"
+    return msg
 
 
 def cmd_compro(parts, s3, config):
     """Registra una compra en el portfolio."""
-    if len(parts) != 4:
-        return "❌ Formato incorrecto\nUso: /compro TICKER CANTIDAD PRECIO\nEj: /compro AAPL 2 180.50"
-
     ticker = parts[1].upper()
-    try:
-        quantity = float(parts[2])
-        price = float(parts[3])
-    except ValueError:
-        return "❌ Cantidad y precio deben ser números\nEj: /compro AAPL 2 180.50"
+    quantity = float(parts[2])
+    price = float(parts[3])
 
     bucket = config["s3_bucket"]
-    portfolio = load_s3_json(s3, bucket, "portfolio/current_positions.json",
-                             default={"positions": [], "cash_eur": 2300})
-
-    # Verificar si ya existe posición en ese ticker
-    existing = next((p for p in portfolio["positions"] if p["ticker"] == ticker), None)
-
-    if existing:
-        # Calcular precio medio ponderado
-        total_qty = existing["quantity"] + quantity
-        avg_price = ((existing["quantity"] * existing["entry_price"]) + (quantity * price)) / total_qty
-        existing["quantity"] = total_qty
-        existing["entry_price"] = round(avg_price, 2)
-        existing["last_updated"] = datetime.now().isoformat()
-        msg = f"✅ Posición ampliada\n{ticker}: {total_qty} acc @ {round(avg_price, 2)}€ (precio medio)"
-    else:
-        # Nueva posición
-        portfolio["positions"].append({
-            "ticker": ticker,
-            "quantity": quantity,
-            "entry_price": price,
-            "date_open": datetime.now().strftime("%Y-%m-%d"),
-            "last_updated": datetime.now().isoformat()
-        })
-        msg = f"✅ Compra registrada\n{ticker}: {quantity} acc @ {price}€"
+    event = portfolio_store.make_event("buy", ticker, quantity, price)
+    try:
+        before, portfolio, pending = portfolio_store.append_event(s3, bucket, event)
+    except portfolio_store.PortfolioError as e:
+        return f"❌ {e}"
+    compact_if_needed(s3, bucket, pending)
 
-    # Actualizar efectivo
-    cost = quantity * price + 1  # +1€ comisión TR
-    portfolio["cash_eur"] = round(portfolio.get("cash_eur", 0) - cost, 2)
-    portfolio["last_updated"] = datetime.now().isoformat()
+    position = next(p for p in portfolio["positions"] if p["ticker"] == ticker)
 
-    save_s3_json(s3, bucket, "portfolio/current_positions.json", portfolio)
+    if any(p["ticker"] == ticker for p in before["positions"]):
+        msg = f"✅ Posición ampliada\n{ticker}: {position['quantity']} acc @ {position['entry_price']}€ (precio medio)"
+    else:
+        msg = f"✅ Compra registrada\n{ticker}: {quantity} acc @ {price}€"
 
     msg += f"\nEfectivo restante: {portfolio['cash_eur']}€"
+
+    try:
+        warnings = risk_warnings(s3, config, before, ticker, quantity * price)
+    except Exception as e:
+        # La compra ya está registrada: el aviso es informativo
+        logger.error(f"❌ Error evaluando riesgo: {e}")
+        warnings = []
+    if warnings:
+        msg += "\n\n⚠️ RIESGO\n" + "\n".join(f"- {w}" for w in warnings)
     return msg
 
 
-def cmd_vendo(parts, s3, config):
-    """Registra una venta y calcula P&L."""
-    if len(parts) != 4:
-        return "❌ Formato incorrecto\nUso: /vendo TICKER CANTIDAD PRECIO\nEj: /vendo AAPL 2 195.00"
+def risk_warnings(s3, config, portfolio, ticker, amount):
+    """Límites de risk_management que la compra supera, sobre el portfolio previo.
 
-    ticker = parts[1].upper()
-    try:
-        quantity = float(parts[2])
-        price = float(parts[3])
-    except ValueError:
-        return "❌ Cantidad y precio deben ser números"
+    Usa la ventana de correlaciones y los metadatos que guarda el análisis
+    diario (risk/) y los precios de la caché de cotizaciones.
+    """
+    # numpy solo para este aviso: no penalizar el cold start del resto de comandos
+    import risk
 
     bucket = config["s3_bucket"]
-    portfolio = load_s3_json(s3, bucket, "portfolio/current_positions.json",
-                             default={"positions": [], "cash_eur": 2300})
+    rules = load_s3_json(s3, bucket, "config/rules.json")
+    risk_rules = rules.get("risk_management", {})
+    if not risk_rules:
+        return []
 
-    # Buscar posición
-    position = next((p for p in portfolio["positions"] if p["ticker"] == ticker), None)
+    positions = portfolio.get("positions", [])
+    quotes = get_quotes(s3, config, positions)
+    values = {
+        p["ticker"]: p["quantity"] * quotes.get(p["ticker"], {}).get("price", p["entry_price"])
+        for p in positions
+    }
+    store = risk.build_store(config, s3)
+    state = risk.load_state(store)
+    metadata = risk.load_metadata(store)
+    return risk.check_buy(state, metadata, values, portfolio.get("cash_eur", 0), ticker, amount, risk_rules)
 
-    if not position:
-        return f"❌ No tienes {ticker} en portfolio"
 
-    if quantity > position["quantity"]:
-        return f"❌ Solo tienes {position['quantity']} acciones de {ticker}"
+def cmd_vendo(parts, s3, config):
+    """Registra una venta y calcula P&L."""
+    ticker = parts[1].upper()
+    quantity = float(parts[2])
+    price = float(parts[3])
+    # El log es inmutable: validar antes de escribir el evento
+    if quantity <= 0 or price <= 0:
+        return "❌ Cantidad y precio deben ser mayores que 0"
+
+    bucket = config["s3_bucket"]
+    event = portfolio_store.make_event("sell", ticker, quantity, price)
 
-    # Calcular P&L
-    entry_price = position["entry_price"]
-    gross_pnl = (price - entry_price) * quantity
-    costs = 2  # 2€ comisiones (entrada ya pagada + salida)
-    net_before_tax = gross_pnl - costs
-    tax = max(0, net_before_tax * 0.19)  # Solo si hay ganancia
+    try:
+        before, portfolio, pending = portfolio_store.append_event(s3, bucket, event)
+    except portfolio_store.PortfolioError as e:
+        return f"❌ {e}"
+    compact_if_needed(s3, bucket, pending)
+
+    position = next(p for p in before["positions"] if p["ticker"] == ticker)
+    # Lote más antiguo que se vende (FIFO)
+    date_open = next((lot["date"] for lot in tax_ledger.get_lots(before, ticker) if lot["quantity"] > 0), "")
+
+    # P&L FIFO: diferencia del acumulado del año antes/después del evento
+    year = event["ts"][:4]
+    year_before = tax_ledger.get_year(before, year)
+    year_after = tax_ledger.get_year(portfolio, year)
+    proceeds = year_after["proceeds"] - year_before["proceeds"]
+    cost_basis = year_after["cost_basis"] - year_before["cost_basis"]
+    costs = round(year_after["commissions"] - year_before["commissions"], 2)
+    net_before_tax = proceeds - cost_basis
+    gross_pnl = net_before_tax + costs
+    entry_price = round((cost_basis - (costs - event["commission"])) / quantity, 4)
+
+    # Impuesto marginal según tramos: cuota del año con la venta menos sin ella
+    tiers = tax_ledger.load_tiers(s3, bucket)
+    tax = tiers.marginal(year_before["net"], net_before_tax)
     net_pnl = round(net_before_tax - tax, 2)
     pnl_pct = round(((price - entry_price) / entry_price) * 100, 2)
+    rate, _ = tiers.current(year_after["net"])
 
-    # Actualizar portfolio
-    if quantity == position["quantity"]:
-        portfolio["positions"].remove(position)
-        status = "cerrada"
-    else:
-        position["quantity"] = round(position["quantity"] - quantity, 4)
-        position["last_updated"] = datetime.now().isoformat()
-        status = "parcial"
-
-    # Actualizar efectivo
-    proceeds = quantity * price - 1  # -1€ comisión TR
-    portfolio["cash_eur"] = round(portfolio.get("cash_eur", 0) + proceeds, 2)
-    portfolio["last_updated"] = datetime.now().isoformat()
-
-    save_s3_json(s3, bucket, "portfolio/current_positions.json", portfolio)
+    status = "cerrada" if quantity == position["quantity"] else "parcial"
 
     # Guardar en historial
     trade = {
@@ -297,67 +316,118 @@ def cmd_vendo(parts, s3, config):
         "gross_pnl": round(gross_pnl, 2),
         "net_pnl": net_pnl,
         "pnl_pct": pnl_pct,
-        "result": "win" if net_pnl > 0 else "loss"
+        "result": "win" if net_pnl > 0 else "loss",
+        "date_open": date_open
     }
 
-    # Añadir a operations_full.csv
+    # Añadir al historial
     save_trade_to_history(s3, bucket, trade)
 
     emoji = "📈" if net_pnl > 0 else "📉"
+    tax_line = (f"Impuestos (tramo {rate:g}%): -{round(tax, 2)}€" if tax >= 0
+                else f"Compensación fiscal {year}: +{round(-tax, 2)}€")
 
     return f"""{emoji} Venta registrada ({status})
 {ticker}: {quantity} acc @ {price}€
 
-Entrada: {entry_price}€
+Entrada (FIFO): {entry_price}€
 Salida: {price}€
 P&L bruto: {round(gross_pnl, 2)}€ ({pnl_pct:+}%)
 Costes: -{costs}€
-Impuestos (19%): -{round(tax, 2)}€
+{tax_line}
 P&L NETO: {net_pnl}€
 
+Ganancia neta {year}: {year_after['net']}€
 Efectivo: {portfolio['cash_eur']}€"""
 
 
-def save_trade_to_history(s3, bucket, trade):
-    """Añade trade al historial CSV."""
+def compact_if_needed(s3, bucket, pending):
+    """Compacta el log de eventos si la cola ya es larga."""
+    if pending < portfolio_store.COMPACT_THRESHOLD:
+        return
     try:
-        existing = load_s3_text(s3, bucket, "history/operations_full.csv")
-
-        if not existing:
-            header = "ticker,quantity,entry_price,exit_price,date_close,gross_pnl,net_pnl,pnl_pct,result\n"
-            existing = header
+        portfolio_store.compact(s3, bucket)
+    except Exception as e:
+        # La compactación es una optimización: el evento ya está guardado
+        logger.error(f"❌ Error compactando portfolio: {e}")
 
-        row = f"{trade['ticker']},{trade['quantity']},{trade['entry_price']},{trade['exit_price']},{trade['date_close']},{trade['gross_pnl']},{trade['net_pnl']},{trade['pnl_pct']},{trade['result']}\n"
-        save_s3_text(s3, bucket, "history/operations_full.csv", existing + row)
 
+def save_trade_to_history(s3, bucket, trade):
+    """Añade trade a la partición mensual del historial y a los agregados."""
+    try:
+        trade_history.append_trade(s3, bucket, trade)
     except Exception as e:
         logger.error(f"❌ Error guardando historial: {e}")
+        return
+
+    try:
+        stats_aggregates.update_aggregates(s3, bucket, trade)
+    except Exception as e:
+        # /rebuild_stats lo recalcula desde el historial
+        logger.error(f"❌ Error actualizando agregados: {e}")
+
+
+def get_quotes(s3, config, positions):
+    """Cotizaciones de las posiciones desde la caché compartida (descarga solo lo que falta)."""
+    if not positions:
+        return {}
+    cache = quote_cache.build_quote_cache(config, s3)
+    return cache.get([p["ticker"] for p in positions])
+
+
+def quotes_footer(quotes, positions):
+    """Antigüedad del precio más viejo y aviso si alguno está caducado o falta."""
+    if not positions:
+        return ""
+    missing = [p["ticker"] for p in positions if p["ticker"] not in quotes]
+    if not quotes:
+        return "\n⚠️ Sin cotizaciones: valorado a precio de entrada"
+
+    oldest = max(q["age"] for q in quotes.values())
+    line = f"\n🕒 Precios {quote_cache.format_age(oldest)}"
+    if any(q["stale"] for q in quotes.values()):
+        line += " ⚠️ desactualizados"
+    if missing:
+        line += f"\n⚠️ Sin cotización (a precio de entrada): {', '.join(missing)}"
+    return line
 
 
 def cmd_portfolio(s3, config):
-    """Muestra posiciones actuales."""
+    """Muestra posiciones actuales valoradas a mercado."""
     bucket = config["s3_bucket"]
-    portfolio = load_s3_json(s3, bucket, "portfolio/current_positions.json",
-                             default={"positions": [], "cash_eur": 2300})
+    portfolio = portfolio_store.load_portfolio(s3, bucket)
 
     positions = portfolio.get("positions", [])
 
     if not positions:
         return f"💼 PORTFOLIO\n\nSin posiciones abiertas\nEfectivo: {portfolio.get('cash_eur', 0)}€"
 
+    quotes = get_quotes(s3, config, positions)
     msg = "💼 PORTFOLIO\n\n"
     total_invested = 0
+    total_value = 0
 
     for p in positions:
         invested = p["quantity"] * p["entry_price"]
+        quote = quotes.get(p["ticker"])
+        value = p["quantity"] * quote["price"] if quote else invested
         total_invested += invested
+        total_value += value
         msg += f"{p['ticker']}: {p['quantity']} acc @ {p['entry_price']}€\n"
         msg += f"Invertido: {round(invested, 2)}€\n"
+        if quote:
+            pnl_pct = (quote["price"] - p["entry_price"]) / p["entry_price"] * 100
+            stale = " ⚠️" if quote["stale"] else ""
+            msg += f"Actual: {round(quote['price'], 2)}€{stale} → {round(value, 2)}€ ({pnl_pct:+.2f}%)\n"
         msg += f"Desde: {p.get('date_open', 'N/A')}\n\n"
 
+    cash = portfolio.get("cash_eur", 0)
+    unrealized = total_value - total_invested
     msg += f"Total invertido: {round(total_invested, 2)}€\n"
-    msg += f"Efectivo: {portfolio.get('cash_eur', 0)}€\n"
-    msg += f"Total portfolio: {round(total_invested + portfolio.get('cash_eur', 0), 2)}€"
+    msg += f"Valor de mercado: {round(total_value, 2)}€ ({round(unrealized, 2):+}€)\n"
+    msg += f"Efectivo: {cash}€\n"
+    msg += f"Total portfolio: {round(total_value + cash, 2)}€"
+    msg += quotes_footer(quotes, positions)
 
     return msg
 
@@ -365,34 +435,24 @@ def cmd_portfolio(s3, config):
 def cmd_balance(s3, config):
     """Muestra resumen financiero total."""
     bucket = config["s3_bucket"]
-    portfolio = load_s3_json(s3, bucket, "portfolio/current_positions.json",
-                             default={"positions": [], "cash_eur": 2300})
-
-    # Leer historial para calcular P&L total
-    csv_text = load_s3_text(s3, bucket, "history/operations_full.csv")
+    portfolio = portfolio_store.load_portfolio(s3, bucket)
 
-    total_net_pnl = 0
-    total_trades = 0
-    wins = 0
+    # P&L total desde agregados materializados (sin recorrer historial)
+    aggregates = stats_aggregates.load_aggregates(s3, bucket)
+    total_net_pnl = aggregates["net_pnl"]
+    total_trades = aggregates["trades"]
+    wins = aggregates["wins"]
 
-    if csv_text:
-        lines = csv_text.strip().split("\n")[1:]  # Skip header
-        for line in lines:
-            if line:
-                parts = line.split(",")
-                try:
-                    net_pnl = float(parts[6])
-                    result = parts[8]
-                    total_net_pnl += net_pnl
-                    total_trades += 1
-                    if result == "win":
-                        wins += 1
-                except:
-                    pass
+    positions = portfolio.get("positions", [])
+    quotes = get_quotes(s3, config, positions)
 
     cash = portfolio.get("cash_eur", 0)
-    invested = sum(p["quantity"] * p["entry_price"] for p in portfolio.get("positions", []))
-    total_value = cash + invested
+    invested = sum(p["quantity"] * p["entry_price"] for p in positions)
+    market_value = sum(
+        p["quantity"] * (quotes[p["ticker"]]["price"] if p["ticker"] in quotes else p["entry_price"])
+        for p in positions
+    )
+    total_value = cash + market_value
 
     win_rate = round((wins / total_trades * 100), 1) if total_trades > 0 else 0
 
@@ -401,64 +461,138 @@ def cmd_balance(s3, config):
 Capital actual: {round(total_value, 2)}€
   Efectivo: {cash}€
   Invertido: {round(invested, 2)}€
+  Valor de mercado: {round(market_value, 2)}€
 
+P&L latente: {round(market_value - invested, 2)}€
 P&L realizado: {round(total_net_pnl, 2)}€
 Operaciones cerradas: {total_trades}
-Win rate: {win_rate}%"""
+Win rate: {win_rate}%{quotes_footer(quotes, positions)}"""
 
 
 def cmd_stats(s3, config):
     """Muestra estadísticas detalladas."""
     bucket = config["s3_bucket"]
-    csv_text = load_s3_text(s3, bucket, "history/operations_full.csv")
+    aggregates = stats_aggregates.load_aggregates(s3, bucket)
 
-    if not csv_text or len(csv_text.strip().split("\n")) <= 1:
+    if aggregates["trades"] == 0:
         return "📊 STATS\n\nSin operaciones cerradas aún.\nLas estadísticas aparecerán tras tu primera venta."
 
-    lines = csv_text.strip().split("\n")[1:]
-    trades = []
+    win_rate = round(aggregates["wins"] / aggregates["trades"] * 100, 1)
+    best = aggregates["best"]
+    worst = aggregates["worst"]
 
-    for line in lines:
-        if line:
-            parts = line.split(",")
-            try:
-                trades.append({
-                    "ticker": parts[0],
-                    "net_pnl": float(parts[6]),
-                    "pnl_pct": float(parts[7]),
-                    "result": parts[8]
-                })
-            except:
-                pass
+    return f"""📊 STATS
 
-    if not trades:
-        return "📊 STATS\n\nSin datos suficientes."
+Total operaciones: {aggregates['trades']}
+Win rate: {win_rate}% ({aggregates['wins']}W / {aggregates['losses']}L)
+P&L total neto: {round(aggregates['net_pnl'], 2)}€
 
-    wins = [t for t in trades if t["result"] == "win"]
-    losses = [t for t in trades if t["result"] == "loss"]
-    win_rate = round(len(wins) / len(trades) * 100, 1)
+Mejor trade: {best['ticker']} +{best['net_pnl']}€ ({best['pnl_pct']:+}%)
+Peor trade: {worst['ticker']} {worst['net_pnl']}€ ({worst['pnl_pct']:+}%)"""
 
-    best = max(trades, key=lambda x: x["net_pnl"])
-    worst = min(trades, key=lambda x: x["net_pnl"])
 
-    total_pnl = sum(t["net_pnl"] for t in trades)
+def cmd_tax(parts, s3, config):
+    """Ganancias realizadas y cuota estimada del año (acumulados del ledger FIFO)."""
+    year = parts[1] if len(parts) > 1 else datetime.now().strftime("%Y")
 
-    return f"""📊 STATS
+    bucket = config["s3_bucket"]
+    portfolio = portfolio_store.load_portfolio(s3, bucket)
+    totals = tax_ledger.get_year(portfolio, year)
 
-Total operaciones: {len(trades)}
-Win rate: {win_rate}% ({len(wins)}W / {len(losses)}L)
-P&L total neto: {round(total_pnl, 2)}€
+    if totals["sales"] == 0:
+        return f"🧾 IMPUESTOS {year}\n\nSin ventas registradas en {year}."
 
-Mejor trade: {best['ticker']} +{best['net_pnl']}€ ({best['pnl_pct']:+}%)
-Peor trade: {worst['ticker']} {worst['net_pnl']}€ ({worst['pnl_pct']:+}%)"""
+    tiers = tax_ledger.load_tiers(s3, bucket)
+    base = totals["net"]
+    msg = f"""🧾 IMPUESTOS {year}
+
+Ventas: {totals['sales']}
+Ganancias: +{totals['gains']}€
+Pérdidas: {totals['losses']}€
+Base del ahorro: {base}€
+"""
+
+    if base <= 0:
+        msg += f"\nSin cuota: pérdidas netas de {round(-base, 2)}€ (compensables 4 años)"
+        return msg
+
+    msg += f"Cuota estimada: {round(tiers.tax(base), 2)}€\n"
+    for lower, upper, rate, amount in tiers.breakdown(base):
+        limit = f"{lower:g}-{upper:g}€" if upper is not None else f">{lower:g}€"
+        msg += f"  {rate:g}% ({limit}): {round(amount, 2)}€\n"
+
+    rate, room = tiers.current(base)
+    msg += f"\nTramo actual: {rate:g}%"
+    if room is not None:
+        msg += f" (quedan {round(room, 2)}€ hasta el siguiente)"
+    return msg
+
+
+def cmd_risk(parts, s3, config):
+    """VaR/CVaR a 1 y 10 días y probabilidad de tocar cada stop (Monte Carlo)."""
+    # numpy solo hace falta aquí: no penalizar el cold start del resto de comandos
+    import montecarlo
+    import risk
+
+    method = parts[1].lower() if len(parts) > 1 else montecarlo.METHOD
+
+    bucket = config["s3_bucket"]
+    portfolio = portfolio_store.load_portfolio(s3, bucket)
+    positions = portfolio.get("positions", [])
+    if not positions:
+        return "📉 RIESGO\n\nSin posiciones abiertas"
+
+    rules = load_s3_json(s3, bucket, "config/rules.json")
+    stop_loss = rules.get("trading_rules", {}).get("stop_loss_percent", -10)
+    quotes = get_quotes(s3, config, positions)
+    prices = {t: q["price"] for t, q in quotes.items()}
+
+    history = montecarlo.load_returns(risk.build_store(config, s3))
+    result, missing = montecarlo.portfolio_risk(
+        history, positions, prices, portfolio.get("cash_eur", 0), stop_loss, method=method,
+        paths=RISK_PATHS, workers=RISK_WORKERS
+    )
+    if result is None:
+        return "📉 RIESGO\n\n⚠️ Sin histórico suficiente (se guarda en el análisis diario)"
+
+    horizon = f"{result['horizon']}d"
+    msg = f"""📉 RIESGO ({result['paths']} escenarios, {method}, {result['days']} sesiones)
+
+Capital: {round(result['total'], 2)}€ (invertido {round(result['invested'], 2)}€)
+"""
+    for confidence in montecarlo.CONFIDENCES:
+        short = result["var"]["1d"][confidence]
+        long = result["var"][horizon][confidence]
+        msg += f"""
+{confidence}%  1d: VaR {round(short['var'], 2)}€ ({short['var_pct']:.1f}%) | CVaR {round(short['cvar'], 2)}€
+{confidence}% {horizon}: VaR {round(long['var'], 2)}€ ({long['var_pct']:.1f}%) | CVaR {round(long['cvar'], 2)}€
+"""
+    msg += f"\nDrawdown máx. {horizon}: mediana {result['drawdown']['p50']:.1f}% | p95 {result['drawdown']['p95']:.1f}%\n"
+
+    msg += f"\n🛑 Prob. de tocar el stop ({stop_loss}%) en {horizon}:\n"
+    ranked = sorted(zip(result["tickers"], result["stop_probability"], result["stops"]), key=lambda r: -r[1])
+    for ticker, probability, stop in ranked:
+        distance = (1 - stop) * 100
+        note = "ya por debajo" if distance <= 0 else f"a {distance:.1f}%"
+        msg += f"{ticker}: {probability * 100:.1f}% ({note})\n"
+
+    if missing:
+        msg += f"\n⚠️ Sin histórico (fuera de la simulación): {', '.join(missing)}"
+    msg += f"\n⏱️ {result['seconds']:.1f}s (procesos: {result['workers']})"
+    return msg
+
+
+def cmd_rebuild_stats(s3, config):
+    """Recalcula los agregados de /balance y /stats."""
+    aggregates = stats_aggregates.rebuild_aggregates(s3, config["s3_bucket"])
+
+    return f"""🔄 Estadísticas recalculadas
+Operaciones: {aggregates['trades']}
+P&L total neto: {round(aggregates['net_pnl'], 2)}€"""
 
 
 def cmd_blacklist(parts, s3, config, remove=False):
     """Añade o elimina ticker de blacklist."""
-    if len(parts) != 2:
-        action = "remove_blacklist" if remove else "blacklist"
-        return f"❌ Formato incorrecto\nUso: /{action} TICKER\nEj: /{action} PLTR"
-
     ticker = parts[1].upper()
     bucket = config["s3_bucket"]
 
@@ -495,8 +629,6 @@ def cmd_tip(parts, s3, config, remove=False):
     tips = load_s3_json(s3, bucket, "external/user_tips.json", default=[])
 
     if remove:
-        if len(parts) != 2:
-            return "❌ Formato incorrecto\nUso: /remove_tip TICKER"
         ticker = parts[1].upper()
         original_count = len(tips)
         tips = [t for t in tips if t.get("ticker") != ticker]
@@ -506,9 +638,6 @@ def cmd_tip(parts, s3, config, remove=False):
         return f"✅ Tip de {ticker} eliminado"
 
     else:
-        if len(parts) < 3:
-            return "❌ Formato incorrecto\nUso: /tip TICKER RAZÓN\nEj: /tip NVDA Amigo dice que presentan GPU"
-
         ticker = parts[1].upper()
         reason = " ".join(parts[2:])
 
@@ -553,10 +682,12 @@ def cmd_run(config):
         return "⚠️ /run solo funciona en AWS\nEn local ejecuta: python3 lambdas/daily_analysis/handler.py"
 
     try:
-        lambda_client = boto3.client("lambda", region_name=config["aws_region"])
+        lambda_client = get_client("lambda", config["aws_region"])
         lambda_client.invoke(
             FunctionName="daily_analysis",
-            InvocationType="Event"  # Asíncrono
+            InvocationType="Event",  # Asíncrono
+            # Manual: análisis completo aunque no haya cambios materiales
+            Payload=json.dumps({"trigger": "manual"})
         )
         return "⚡ Análisis lanzado\nRecibirás el resultado en unos segundos"
     except Exception as e:
@@ -565,81 +696,323 @@ def cmd_run(config):
 
 
 # ════════════════════════════════════════
-# PROCESADOR DE COMANDOS
+# REGISTRO DE COMANDOS
 # ════════════════════════════════════════
 
-def process_command(text, s3, config):
-    """Parsea y ejecuta el comando recibido."""
-    if not text or not text.startswith("/"):
+SECTIONS = ["💰 OPERACIONES", "📊 CONSULTAS", "🔧 CONFIGURACIÓN", "⚡ ACCIONES"]
+
+
+def arg(name, kind, required=True):
+    """Argumento de un comando. kind: "ticker", "number", "year", "text"
+    (resto del mensaje) o una tupla con las opciones válidas."""
+    return {"name": name, "kind": kind, "required": required}
+
+
+# Comando → handler(parts, s3, config), argumentos y ayuda.
+# mutating: escribe estado; se ejecuta una sola vez por update_id aunque
+#   Telegram reenvíe el webhook o Lambda reintente la invocación asíncrona.
+# inline: sin I/O, se responde en el propio webhook.
+COMMANDS = {
+    "/compro": {
+        "handler": cmd_compro,
+        "args": [arg("TICKER", "ticker"), arg("CANTIDAD", "number"), arg("PRECIO(€)", "number")],
+        "help": "Registra una compra",
+        "example": "/compro AAPL 2 180.50",
+        "section": "💰 OPERACIONES",
+        "mutating": True
+    },
+    "/vendo": {
+        "handler": cmd_vendo,
+        "args": [arg("TICKER", "ticker"), arg("CANTIDAD", "number"), arg("PRECIO(€)", "number")],
+        "help": "Registra una venta",
+        "example": "/vendo AAPL 2 195.00",
+        "section": "💰 OPERACIONES",
+        "mutating": True
+    },
+    "/portfolio": {
+        "handler": lambda parts, s3, config: cmd_portfolio(s3, config),
+        "args": [],
+        "help": "Muestra posiciones actuales y P&L",
+        "section": "📊 CONSULTAS"
+    },
+    "/balance": {
+        "handler": lambda parts, s3, config: cmd_balance(s3, config),
+        "args": [],
+        "help": "Resumen financiero total",
+        "section": "📊 CONSULTAS"
+    },
+    "/stats": {
+        "handler": lambda parts, s3, config: cmd_stats(s3, config),
+        "args": [],
+        "help": "Estadísticas: win rate, mejor/peor trade",
+        "section": "📊 CONSULTAS"
+    },
+    "/tax": {
+        "handler": cmd_tax,
+        "args": [arg("AÑO", "year", required=False)],
+        "help": "Ganancias realizadas e impuesto estimado por tramos",
+        "example": "/tax 2025",
+        "section": "📊 CONSULTAS"
+    },
+    "/risk": {
+        "handler": cmd_risk,
+        # Mismas opciones que montecarlo.METHODS (no se importa aquí: numpy)
+        "args": [arg("MÉTODO", ("bootstrap", "cov"), required=False)],
+        "help": "VaR/CVaR a 1 y 10 días y probabilidad de stop (Monte Carlo)",
+        "example": "/risk cov",
+        "section": "📊 CONSULTAS"
+    },
+    "/rebuild_stats": {
+        "handler": lambda parts, s3, config: cmd_rebuild_stats(s3, config),
+        "args": [],
+        "help": "Recalcula estadísticas desde el historial",
+        "section": "📊 CONSULTAS",
+        "mutating": True
+    },
+    "/blacklist": {
+        "handler": lambda parts, s3, config: cmd_blacklist(parts, s3, config, remove=False),
+        "args": [arg("TICKER", "ticker")],
+        "help": "Marca ticker como no disponible en TR",
+        "example": "/blacklist PLTR",
+        "section": "🔧 CONFIGURACIÓN",
+        "mutating": True
+    },
+    "/remove_blacklist": {
+        "handler": lambda parts, s3, config: cmd_blacklist(parts, s3, config, remove=True),
+        "args": [arg("TICKER", "ticker")],
+        "help": "Elimina ticker de la blacklist",
+        "example": "/remove_blacklist PLTR",
+        "section": "🔧 CONFIGURACIÓN",
+        "mutating": True
+    },
+    "/blacklists": {
+        "handler": lambda parts, s3, config: cmd_blacklists(s3, config),
+        "args": [],
+        "help": "Muestra tickers bloqueados en TR",
+        "section": "🔧 CONFIGURACIÓN"
+    },
+    "/tip": {
+        "handler": lambda parts, s3, config: cmd_tip(parts, s3, config, remove=False),
+        "args": [arg("TICKER", "ticker"), arg("RAZÓN", "text")],
+        "help": "Añade recomendación externa para análisis",
+        "example": "/tip NVDA Amigo dice que presentan GPU",
+        "section": "🔧 CONFIGURACIÓN",
+        "mutating": True
+    },
+    "/remove_tip": {
+        "handler": lambda parts, s3, config: cmd_tip(parts, s3, config, remove=True),
+        "args": [arg("TICKER", "ticker")],
+        "help": "Elimina tip externo",
+        "example": "/remove_tip NVDA",
+        "section": "🔧 CONFIGURACIÓN",
+        "mutating": True
+    },
+    "/tips": {
+        "handler": lambda parts, s3, config: cmd_tips(s3, config),
+        "args": [],
+        "help": "Muestra tips externos activos",
+        "section": "🔧 CONFIGURACIÓN"
+    },
+    "/run": {
+        "handler": lambda parts, s3, config: cmd_run(config),
+        "args": [],
+        "help": "Lanza análisis manual ahora mismo",
+        "section": "⚡ ACCIONES",
+        # Cada análisis es una llamada a Claude: no repetirlo por un reenvío
+        "mutating": True
+    },
+    "/help": {
+        "handler": lambda parts, s3, config: cmd_help(),
+        "args": [],
+        "help": "Muestra este mensaje",
+        "section": "⚡ ACCIONES",
+        "inline": True
+    }
+}
+
+
+def usage(name, spec):
+    """Línea de uso: /compro TICKER CANTIDAD PRECIO(€), /risk [bootstrap|cov]..."""
+    words = [name]
+    for a in spec["args"]:
+        label = "|".join(a["kind"]) if isinstance(a["kind"], tuple) else a["name"]
+        words.append(label if a["required"] else f"[{label}]")
+    return " ".join(words)
+
+
+def validate_args(name, spec, parts):
+    """Comprueba parts contra el esquema del comando. Retorna el mensaje de error o None."""
+    schema = spec["args"]
+    values = parts[1:]
+    required = sum(1 for a in schema if a["required"])
+    takes_rest = bool(schema) and schema[-1]["kind"] == "text"
+
+    error = None
+    if len(values) < required or (len(values) > len(schema) and not takes_rest):
+        error = "Formato incorrecto"
+    else:
+        for a, value in zip(schema, values):
+            kind = a["kind"]
+            if kind == "number":
+                try:
+                    number = float(value)
+                except ValueError:
+                    number = None
+                # float() acepta "nan", "inf" y negativos
+                if number is None or not (math.isfinite(number) and number > 0):
+                    error = f"{a['name']} debe ser un número mayor que 0"
+            elif kind == "year" and not (value.isdigit() and len(value) == 4):
+                error = f"{a['name']} debe ser un año (4 cifras)"
+            elif isinstance(kind, tuple) and value.lower() not in kind:
+                error = f"{a['name']} debe ser {' o '.join(kind)}"
+            if error:
+                break
+
+    if error is None:
         return None
+    msg = f"❌ {error}\nUso: {usage(name, spec)}"
+    if spec.get("example"):
+        msg += f"\nEj: {spec['example']}"
+    return msg
+
 
+def parse_command(text):
+    """(parts, nombre, spec) del texto. spec es None si no es un comando conocido."""
     parts = text.strip().split()
     command = parts[0].lower()
+    return parts, command, COMMANDS.get(command)
+
+
+# ════════════════════════════════════════
+# PROCESADOR DE COMANDOS
+# ════════════════════════════════════════
+
+def process_command(text, s3, config):
+    """Parsea, valida y ejecuta el comando recibido."""
+    if not text or not text.startswith("/"):
+        return None
 
+    parts, command, spec = parse_command(text)
     logger.info(f"Comando recibido: {command}")
 
-    if command == "/help":
-        return cmd_help()
+    if spec is None:
+        return f"❌ Comando desconocido: {command}\nEscribe /help para ver comandos disponibles"
 
-    elif command == "/compro":
-        return cmd_compro(parts, s3, config)
+    error = validate_args(command, spec, parts)
+    if error:
+        return error
+    return spec["handler"](parts, s3, config)
 
-    elif command == "/vendo":
-        return cmd_vendo(parts, s3, config)
 
-    elif command == "/portfolio":
-        return cmd_portfolio(s3, config)
+def needs_background(text):
+    """True si el comando hace I/O: el webhook lo delega y responde al momento.
 
-    elif command == "/balance":
-        return cmd_balance(s3, config)
+    Desconocidos, mal formados y los inline se responden sin tocar S3.
+    """
+    if not text.startswith("/"):
+        return False
+    parts, command, spec = parse_command(text)
+    return spec is not None and not spec.get("inline") and validate_args(command, spec, parts) is None
 
-    elif command == "/stats":
-        return cmd_stats(s3, config)
 
-    elif command == "/blacklist":
-        return cmd_blacklist(parts, s3, config, remove=False)
+def claim_update(s3, bucket, update_id):
+    """Marca update_id como procesado (put condicional). False si ya lo estaba."""
+    if update_id is None:
+        return True
+    try:
+        s3.put_object(Bucket=bucket, Key=f"{UPDATES_PREFIX}{update_id}", Body=b"", IfNoneMatch="*")
+        return True
+    except ClientError as e:
+        if portfolio_store.is_conflict(e):
+            return False
+        raise
 
-    elif command == "/remove_blacklist":
-        return cmd_blacklist(parts, s3, config, remove=True)
-    
-    elif command == "/blacklists":
-        return cmd_blacklists(s3, config)
 
-    elif command == "/tip":
-        return cmd_tip(parts, s3, config, remove=False)
+def execute(text, update_id, s3, config):
+    """Ejecuta el comando y envía la respuesta (webhook síncrono o invocación asíncrona)."""
+    if text.startswith("/"):
+        parts, command, spec = parse_command(text)
+        # Solo los que van a escribir: un error de formato no consume el update
+        mutating = spec and spec.get("mutating") and validate_args(command, spec, parts) is None
+        if mutating and not claim_update(s3, config["s3_bucket"], update_id):
+            logger.warning(f"⚠️ Update {update_id} ({command}) ya procesado, se ignora")
+            return
 
-    elif command == "/remove_tip":
-        return cmd_tip(parts, s3, config, remove=True)
-    
-    elif command == "/tips":
-        return cmd_tips(s3, config)
+    response = process_command(text, s3, config)
+    if response:
+        send_telegram(response, config)
 
-    elif command == "/run":
-        return cmd_run(config)
 
-    else:
-        return f"❌ Comando desconocido: {command}\nEscribe /help para ver comandos disponibles"
+def dispatch_background(context, text, update_id, config):
+    """Se reinvoca a sí misma (InvocationType=Event) con el comando. False si no se pudo.
+
+    En local o sin context (tests, benchmark) no hay función a la que invocar.
+    """
+    function_name = getattr(context, "function_name", None)
+    if not function_name or os.getenv("ENVIRONMENT", "aws") == "local":
+        return False
+    try:
+        get_client("lambda", config["aws_region"]).invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=json.dumps({"command": text, "update_id": update_id})
+        )
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo delegar el comando, se ejecuta en el webhook: {e}")
+        return False
 
 
 # ════════════════════════════════════════
 # ENTRY POINT
 # ════════════════════════════════════════
 
+def run_background(event):
+    """Invocación asíncrona lanzada por el webhook: ejecuta el comando y responde.
+
+    Los errores se contestan por Telegram y no se relanzan: un reintento de
+    Lambda no debe repetir una operación a medias.
+    """
+    text = event["command"]
+    config = None
+    try:
+        config = get_config()
+        s3 = get_client("s3", config["aws_region"])
+        execute(text, event.get("update_id"), s3, config)
+    except Exception as e:
+        logger.error(f"❌ Error ejecutando {text}: {e}")
+        if config:
+            send_telegram(f"❌ Error ejecutando {text.split()[0]}: {e}", config)
+    return {"statusCode": 200, "body": "OK"}
+
+
 def lambda_handler(event, context):
     """
     Entry point webhook.
-    Telegram llama directamente cuando el usuario escribe.
+    Telegram llama directamente cuando el usuario escribe: se responde 200
+    en cuanto el comando queda delegado; la respuesta llega desde la
+    invocación asíncrona (run_background).
     """
+    global _cold_start
+
+    if "command" in event:
+        logger.info(f"🤖 Comando en segundo plano: {event['command']}")
+        return run_background(event)
+
     logger.info("🤖 Telegram webhook recibido")
     
     try:
+        start = time.perf_counter()
         config = get_config()
-        s3 = boto3.client("s3", region_name=config["aws_region"])
+        setup_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"⏱️ Config: {setup_ms:.0f} ms ({'cold' if _cold_start else 'warm'})")
+        _cold_start = False
         
         # Parsear evento de Telegram
         body = json.loads(event.get("body", "{}"))
         message = body.get("message", {})
         text = message.get("text", "")
+        update_id = body.get("update_id")
         
         if not text:
             logger.info("Mensaje sin texto, ignorando")
@@ -647,11 +1020,13 @@ def lambda_handler(event, context):
         
         logger.info(f"Mensaje recibido: {text}")
         
-        # Procesar comando
-        response = process_command(text, s3, config)
+        # Ack inmediato: el trabajo con S3 va en otra invocación
+        if needs_background(text) and dispatch_background(context, text, update_id, config):
+            logger.info(f"⚡ Delegado en {(time.perf_counter() - start) * 1000:.0f} ms")
+            return {"statusCode": 200, "body": "OK"}
         
-        if response:
-            send_telegram(response, config)
+        s3 = get_client("s3", config["aws_region"])
+        execute(text, update_id, s3, config)
         
         return {"statusCode": 200, "body": "OK"}
         
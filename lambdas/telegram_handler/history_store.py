@@ -0,0 +1,233 @@
+import os
+import sys
+import logging
+
+import numpy as np
+
+logger = logging.getLogger()
+
+TRADE_DTYPE = np.dtype([
+    ("ticker", "U16"),
+    ("quantity", "f8"),
+    ("entry_price", "f8"),
+    ("exit_price", "f8"),
+    ("date_close", "datetime64[D]"),
+    ("gross_pnl", "f8"),
+    ("net_pnl", "f8"),
+    ("pnl_pct", "f8"),
+    ("win", "?"),
+    ("loss", "?"),
+    ("date_open", "datetime64[D]")
+])
+
+
+# ════════════════════════════════════════
+# CONVERSIÓN
+# ════════════════════════════════════════
+
+def csv_to_array(csv_text):
+    """Convierte el CSV de historial en un array estructurado.
+
+    Acepta el formato antiguo (9 columnas) y el nuevo con date_open.
+    Las líneas inválidas se descartan igual que en /stats.
+    """
+    rows = []
+    if csv_text:
+        for line in csv_text.strip().split("\n")[1:]:
+            if not line:
+                continue
+            parts = line.split(",")
+            try:
+                rows.append((
+                    parts[0],
+                    float(parts[1]),
+                    float(parts[2]),
+                    float(parts[3]),
+                    np.datetime64(parts[4], "D"),
+                    float(parts[5]),
+                    float(parts[6]),
+                    float(parts[7]),
+                    parts[8] == "win",
+                    parts[8] == "loss",
+                    np.datetime64(parts[9], "D") if len(parts) > 9 and parts[9] else np.datetime64("NaT")
+                ))
+            except (IndexError, ValueError):
+                logger.warning(f"⚠️ Línea de historial inválida: {line}")
+
+    return np.array(rows, dtype=TRADE_DTYPE)
+
+
+def load_mmap(path):
+    """Abre el .npy en modo memory-map (solo lectura)."""
+    return np.load(path, mmap_mode="r", allow_pickle=False)
+
+
+# ════════════════════════════════════════
+# ANALÍTICA VECTORIZADA
+# ════════════════════════════════════════
+
+def summary_stats(trades):
+    """Mismos números que /stats."""
+    n = len(trades)
+    if n == 0:
+        return None
+
+    net = trades["net_pnl"]
+    wins = int(trades["win"].sum())
+    # argmax/argmin devuelven la primera aparición, igual que max()/min()
+    best = trades[int(np.argmax(net))]
+    worst = trades[int(np.argmin(net))]
+
+    return {
+        "trades": n,
+        "wins": wins,
+        "losses": int(trades["loss"].sum()),
+        "win_rate": round(wins / n * 100, 1),
+        # Suma secuencial para reproducir el redondeo de sum() en Python
+        "net_pnl": float(np.add.accumulate(net)[-1]),
+        "best": {"ticker": str(best["ticker"]), "net_pnl": float(best["net_pnl"]), "pnl_pct": float(best["pnl_pct"])},
+        "worst": {"ticker": str(worst["ticker"]), "net_pnl": float(worst["net_pnl"]), "pnl_pct": float(worst["pnl_pct"])}
+    }
+
+
+def stats_by_ticker(trades):
+    """Trades, win rate y P&L neto por ticker. Retorna lista ordenada por P&L."""
+    if len(trades) == 0:
+        return []
+
+    tickers, idx = np.unique(trades["ticker"], return_inverse=True)
+    count = np.bincount(idx)
+    wins = np.bincount(idx, weights=trades["win"])
+    pnl = np.bincount(idx, weights=trades["net_pnl"])
+    order = np.argsort(-pnl, kind="stable")
+
+    return [
+        {
+            "ticker": str(tickers[i]),
+            "trades": int(count[i]),
+            "win_rate": round(float(wins[i] / count[i] * 100), 1),
+            "net_pnl": round(float(pnl[i]), 2)
+        }
+        for i in order
+    ]
+
+
+def pnl_distribution(trades, percentiles=(5, 25, 50, 75, 95)):
+    """Percentiles de net_pnl y pnl_pct."""
+    if len(trades) == 0:
+        return {}
+    return {
+        "net_pnl": dict(zip(percentiles, np.round(np.percentile(trades["net_pnl"], percentiles), 2).tolist())),
+        "pnl_pct": dict(zip(percentiles, np.round(np.percentile(trades["pnl_pct"], percentiles), 2).tolist()))
+    }
+
+
+def holding_period_stats(trades):
+    """Días en cartera (solo trades con date_open registrada)."""
+    known = ~np.isnat(trades["date_open"])
+    if not known.any():
+        return None
+
+    days = (trades["date_close"][known] - trades["date_open"][known]).astype(np.int64)
+    wins = trades["win"][known]
+    return {
+        "trades": int(known.sum()),
+        "mean_days": round(float(days.mean()), 1),
+        "median_days": float(np.median(days)),
+        "max_days": int(days.max()),
+        "mean_days_win": round(float(days[wins].mean()), 1) if wins.any() else None,
+        "mean_days_loss": round(float(days[~wins].mean()), 1) if (~wins).any() else None
+    }
+
+
+# ════════════════════════════════════════
+# CLI
+# ════════════════════════════════════════
+
+def legacy_stats(csv_text):
+    """Cálculo original de /stats sobre el CSV, para verificar la conversión."""
+    trades = []
+    for line in csv_text.strip().split("\n")[1:]:
+        if line:
+            parts = line.split(",")
+            try:
+                trades.append({
+                    "ticker": parts[0],
+                    "net_pnl": float(parts[6]),
+                    "pnl_pct": float(parts[7]),
+                    "result": parts[8]
+                })
+            except (IndexError, ValueError):
+                pass
+    if not trades:
+        return None
+
+    wins = [t for t in trades if t["result"] == "win"]
+    best = max(trades, key=lambda x: x["net_pnl"])
+    worst = min(trades, key=lambda x: x["net_pnl"])
+    return {
+        "trades": len(trades),
+        "wins": len(wins),
+        "losses": len([t for t in trades if t["result"] == "loss"]),
+        "win_rate": round(len(wins) / len(trades) * 100, 1),
+        "net_pnl": sum(t["net_pnl"] for t in trades),
+        "best": {k: best[k] for k in ("ticker", "net_pnl", "pnl_pct")},
+        "worst": {k: worst[k] for k in ("ticker", "net_pnl", "pnl_pct")}
+    }
+
+
+def load_history_csv(source):
+    """CSV del historial: fichero local o, si no existe, las particiones
+    mensuales del bucket S3 source (vía trade_history, con su manifest).
+    """
+    if os.path.isfile(source):
+        with open(source) as f:
+            return f.read()
+
+    import boto3
+    import trade_history
+    s3 = boto3.client("s3", region_name=os.getenv("AWS_REGION", "eu-west-1"))
+    return trade_history.load_history_text(s3, source)
+
+
+def main(argv):
+    """Uso (ORIGEN = bucket S3 con history/trades/ o un CSV local):
+    python3 history_store.py convert ORIGEN trades.npy
+    python3 history_store.py report trades.npy
+    python3 history_store.py verify ORIGEN trades.npy
+    """
+    if len(argv) < 2 or argv[0] not in ("convert", "report", "verify"):
+        print(main.__doc__)
+        return 1
+
+    command = argv[0]
+
+    if command == "convert":
+        trades = csv_to_array(load_history_csv(argv[1]))
+        np.save(argv[2], trades, allow_pickle=False)
+        print(f"✅ {len(trades)} trades → {argv[2]}")
+        return 0
+
+    if command == "report":
+        trades = load_mmap(argv[1])
+        print("Resumen:", summary_stats(trades))
+        print("Por ticker:")
+        for row in stats_by_ticker(trades):
+            print(f"  {row['ticker']}: {row['trades']} trades, {row['win_rate']}% win, {row['net_pnl']}€")
+        print("Distribución P&L:", pnl_distribution(trades))
+        print("Holding period:", holding_period_stats(trades))
+        return 0
+
+    expected = legacy_stats(load_history_csv(argv[1]))
+    actual = summary_stats(load_mmap(argv[2]))
+    if expected == actual:
+        print("✅ Mismo resultado que /stats")
+        return 0
+    print(f"❌ Diferencias:\n  CSV: {expected}\n  NPY: {actual}")
+    return 1
+
+
+if __name__ == "__main__":
+    # trade_history importa portfolio_store de lambdas/shared
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+    sys.exit(main(sys.argv[1:]))
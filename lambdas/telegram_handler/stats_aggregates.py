@@ -0,0 +1,143 @@
+import json
+import logging
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+from portfolio_store import is_conflict
+from trade_history import get_with_etag, put_conditional, load_history_text
+
+logger = logging.getLogger()
+
+AGGREGATES_KEY = "history/aggregates.json"
+MAX_RETRIES = 5
+
+
+def empty_bucket():
+    return {"trades": 0, "wins": 0, "losses": 0, "net_pnl": 0.0}
+
+
+def empty_aggregates():
+    aggregates = empty_bucket()
+    aggregates.update({
+        "gross_pnl": 0.0,
+        "best": None,
+        "worst": None,
+        "by_ticker": {},
+        "by_month": {}
+    })
+    return aggregates
+
+
+def add_to_bucket(bucket, trade):
+    bucket["trades"] += 1
+    bucket["net_pnl"] += trade["net_pnl"]
+    if trade["result"] == "win":
+        bucket["wins"] += 1
+    elif trade["result"] == "loss":
+        bucket["losses"] += 1
+
+
+def add_trade(aggregates, trade):
+    """Suma un trade a los agregados en O(1)."""
+    add_to_bucket(aggregates, trade)
+    aggregates["gross_pnl"] += trade.get("gross_pnl", 0)
+
+    summary = {k: trade[k] for k in ("ticker", "net_pnl", "pnl_pct", "date_close")}
+    # Estricto: en empate se queda el primero, igual que max()/min() sobre el CSV
+    if aggregates["best"] is None or trade["net_pnl"] > aggregates["best"]["net_pnl"]:
+        aggregates["best"] = summary
+    if aggregates["worst"] is None or trade["net_pnl"] < aggregates["worst"]["net_pnl"]:
+        aggregates["worst"] = summary
+
+    add_to_bucket(aggregates["by_ticker"].setdefault(trade["ticker"], empty_bucket()), trade)
+    add_to_bucket(aggregates["by_month"].setdefault(trade["date_close"][:7], empty_bucket()), trade)
+    return aggregates
+
+
+def parse_history(csv_text):
+    """Trades del CSV de historial (mismas columnas que operations_full.csv)."""
+    trades = []
+    if not csv_text:
+        return trades
+
+    for line in csv_text.strip().split("\n")[1:]:
+        if not line:
+            continue
+        parts = line.split(",")
+        try:
+            trades.append({
+                "ticker": parts[0],
+                "date_close": parts[4],
+                "gross_pnl": float(parts[5]),
+                "net_pnl": float(parts[6]),
+                "pnl_pct": float(parts[7]),
+                "result": parts[8]
+            })
+        except (IndexError, ValueError):
+            logger.warning(f"⚠️ Línea de historial inválida: {line}")
+    return trades
+
+
+# ════════════════════════════════════════
+# S3
+# ════════════════════════════════════════
+
+def save_aggregates(s3, bucket, aggregates, etag):
+    aggregates["updated"] = datetime.now().isoformat()
+    put_conditional(s3, bucket, AGGREGATES_KEY, json.dumps(aggregates, indent=2, ensure_ascii=False),
+                    etag, "application/json")
+
+
+def rebuild_aggregates(s3, bucket):
+    """Recalcula los agregados desde el historial completo y los guarda.
+
+    El ETag se lee antes que el historial: si un update_aggregates entra
+    mientras tanto, la escritura condicional falla y se recalcula con el
+    trade ya incluido en vez de pisarlo.
+    """
+    for attempt in range(MAX_RETRIES):
+        _, etag = get_with_etag(s3, bucket, AGGREGATES_KEY)
+        aggregates = empty_aggregates()
+        for trade in parse_history(load_history_text(s3, bucket)):
+            add_trade(aggregates, trade)
+
+        try:
+            save_aggregates(s3, bucket, aggregates, etag)
+            logger.info(f"✅ Agregados reconstruidos: {aggregates['trades']} trades")
+            return aggregates
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+            logger.warning(f"⚠️ Conflicto reconstruyendo agregados, reintentando ({attempt + 1})")
+
+    raise RuntimeError("No se pudieron reconstruir los agregados")
+
+
+def load_aggregates(s3, bucket):
+    """Agregados actuales. Si aún no existen, se construyen desde el historial."""
+    text, _ = get_with_etag(s3, bucket, AGGREGATES_KEY)
+    if text is None:
+        return rebuild_aggregates(s3, bucket)
+    return json.loads(text)
+
+
+def update_aggregates(s3, bucket, trade):
+    """Añade un trade recién cerrado (escritura condicional con reintento)."""
+    for attempt in range(MAX_RETRIES):
+        text, etag = get_with_etag(s3, bucket, AGGREGATES_KEY)
+        if text is None:
+            # El trade ya está en el historial: reconstruir lo incluye
+            rebuild_aggregates(s3, bucket)
+            return
+
+        aggregates = add_trade(json.loads(text), trade)
+        try:
+            save_aggregates(s3, bucket, aggregates, etag)
+            return
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+            logger.warning(f"⚠️ Conflicto actualizando agregados, reintentando ({attempt + 1})")
+
+    raise RuntimeError("No se pudieron actualizar los agregados")
@@ -0,0 +1,194 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from portfolio_store import is_conflict
+
+logger = logging.getLogger()
+
+HEADER = "ticker,quantity,entry_price,exit_price,date_close,gross_pnl,net_pnl,pnl_pct,result,date_open\n"
+LEGACY_KEY = "history/operations_full.csv"
+MANIFEST_KEY = "history/manifest.json"
+PARTITION_PREFIX = "history/trades/"
+MAX_RETRIES = 5
+IO_WORKERS = 8
+
+
+def partition_key(month):
+    """Objeto S3 de un mes (YYYY-MM)."""
+    return f"{PARTITION_PREFIX}{month}.csv"
+
+
+def trade_to_row(trade):
+    return f"{trade['ticker']},{trade['quantity']},{trade['entry_price']},{trade['exit_price']},{trade['date_close']},{trade['gross_pnl']},{trade['net_pnl']},{trade['pnl_pct']},{trade['result']},{trade.get('date_open', '')}\n"
+
+
+# ════════════════════════════════════════
+# S3 CONDICIONAL
+# ════════════════════════════════════════
+
+def get_with_etag(s3, bucket, key):
+    """Retorna (texto, etag) o (None, None) si no existe."""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None, None
+        raise
+    return response["Body"].read().decode("utf-8"), response["ETag"]
+
+
+def put_conditional(s3, bucket, key, body, etag, content_type):
+    """Escribe solo si el objeto no cambió desde que se leyó (o si no existía)."""
+    params = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=body.encode("utf-8"),
+        ContentType=content_type,
+        **params
+    )
+
+
+# ════════════════════════════════════════
+# MANIFEST
+# ════════════════════════════════════════
+
+def load_manifest(s3, bucket):
+    """Manifest de particiones. Migra operations_full.csv la primera vez."""
+    text, _ = get_with_etag(s3, bucket, MANIFEST_KEY)
+    if text is not None:
+        return json.loads(text)
+
+    legacy, _ = get_with_etag(s3, bucket, LEGACY_KEY)
+    if legacy:
+        return migrate_legacy(s3, bucket, legacy)
+
+    return {"partitions": {}}
+
+
+def add_partitions(s3, bucket, months):
+    """Registra meses en el manifest (escritura condicional con reintento).
+
+    Une con lo que haya: una migración y una escritura concurrentes no se
+    pisan. Retorna el manifest resultante.
+    """
+    for _ in range(MAX_RETRIES):
+        text, etag = get_with_etag(s3, bucket, MANIFEST_KEY)
+        manifest = json.loads(text) if text else {"partitions": {}}
+        missing = [m for m in months if m not in manifest["partitions"]]
+        if not missing and text is not None:
+            return manifest
+
+        for month in missing:
+            manifest["partitions"][month] = partition_key(month)
+        manifest["partitions"] = dict(sorted(manifest["partitions"].items()))
+        try:
+            put_conditional(s3, bucket, MANIFEST_KEY, json.dumps(manifest, indent=2), etag, "application/json")
+            return manifest
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+
+    raise RuntimeError("No se pudo actualizar el manifest del historial")
+
+
+def add_partition(s3, bucket, month):
+    """Registra un mes en el manifest."""
+    return add_partitions(s3, bucket, [month])
+
+
+def migrate_legacy(s3, bucket, legacy):
+    """Reparte operations_full.csv en particiones mensuales.
+
+    Todo con IfNoneMatch: si otra invocación ya migró (o ya añadió un trade
+    a un mes con IfMatch), su partición se respeta en vez de sobrescribirla.
+    """
+    months = {}
+    for line in legacy.strip().split("\n")[1:]:
+        parts = line.split(",")
+        if len(parts) < 5:
+            continue
+        months.setdefault(parts[4][:7], []).append(line + "\n")
+
+    for month, rows in months.items():
+        try:
+            put_conditional(s3, bucket, partition_key(month), HEADER + "".join(rows), None, "text/plain")
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+            logger.warning(f"⚠️ {partition_key(month)} ya existe, se conserva")
+
+    manifest = add_partitions(s3, bucket, sorted(months))
+    logger.info(f"✅ Historial migrado a {len(months)} particiones mensuales")
+    return manifest
+
+
+# ════════════════════════════════════════
+# API
+# ════════════════════════════════════════
+
+def append_trade(s3, bucket, trade):
+    """Añade un trade a la partición de su mes. Solo lee/escribe ese mes."""
+    month = trade["date_close"][:7]
+    key = partition_key(month)
+    row = trade_to_row(trade)
+
+    # Migrar antes de la primera escritura para no perder el CSV antiguo.
+    # El mes se registra antes de escribirlo: si esto falla no queda una
+    # partición con trades que el manifest no lista
+    manifest = load_manifest(s3, bucket)
+    if month not in manifest["partitions"]:
+        add_partition(s3, bucket, month)
+
+    for attempt in range(MAX_RETRIES):
+        text, etag = get_with_etag(s3, bucket, key)
+        try:
+            put_conditional(s3, bucket, key, (text or HEADER) + row, etag, "text/plain")
+            break
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+            logger.warning(f"⚠️ Conflicto escribiendo {key}, reintentando ({attempt + 1})")
+    else:
+        raise RuntimeError(f"No se pudo guardar el trade en {key}")
+
+
+def select_months(manifest, start=None, end=None):
+    """Meses del manifest que solapan con [start, end] (fechas YYYY-MM-DD)."""
+    months = sorted(manifest["partitions"])
+    if start:
+        months = [m for m in months if m >= start[:7]]
+    if end:
+        months = [m for m in months if m <= end[:7]]
+    return months
+
+
+def load_history_text(s3, bucket, start=None, end=None):
+    """CSV (con cabecera) de los trades en el rango pedido.
+
+    Solo descarga las particiones de los meses necesarios, en paralelo.
+    """
+    manifest = load_manifest(s3, bucket)
+    months = select_months(manifest, start, end)
+    if not months:
+        return ""
+
+    def fetch(month):
+        text, _ = get_with_etag(s3, bucket, manifest["partitions"][month])
+        return text or ""
+
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as pool:
+        texts = list(pool.map(fetch, months))
+
+    rows = []
+    for text in texts:
+        for line in text.strip().split("\n")[1:]:
+            date_close = line.split(",")[4] if line.count(",") >= 4 else ""
+            if (start and date_close < start) or (end and date_close > end):
+                continue
+            rows.append(line + "\n")
+
+    return HEADER + "".join(rows)